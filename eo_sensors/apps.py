@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class EOSensorsConfig(AppConfig):
     name = 'eo_sensors'
     verbose_name = 'EO Sensors'
+
+    def ready(self):
+        import eo_sensors.signals
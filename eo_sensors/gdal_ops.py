@@ -0,0 +1,225 @@
+"""
+GDAL operations run in-process through the GDAL Python bindings, instead of
+launching GDAL command line utilities.
+
+All operations take source datasets either as paths or as open
+`gdal.Dataset` objects, so they can be chained: use an empty destination
+path ("") with the VRT or MEM formats to get a virtual dataset that is only
+read when the next operation materializes it.  Operations return the output
+dataset if it is virtual, or the output path otherwise (after closing the
+dataset, so it is completely written).
+
+"""
+import logging
+import os
+import sys
+from contextlib import contextmanager
+
+from osgeo import gdal, ogr, osr
+
+gdal.UseExceptions()
+ogr.UseExceptions()
+
+# Configure logger
+logger = logging.getLogger(__name__)
+out_handler = logging.StreamHandler(sys.stdout)
+out_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+out_handler.setLevel(logging.INFO)
+logger.addHandler(out_handler)
+logger.setLevel(logging.INFO)
+
+VIRTUAL_FORMATS = ("VRT", "MEM")
+
+DEFAULT_CREATION_OPTIONS = ["COMPRESS=DEFLATE", "TILED=YES"]
+
+
+def warp(
+    src,
+    dst,
+    *,
+    cutline=None,
+    crop_to_cutline=False,
+    format="GTiff",
+    creation_options=DEFAULT_CREATION_OPTIONS,
+    **kwargs,
+):
+    """
+    Warp +src+ (a path, a dataset, or a list of them) into +dst+, like
+    `gdalwarp`.  If +cutline+ (a vector file) is given, pixels outside of its
+    geometries are masked, and with +crop_to_cutline+, the output extent is
+    cropped to it.  Extra keyword arguments are passed to `gdal.WarpOptions`.
+
+    """
+    srcs = src if isinstance(src, (list, tuple)) else [src]
+    logger.info("Warp %s into %s", _names(srcs), dst or "memory")
+    _prepare(dst, format)
+    options = gdal.WarpOptions(
+        format=format,
+        cutlineDSName=cutline,
+        cropToCutline=crop_to_cutline,
+        creationOptions=_creation_options(format, creation_options),
+        multithread=True,
+        warpOptions=["NUM_THREADS=ALL_CPUS"],
+        **kwargs,
+    )
+    ds = gdal.Warp(dst, [_open(s) for s in srcs], options=options)
+    return _finish(ds, dst, format)
+
+
+def clip(src, dst, *, aoi, **kwargs):
+    """Clip +src+ to the geometries of +aoi+ (a vector file) into +dst+"""
+    return warp(src, dst, cutline=aoi, crop_to_cutline=True, **kwargs)
+
+
+def translate(
+    src,
+    dst,
+    *,
+    format="GTiff",
+    creation_options=DEFAULT_CREATION_OPTIONS,
+    **kwargs,
+):
+    """
+    Convert +src+ into +dst+, like `gdal_translate`.  Keyword arguments are
+    passed to `gdal.TranslateOptions` (e.g. outputType, scaleParams, noData,
+    bandList).
+
+    """
+    logger.info("Translate %s into %s", _names([src]), dst or "memory")
+    _prepare(dst, format)
+    options = gdal.TranslateOptions(
+        format=format,
+        creationOptions=_creation_options(format, creation_options),
+        **kwargs,
+    )
+    ds = gdal.Translate(dst, _open(src), options=options)
+    return _finish(ds, dst, format)
+
+
+def build_vrt(srcs, dst="", *, separate=False, **kwargs):
+    """
+    Build a virtual mosaic of +srcs+, like `gdalbuildvrt`.  With +separate+,
+    each source is a band of the output.  If +dst+ is empty, the VRT is kept
+    in memory.  Keyword arguments are passed to `gdal.BuildVRTOptions`.
+
+    """
+    logger.info("Build VRT of %s into %s", _names(srcs), dst or "memory")
+    _prepare(dst, "VRT")
+    options = gdal.BuildVRTOptions(separate=separate, **kwargs)
+    ds = gdal.BuildVRT(dst, [_open(s) for s in srcs], options=options)
+    return _finish(ds, dst, "VRT")
+
+
+def build_overviews(
+    path,
+    levels=(2, 4, 8, 16),
+    *,
+    resampling="nearest",
+    compress="JPEG",
+    photometric=None,
+    interleave="PIXEL",
+):
+    """Add internal compressed overviews to raster at +path+, like
+    `gdaladdo`"""
+    logger.info("Add internal %s compressed overviews to %s", compress, path)
+    config = dict(COMPRESS_OVERVIEW=compress, INTERLEAVE_OVERVIEW=interleave)
+    if photometric:
+        config["PHOTOMETRIC_OVERVIEW"] = photometric
+    with config_options(config):
+        ds = gdal.Open(path, gdal.GA_Update)
+        ds.BuildOverviews(resampling.upper(), list(levels))
+        ds = None
+    return path
+
+
+def polygonize(src, dst, *, band=1, field="DN", format="GeoJSON", epsg=None):
+    """
+    Polygonize band +band+ of +src+ into vector file +dst+, like
+    `gdal_polygonize.py`.  Pixel values are stored on field +field+.  If
+    +epsg+ is given, features are reprojected to it.
+
+    """
+    logger.info("Polygonize %s into %s", _names([src]), dst)
+    src_ds = _open(src)
+    src_band = src_ds.GetRasterBand(band)
+    srs = src_ds.GetSpatialRef()
+
+    driver = ogr.GetDriverByName(format)
+    if os.path.exists(dst):
+        driver.DeleteDataSource(dst)
+
+    if epsg:
+        # Polygonize into memory first, and then reproject while copying
+        # features into destination
+        dst_srs = osr.SpatialReference()
+        dst_srs.ImportFromEPSG(epsg)
+        dst_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        mem_ds = ogr.GetDriverByName("Memory").CreateDataSource("")
+        layer = _create_layer(mem_ds, srs, field)
+        gdal.Polygonize(src_band, src_band.GetMaskBand(), layer, 0, [])
+        options = gdal.VectorTranslateOptions(format=format, dstSRS=dst_srs)
+        gdal.VectorTranslate(dst, mem_ds, options=options)
+    else:
+        dst_ds = driver.CreateDataSource(dst)
+        layer = _create_layer(dst_ds, srs, field)
+        gdal.Polygonize(src_band, src_band.GetMaskBand(), layer, 0, [])
+        dst_ds = None
+    return dst
+
+
+@contextmanager
+def config_options(options):
+    """Set GDAL configuration +options+ temporarily"""
+    previous = {key: gdal.GetConfigOption(key) for key in options}
+    for key, value in options.items():
+        gdal.SetConfigOption(key, str(value))
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            gdal.SetConfigOption(key, value)
+
+
+def _create_layer(ds, srs, field):
+    layer = ds.CreateLayer("polygons", srs=srs, geom_type=ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn(field, ogr.OFTInteger))
+    return layer
+
+
+def _open(src):
+    if isinstance(src, gdal.Dataset):
+        return src
+    return gdal.Open(src)
+
+
+def _names(srcs):
+    return ", ".join(
+        s.GetDescription() or "<memory>" if isinstance(s, gdal.Dataset) else str(s)
+        for s in srcs
+    )
+
+
+def _prepare(dst, format):
+    if not dst or format == "MEM":
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    if os.path.exists(dst):
+        os.unlink(dst)
+
+
+def _creation_options(format, creation_options):
+    # Virtual datasets have no creation options
+    if format in VIRTUAL_FORMATS:
+        return []
+    return list(creation_options or [])
+
+
+def _finish(ds, dst, format):
+    if format in VIRTUAL_FORMATS or not dst:
+        if dst:
+            # Write VRT file, and keep dataset open for chaining
+            ds.FlushCache()
+        return ds
+    ds.FlushCache()
+    ds = None
+    return dst
@@ -0,0 +1,380 @@
+import json
+import multiprocessing as mp
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from queue import Empty
+
+import numpy as np
+import psutil
+import rasterio
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from eo_sensors.tiles import generate_tiles
+from rasterio.enums import ColorInterp, Resampling
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+CRS = "EPSG:32718"
+# Upper-left corner of synthetic rasters (around Lima)
+ORIGIN = (280000, 8680000)
+# Class colors of synthetic categorical rasters (0 is transparent)
+COLORMAP = {
+    0: (0, 0, 0, 0),
+    1: (199, 0, 57, 255),
+    2: (237, 221, 83, 255),
+    3: (42, 123, 155, 255),
+    4: (51, 160, 44, 255),
+}
+KINDS = ["rgb", "rgba", "paletted"]
+# Seconds between samples of the RSS of benchmark processes
+RSS_SAMPLE_INTERVAL = 0.1
+ENGINES = ["native", "mbtiles", "gdal2tiles"]
+
+
+def zoom_range(value):
+    min_zoom, max_zoom = value.split("-")
+    return int(min_zoom), int(max_zoom)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark tile generation on synthetic rasters, across raster types, "
+        "tilers, zoom ranges and number of processes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=4096,
+            help="width and height of synthetic rasters, in pixels",
+        )
+        parser.add_argument(
+            "--pixel-size",
+            type=float,
+            default=10.0,
+            help="pixel size of synthetic rasters, in meters",
+        )
+        parser.add_argument(
+            "--kinds",
+            nargs="+",
+            choices=KINDS,
+            default=KINDS,
+            help="rgb (TCI-like), rgba (expanded categorical mask) or paletted",
+        )
+        parser.add_argument(
+            "--engines",
+            nargs="+",
+            choices=ENGINES,
+            default=["native", "mbtiles"],
+            help="native tiler (into a directory or a MBTiles archive) or gdal2tilesp.py",
+        )
+        parser.add_argument(
+            "--jobs",
+            nargs="+",
+            type=int,
+            default=sorted({1, mp.cpu_count()}),
+            help="number of processes",
+        )
+        parser.add_argument(
+            "--levels",
+            nargs="+",
+            type=zoom_range,
+            default=[(6, 14)],
+            help="zoom ranges (e.g. 6-12 6-14)",
+        )
+        parser.add_argument("--repeat", type=int, default=1)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--work-dir",
+            help="directory for rasters and tiles (default: a temporary directory)",
+        )
+        parser.add_argument("--output", help="write results as JSON to this file")
+
+    def handle(self, *args, **options):
+        work_dir = options["work_dir"] or tempfile.mkdtemp(prefix="benchmark_tiles_")
+        os.makedirs(work_dir, exist_ok=True)
+
+        results = []
+        try:
+            for kind in options["kinds"]:
+                src_path = os.path.join(work_dir, f"{kind}.tif")
+                self.stdout.write(
+                    f"Write synthetic {kind} raster of {options['size']}x{options['size']} pixels"
+                )
+                write_synthetic_raster(
+                    src_path,
+                    kind,
+                    size=options["size"],
+                    pixel_size=options["pixel_size"],
+                    seed=options["seed"],
+                )
+
+                for levels in options["levels"]:
+                    for engine in options["engines"]:
+                        for n_jobs in options["jobs"]:
+                            for _ in range(options["repeat"]):
+                                result = dict(
+                                    kind=kind,
+                                    engine=engine,
+                                    levels=list(levels),
+                                    jobs=n_jobs,
+                                    **run_isolated(
+                                        engine,
+                                        src_path,
+                                        os.path.join(work_dir, "tiles"),
+                                        levels=levels,
+                                        n_jobs=n_jobs,
+                                    ),
+                                )
+                                self.report(result)
+                                results.append(result)
+        finally:
+            if not options["work_dir"]:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+
+    def report(self, result):
+        name = "{kind:<8} {engine:<10} z{levels[0]}-{levels[1]:<3} {jobs:>3} jobs".format(
+            **result
+        )
+        if "error" in result:
+            self.stdout.write(self.style.ERROR(f"{name}: {result['error']}"))
+            return
+        self.stdout.write(
+            f"{name}: {result['tiles']:>7} tiles in {result['seconds']:8.2f}s "
+            f"({result['tiles_per_second']:8.1f} tiles/s), "
+            f"{result['bytes'] / 1024 ** 2:8.1f} MB written, "
+            f"peak RSS {result['peak_rss'] / 1024 ** 2:7.1f} MB"
+        )
+        for z in result["zooms"]:
+            self.stdout.write(
+                f"    zoom {z['zoom']:>7}: {z['tiles']:>7} tiles, {z['seconds']:8.2f}s"
+            )
+
+
+def run_isolated(engine, src_path, dst, **kwargs):
+    """Run benchmark in a new process, so that peak RSS is measured only for
+    this run (and its worker processes)"""
+    queue = mp.Queue()
+    proc = mp.Process(target=_run_and_measure, args=(queue, engine, src_path, dst), kwargs=kwargs)
+    proc.start()
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except Empty:
+            if not proc.is_alive():
+                # Killed (e.g. out of memory) or crashed, without a result
+                error = f"Benchmark process died (exit code {proc.exitcode})"
+                result = dict(error=error)
+                break
+    proc.join()
+    return result
+
+
+def _run_and_measure(queue, engine, src_path, dst, **kwargs):
+    # Worker processes come and go, so the peak of their combined RSS is only
+    # known by sampling the whole process tree while the benchmark runs
+    peak_rss = 0
+    stop = threading.Event()
+
+    def sample_rss():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss, _tree_rss(psutil.Process()))
+            if stop.wait(RSS_SAMPLE_INTERVAL):
+                break
+
+    monitor = threading.Thread(target=sample_rss, daemon=True)
+    monitor.start()
+    try:
+        result = run(engine, src_path, dst, **kwargs)
+    except Exception as err:
+        result = dict(error=str(err))
+    finally:
+        stop.set()
+        monitor.join()
+        if os.path.isdir(dst):
+            shutil.rmtree(dst)
+        elif os.path.exists(dst):
+            os.remove(dst)
+    result["peak_rss"] = peak_rss
+    queue.put(result)
+
+
+def _tree_rss(proc):
+    """Combined RSS of process +proc+ and all its descendants, in bytes"""
+    total = 0
+    for p in [proc, *proc.children(recursive=True)]:
+        try:
+            total += p.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+def run(engine, src_path, dst, *, levels, n_jobs):
+    """Generate tiles of +src_path+ into +dst+ and return number of tiles,
+    elapsed time, bytes written and time per zoom level"""
+    start = time.time()
+    if engine == "gdal2tiles":
+        stats_path = f"{dst}.json"
+        subprocess.run(
+            [
+                sys.executable,
+                settings.GDAL2TILES_BIN_PATH,
+                "--processes",
+                str(n_jobs),
+                "--skip-blank",
+                "--stats",
+                stats_path,
+                "-w",
+                "none",
+                "-n",
+                "-z",
+                f"{levels[0]}-{levels[1]}",
+                src_path,
+                dst,
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        seconds = time.time() - start
+        with open(stats_path) as f:
+            stats = json.load(f)
+        os.remove(stats_path)
+        tiles = sum(1 for _ in _files(dst))
+        # Overviews inside each batch are built in the same wave, so time
+        # is reported for the whole range of zoom levels of a wave
+        zooms = [
+            dict(zoom="{}-{}".format(*w["zooms"]), tiles=w["tiles"], seconds=w["seconds"])
+            for w in stats["waves"]
+        ]
+    else:
+        stats = generate_tiles(
+            src_path,
+            dst,
+            levels=levels,
+            n_jobs=n_jobs,
+            format="mbtiles" if engine == "mbtiles" else "dir",
+        )
+        seconds = time.time() - start
+        tiles = stats["tiles"]
+        # Time spent on each zoom level, summed over all processes
+        zooms = [
+            dict(zoom=str(z), tiles=s["tiles"], seconds=s["seconds"])
+            for z, s in stats["zooms"].items()
+        ]
+
+    return dict(
+        tiles=tiles,
+        seconds=seconds,
+        tiles_per_second=tiles / seconds if seconds else 0,
+        bytes=_disk_usage(dst),
+        zooms=zooms,
+    )
+
+
+def write_synthetic_raster(path, kind, *, size, pixel_size, seed):
+    """Write a synthetic raster of +size+ x +size+ pixels in EPSG:32718.
+
+    Rasters are clipped to an ellipse (the rest is transparent), like our
+    AOI-clipped products.  Categorical rasters are mostly transparent, with
+    large patches of a few classes.
+
+    """
+    rng = np.random.default_rng(seed)
+    # Patches of 128x128 pixels
+    patch_size = 128
+    patches = size // patch_size + 1
+    colors = rng.integers(1, 256, (3, patches, patches), dtype=np.uint8)
+    classes = rng.choice(
+        np.arange(len(COLORMAP)), (patches, patches), p=[0.6, 0.1, 0.1, 0.1, 0.1]
+    ).astype(np.uint8)
+    lut = np.array([COLORMAP[i] for i in range(len(COLORMAP))], dtype=np.uint8)
+
+    profile = dict(
+        driver="GTiff",
+        width=size,
+        height=size,
+        crs=CRS,
+        transform=from_origin(*ORIGIN, pixel_size, pixel_size),
+        dtype="uint8",
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+        compress="deflate",
+    )
+    if kind == "rgb":
+        profile.update(count=3, nodata=0)
+    elif kind == "rgba":
+        profile.update(count=4)
+    else:
+        profile.update(count=1, nodata=0)
+
+    cols = np.arange(size)
+    with rasterio.open(path, "w", **profile) as dst:
+        for row_off in range(0, size, 256):
+            height = min(256, size - row_off)
+            rows = np.arange(row_off, row_off + height)[:, np.newaxis]
+            inside = ((rows - size / 2) / (0.45 * size)) ** 2 + (
+                (cols - size / 2) / (0.4 * size)
+            ) ** 2 <= 1
+            patch_rows, patch_cols = rows // patch_size, cols // patch_size
+            window = Window(0, row_off, size, height)
+
+            if kind == "rgb":
+                noise = rng.integers(0, 32, (3, height, size), dtype=np.uint8)
+                img = colors[:, patch_rows, patch_cols] // 2 + noise
+                img = np.maximum(img, 1) * inside
+                dst.write(img.astype(np.uint8), window=window)
+            else:
+                img = classes[patch_rows, patch_cols] * inside
+                if kind == "rgba":
+                    dst.write(lut[img].transpose(2, 0, 1), window=window)
+                else:
+                    dst.write(img.astype(np.uint8), 1, window=window)
+
+        if kind == "rgba":
+            dst.colorinterp = [
+                ColorInterp.red,
+                ColorInterp.green,
+                ColorInterp.blue,
+                ColorInterp.alpha,
+            ]
+        if kind == "paletted":
+            dst.write_colormap(1, COLORMAP)
+            resampling = Resampling.mode
+        else:
+            resampling = Resampling.average
+        dst.build_overviews([2, 4, 8, 16], resampling)
+
+
+def _files(path):
+    if os.path.isfile(path):
+        yield path
+        return
+    for root, _, files in os.walk(path):
+        for name in files:
+            yield os.path.join(root, name)
+
+
+def _disk_usage(path):
+    # Count hard-linked files (deduplicated tiles) only once
+    seen = set()
+    total = 0
+    for file in _files(path):
+        st = os.stat(file)
+        if (st.st_dev, st.st_ino) not in seen:
+            seen.add((st.st_dev, st.st_ino))
+            total += st.st_size
+    return total
@@ -0,0 +1,148 @@
+import json
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import rasterio
+from django.core.management.base import BaseCommand
+from eo_sensors.utils.vectorize import parallel_union, polygonize_blocks
+from rasterio.transform import from_origin
+from shapely.ops import unary_union
+
+CRS = "EPSG:32718"
+# Upper-left corner of synthetic rasters (around Lima)
+ORIGIN = (280000, 8680000)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark merging of polygonized coverage masks: a single union "
+        "against the parallel divide-and-conquer union, on synthetic rasters"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=4096,
+            help="width and height of synthetic raster, in pixels",
+        )
+        parser.add_argument(
+            "--patch-size",
+            type=int,
+            default=4,
+            help="size of class patches, in pixels (smaller means more polygons)",
+        )
+        parser.add_argument(
+            "--classes", type=int, default=5, help="number of classes (besides 0)"
+        )
+        parser.add_argument(
+            "--jobs",
+            nargs="+",
+            type=int,
+            default=sorted({1, mp.cpu_count()}),
+            help="number of processes",
+        )
+        parser.add_argument("--repeat", type=int, default=1)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--raster",
+            help="benchmark on this raster instead of a synthetic one",
+        )
+        parser.add_argument("--output", help="write results as JSON to this file")
+
+    def handle(self, *args, **options):
+        work_dir = tempfile.mkdtemp(prefix="benchmark_union_")
+        results = []
+        try:
+            src_path = options["raster"]
+            if not src_path:
+                src_path = os.path.join(work_dir, "mask.tif")
+                self.stdout.write(
+                    f"Write synthetic raster of {options['size']}x{options['size']} pixels"
+                )
+                write_synthetic_raster(
+                    src_path,
+                    size=options["size"],
+                    patch_size=options["patch_size"],
+                    classes=options["classes"],
+                    seed=options["seed"],
+                )
+
+            start = time.time()
+            values, geoms = polygonize_blocks(src_path)
+            self.stdout.write(
+                f"Polygonized into {len(geoms)} polygons in {time.time() - start:.2f}s"
+            )
+
+            for value in np.unique(values):
+                value_geoms = geoms[values == value]
+                baseline = None
+                for n_jobs in options["jobs"]:
+                    for _ in range(options["repeat"]):
+                        start = time.time()
+                        if n_jobs == 1:
+                            geom = unary_union(list(value_geoms))
+                        else:
+                            geom = parallel_union(
+                                value_geoms, n_jobs=n_jobs, min_size=0
+                            )
+                        seconds = time.time() - start
+                        if baseline is None:
+                            baseline = dict(geom=geom, seconds=seconds)
+                        result = dict(
+                            value=int(value),
+                            polygons=len(value_geoms),
+                            jobs=n_jobs,
+                            seconds=seconds,
+                            speedup=baseline["seconds"] / seconds if seconds else 0,
+                            equal=geom.equals(baseline["geom"]),
+                        )
+                        self.report(result)
+                        results.append(result)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+
+    def report(self, result):
+        line = (
+            "value {value:>3}: {polygons:>8} polygons, {jobs:>3} jobs: "
+            "{seconds:8.2f}s ({speedup:5.2f}x)".format(**result)
+        )
+        if result["equal"]:
+            self.stdout.write(line)
+        else:
+            self.stdout.write(self.style.ERROR(f"{line}, result differs!"))
+
+
+def write_synthetic_raster(path, *, size, patch_size, classes, seed):
+    """Write a synthetic categorical raster of +size+ x +size+ pixels, made of
+    square patches of +patch_size+ pixels of random classes (0 to +classes+)"""
+    rng = np.random.default_rng(seed)
+    patches = size // patch_size + 1
+    img = rng.integers(0, classes + 1, (patches, patches), dtype=np.uint8)
+    img = np.repeat(np.repeat(img, patch_size, axis=0), patch_size, axis=1)
+    img = img[:size, :size]
+
+    profile = dict(
+        driver="GTiff",
+        width=size,
+        height=size,
+        count=1,
+        crs=CRS,
+        transform=from_origin(*ORIGIN, 0.7, 0.7),
+        dtype="uint8",
+        nodata=0,
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+        compress="deflate",
+    )
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(img, 1)
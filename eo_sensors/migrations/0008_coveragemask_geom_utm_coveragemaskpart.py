@@ -0,0 +1,59 @@
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Fill projected geometries and parts of existing masks (new or updated masks
+# are handled by eo_sensors.signals)
+BACKFILL_SQL = """
+    UPDATE eo_sensors_coveragemask SET geom_utm = ST_Multi(ST_Transform(geom, 32718));
+    INSERT INTO eo_sensors_coveragemaskpart (mask_id, geom)
+    SELECT m.id, d.geom
+    FROM eo_sensors_coveragemask AS m,
+        LATERAL ST_Subdivide(m.geom_utm, 256) AS s(geom),
+        LATERAL ST_Dump(s.geom) AS d
+    WHERE ST_GeometryType(d.geom) = 'ST_Polygon';
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eo_sensors", "0007_fix_coverage_mask_and_measurements_dates"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="coveragemask",
+            name="geom_utm",
+            field=django.contrib.gis.db.models.fields.MultiPolygonField(
+                blank=True, null=True, srid=32718
+            ),
+        ),
+        migrations.CreateModel(
+            name="CoverageMaskPart",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "geom",
+                    django.contrib.gis.db.models.fields.PolygonField(srid=32718),
+                ),
+                (
+                    "mask",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="parts",
+                        to="eo_sensors.coveragemask",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
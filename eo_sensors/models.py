@@ -1,3 +1,5 @@
+import os
+
 from django.conf import settings
 from django.contrib.gis.db import models
 from django.db.models import JSONField
@@ -32,12 +34,28 @@ class Raster(models.Model):
         return f"[{self.source}] {self.date} {self.name}"
 
     def tiles_url(self):
-        return f"{settings.TILE_SERVER_URL}{self.path()}" + "{z}/{x}/{y}.png"
+        # Tiles are cached by clients, so include the version in the URL
+        query = f"?v={self.tiles_version()}"
+        if settings.DYNAMIC_TILES:
+            url = f"{settings.DYNAMIC_TILE_SERVER_URL}{self.pk}/tiles/"
+            return url + "{z}/{x}/{y}.png" + query
+        if settings.TILES_FORMAT == "mbtiles":
+            url = f"{settings.DYNAMIC_TILE_SERVER_URL}{self.pk}/mbtiles/"
+            return url + "{z}/{x}/{y}.png" + query
+        return f"{settings.TILE_SERVER_URL}{self.path()}" + "{z}/{x}/{y}.png" + query
+
+    def tiles_version(self):
+        """Version of the tiles, which changes whenever the raster is updated
+        (e.g. re-processed for the same date)"""
+        return int(self.updated_at.timestamp())
 
     def path(self):
         date_str = self.date.strftime("%Y%m%d")
         return f"{self.source}/{self.slug}/{date_str}/"
 
+    def tiles_archive_path(self):
+        return os.path.join(settings.TILES_DIR, f"{self.path()[:-1]}.mbtiles")
+
 
 class CoverageMask(models.Model):
     date = models.DateField(null=True)
@@ -45,6 +63,9 @@ class CoverageMask(models.Model):
     kind = models.CharField(max_length=2, blank=True, null=True)
     raster = models.ForeignKey(Raster, on_delete=models.CASCADE)
     geom = models.MultiPolygonField()
+    # Copy of geom projected to UTM 18S, for area computations.  It is
+    # updated, along with parts, when the mask is saved (see signals).
+    geom_utm = models.MultiPolygonField(srid=32718, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -59,6 +80,23 @@ class CoverageMask(models.Model):
         )
 
 
+class CoverageMaskPart(models.Model):
+    """
+    A piece of the (projected) geometry of a CoverageMask, of at most
+    `MAX_VERTICES` vertices, as split by ST_Subdivide.  Intersections with
+    other geometries only need to go through the few small pieces that
+    overlap them, found with the spatial index.
+
+    """
+
+    MAX_VERTICES = 256
+
+    mask = models.ForeignKey(
+        CoverageMask, related_name="parts", on_delete=models.CASCADE
+    )
+    geom = models.PolygonField(srid=32718)
+
+
 class CoverageRaster(models.Model):
     raster = models.ForeignKey(Raster, on_delete=models.CASCADE)
     cov_rast = models.RasterField(srid=32718)
@@ -0,0 +1,41 @@
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from eo_sensors.models import CoverageMask, CoverageMaskPart, Raster
+from eo_sensors.tile_storage import delete_raster_tiles
+
+UPDATE_MASK_GEOM_UTM_SQL = """
+    UPDATE eo_sensors_coveragemask
+    SET geom_utm = ST_Multi(ST_Transform(geom, 32718))
+    WHERE id = %(mask_id)s
+"""
+
+DELETE_MASK_PARTS_SQL = """
+    DELETE FROM eo_sensors_coveragemaskpart WHERE mask_id = %(mask_id)s
+"""
+
+INSERT_MASK_PARTS_SQL = """
+    INSERT INTO eo_sensors_coveragemaskpart (mask_id, geom)
+    SELECT m.id, d.geom
+    FROM eo_sensors_coveragemask AS m,
+        LATERAL ST_Subdivide(m.geom_utm, %(max_vertices)s) AS s(geom),
+        LATERAL ST_Dump(s.geom) AS d
+    WHERE m.id = %(mask_id)s AND ST_GeometryType(d.geom) = 'ST_Polygon'
+"""
+
+
+@receiver(post_save, sender=CoverageMask)
+def update_mask_projected_geoms(sender, instance, **kwargs):
+    params = dict(mask_id=instance.pk, max_vertices=CoverageMaskPart.MAX_VERTICES)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(UPDATE_MASK_GEOM_UTM_SQL, params)
+        cursor.execute(DELETE_MASK_PARTS_SQL, params)
+        cursor.execute(INSERT_MASK_PARTS_SQL, params)
+
+
+@receiver(post_delete, sender=Raster)
+def delete_tiles(sender, instance, **kwargs):
+    # Files can not be restored, so only delete them when the deletion of the
+    # raster is committed
+    transaction.on_commit(lambda: delete_raster_tiles(instance))
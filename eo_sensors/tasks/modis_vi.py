@@ -9,28 +9,34 @@ import time
 from datetime import datetime, timedelta
 from glob import glob
 
-import geopandas as gpd
 import numpy as np
 import rasterio
-import shapely.wkt
 from django.conf import settings
-from django.contrib.gis.gdal import DataSource
-from django.contrib.gis.geos import GEOSGeometry
-from django.core.files import File
-from django.db import DatabaseError, connection
-from eo_sensors.models import CoverageMask, CoverageMeasurement, Raster, Sources
+from eo_sensors import gdal_ops
+from eo_sensors.models import CoverageMask, Raster, Sources
 from eo_sensors.tasks import APP_DATA_DIR, TASKS_DATA_DIR
-from eo_sensors.utils import run_otb_command, create_raster_tiles, write_rgb_raster, hex_to_dec_string
+from eo_sensors.utils import (
+    run_otb_command,
+    create_raster_tiles,
+    write_rgb_raster,
+    hex_to_dec_string,
+    write_paletted_raster,
+    save_raster_file,
+    generate_measurements,
+    generate_raster_measurements,
+    multipolygon_to_geos,
+)
 from eo_sensors.utils.colormap import apply_cmap, rescale_to_byte
+from eo_sensors.utils.pipeline import process_blocks
+from eo_sensors.utils.srtm import elevation_mask
+from eo_sensors.utils.step_cache import cached_step
+from eo_sensors.utils.vectorize import polygonize
 from jobs.utils import job
 from satlomasproc.modis_vi import (
     download_modis_vi_images,
     extract_subdatasets_as_gtiffs,
     extract_date_from_modis_filename,
 )
-from satlomasproc.utils import run_command
-from scopes.models import Scope
-from shapely.ops import unary_union
 from skimage import exposure
 
 # Configure loggers
@@ -102,7 +108,13 @@ def process_period(job):
     if found:
         create_rgb_rasters(scene_date, date_from, date_to)
         create_masks(scene_date, date_from, date_to)
-        generate_measurements(scene_date)
+        coverage_masks = CoverageMask.objects.filter(
+            date=scene_date, source=Sources.MODIS_VI
+        )
+        if settings.EO_SENSORS_MEASUREMENTS_ENGINE == "raster":
+            generate_raster_measurements_from_mask(coverage_masks, date_from, date_to)
+        else:
+            generate_measurements(coverage_masks)
         clean_temp_files()
 
 
@@ -128,138 +140,71 @@ def download_and_process(date_from, date_to):
     scene_date = extract_date_from_modis_filename(last_scene)
     logger.info(f"Going to use latest scene: {last_scene} ({scene_date})")
 
-    logger.info("Clip SRTM to extent")
-    srtm_clipped_path = clip_srtm_to_extent()
-    lomas_mask = calculate_srtm_mask(srtm_clipped_path)
+    lomas_mask_path = lomas_mask()
 
     logger.info("Clip NDVI to extent")
     os.makedirs(MVI_CLIP_DIR, exist_ok=True)
     name, _ = os.path.splitext(os.path.basename(last_scene))
     ndvi_path = glob(os.path.join(MVI_TIF_DIR, f"{name}_ndvi.tif"))[0]
-    ndvi_clipped_path = os.path.join(MVI_CLIP_DIR, os.path.basename(ndvi_path))
-    if os.path.exists(ndvi_clipped_path):
-        os.unlink(ndvi_clipped_path)
-    run_command(
-        "{gdal_bin_path}/gdalwarp -of GTiff -cutline {extent} -crop_to_cutline {src} {dst}".format(
-            gdal_bin_path=settings.GDAL_BIN_PATH,
-            extent=EXTENT_PATH,
-            src=ndvi_path,
-            dst=ndvi_clipped_path,
-        )
-    )
+    # Clipped raster is only read by Superimpose, so keep it as a warped VRT
+    ndvi_clipped_path = os.path.join(MVI_CLIP_DIR, f"{name}_ndvi.vrt")
+    gdal_ops.clip(ndvi_path, ndvi_clipped_path, aoi=EXTENT_PATH, format="VRT")
 
-    logger.info("Superimpose clipped SRTM and NDVI rasters to align them")
+    logger.info("Superimpose NDVI raster to lomas mask to align them")
     os.makedirs(MVI_SUPERIMP_DIR, exist_ok=True)
-    ndvi_superimp_path = os.path.join(
-        MVI_SUPERIMP_DIR, os.path.basename(ndvi_clipped_path)
-    )
+    ndvi_superimp_path = os.path.join(MVI_SUPERIMP_DIR, os.path.basename(ndvi_path))
     run_otb_command(
         "otbcli_Superimpose -inr {inr} -inm {inm} -out {out}".format(
-            inr=srtm_clipped_path,
+            inr=lomas_mask_path,
             inm=ndvi_clipped_path,
             out=ndvi_superimp_path,
         )
     )
 
-    with rasterio.open(ndvi_superimp_path) as src:
-        modis_ndvi = src.read(1)
-        modis_meta = src.profile.copy()
-
-    modis_meta["nodata"] = 0
-    modis_meta["dtype"] = np.uint8
-
-    logger.info("Build final vegetation mask")
-    vegetacion_mask = modis_ndvi > THRESHOLD
-    verde_mask = vegetacion_mask & lomas_mask
-    verde = np.copy(modis_ndvi)
-    verde[~verde_mask] = 0
-
-    logger.info("Build scaled NDVI mask")
-    verde_rango = np.copy(verde)
-    verde_rango[(verde >= (0.2 / FACTOR_ESCALA)) & (verde < (0.4 / FACTOR_ESCALA))] = 1
-    verde_rango[(verde >= (0.4 / FACTOR_ESCALA)) & (verde < (0.6 / FACTOR_ESCALA))] = 2
-    verde_rango[(verde >= (0.6 / FACTOR_ESCALA)) & (verde < (0.8 / FACTOR_ESCALA))] = 3
-    verde_rango[verde >= (0.8 / FACTOR_ESCALA)] = 4
-    verde_rango[verde < 0] = 0
-    verde_rango = verde_rango.astype(dtype=np.uint8)
-
-    period_s = f'{date_from.strftime("%Y%m")}-{date_to.strftime("%Y%m")}'
-
-    logger.info("Write masked NDVI raster")
-    os.makedirs(MVI_MASK_DIR, exist_ok=True)
-    ndvi_path = os.path.join(MVI_MASK_DIR, "{}_ndvi.tif".format(period_s))
-    meta = modis_meta.copy()
-    meta.update(dtype=verde.dtype)
-    with rasterio.open(ndvi_path, "w", **meta) as dst:
-        dst.write(verde, 1)
-
-    verde[verde_mask] = 1
-    verde = verde.astype(dtype=np.uint8)
-
-    logger.info("Write vegetation mask raster")
-    os.makedirs(MVI_MASK_DIR, exist_ok=True)
-    vegetation_mask_path = os.path.join(
-        MVI_MASK_DIR, "{}_vegetation_mask.tif".format(period_s)
-    )
-    with rasterio.open(vegetation_mask_path, "w", **modis_meta) as dst:
-        dst.write(verde, 1)
-
     # Cloud mask
     logger.info("Clip pixel reliability raster to extent")
     name, _ = os.path.splitext(os.path.basename(modis_filenames[0]))
     pixelrel_path = glob(os.path.join(MVI_TIF_DIR, f"{name}_pixelrel.tif"))[0]
-    pixelrel_clipped_path = os.path.join(MVI_CLIP_DIR, os.path.basename(pixelrel_path))
-    if os.path.exists(pixelrel_clipped_path):
-        os.unlink(pixelrel_clipped_path)
-    run_command(
-        "{gdal_bin_path}/gdalwarp -of GTiff -cutline {extent} -crop_to_cutline {src} {dst}".format(
-            gdal_bin_path=settings.GDAL_BIN_PATH,
-            extent=EXTENT_PATH,
-            src=pixelrel_path,
-            dst=pixelrel_clipped_path,
-        )
+    pixelrel_clipped_path = os.path.join(MVI_CLIP_DIR, f"{name}_pixelrel.vrt")
+    gdal_ops.clip(
+        pixelrel_path, pixelrel_clipped_path, aoi=EXTENT_PATH, format="VRT"
     )
 
-    logger.info("Superimpose pixel rel raster to SRTM raster")
+    logger.info("Superimpose pixel rel raster to lomas mask")
     pixelrel_superimp_path = os.path.join(
-        MVI_SUPERIMP_DIR, os.path.basename(pixelrel_clipped_path)
+        MVI_SUPERIMP_DIR, os.path.basename(pixelrel_path)
     )
     run_otb_command(
         "otbcli_Superimpose -inr {inr} -inm {inm} -out {out}".format(
-            inr=srtm_clipped_path,
+            inr=lomas_mask_path,
             inm=pixelrel_clipped_path,
             out=pixelrel_superimp_path,
         )
     )
 
-    logger.info("Build cloud mask from pixel reliability raster")
-    with rasterio.open(pixelrel_superimp_path) as cloud_src:
-        clouds = cloud_src.read(1)
-
-    # In clouds 2 is snow/ice and 3 are clouds, and -1 is not processed data
-    cloud_mask = np.copy(clouds)
-    cloud_mask[(clouds == 2) | (clouds == 3) | (clouds == -1)] = 1
-    cloud_mask[(clouds != 2) & (clouds != 3)] = 0
-    cloud_mask = cloud_mask.astype(np.uint8)
-
-    logger.info("Write cloud mask raster")
+    period_s = f'{date_from.strftime("%Y%m")}-{date_to.strftime("%Y%m")}'
+    os.makedirs(MVI_MASK_DIR, exist_ok=True)
+    ndvi_path = os.path.join(MVI_MASK_DIR, "{}_ndvi.tif".format(period_s))
+    vegetation_mask_path = os.path.join(
+        MVI_MASK_DIR, "{}_vegetation_mask.tif".format(period_s)
+    )
     cloud_mask_path = os.path.join(MVI_MASK_DIR, "{}_cloud_mask.tif".format(period_s))
-    with rasterio.open(cloud_mask_path, "w", **modis_meta) as dst:
-        dst.write(cloud_mask, 1)
-
-    # vegetation_range_path = os.path.join(
-    #     MVI_MASK_DIR, "{}_vegetation_range.tif".format(period_s)
-    # )
-    # with rasterio.open(vegetation_range_path, "w", **modis_meta) as dst:
-    #     dst.write(verde_rango, 1)
-
-    logger.info("Create a mask with both vegetation and clouds")
-    verde[cloud_mask == 1] = 2
     veg_cloud_mask_path = os.path.join(
         MVI_MASK_DIR, "{}_vegetation_cloud_mask.tif".format(period_s)
     )
-    with rasterio.open(veg_cloud_mask_path, "w", **modis_meta) as dst:
-        dst.write(verde, 1)
+
+    # Superimposed rasters are on the grid of the lomas mask, so all inputs
+    # are aligned
+    logger.info("Build masked NDVI, vegetation, cloud and vegetation+cloud masks")
+    mask_profile = dict(count=1, dtype="uint8", nodata=0)
+    process_blocks(
+        build_masks,
+        [ndvi_superimp_path, pixelrel_superimp_path, lomas_mask_path],
+        [ndvi_path, vegetation_mask_path, cloud_mask_path, veg_cloud_mask_path],
+        indexes=[1, 1, 1],
+        profiles=[dict(count=1, nodata=0), mask_profile, mask_profile, mask_profile],
+        desc="modis_vi masks",
+    )
 
     # Clip to AOI all rasters into RESULTS_DIR
     clip_with_aoi(ndvi_path)
@@ -270,27 +215,39 @@ def download_and_process(date_from, date_to):
     return True, scene_date
 
 
-def clip_srtm_to_extent():
-    logger.info("Clip SRTM to extent")
-    srtm_clipped_path = os.path.join(MODIS_VI_TASKS_DATA_DIR, "srtm_dem_clipped.tif")
-    if not os.path.exists(srtm_clipped_path):
-        run_command(
-            "{gdal_bin_path}/gdalwarp -of GTiff -cutline {aoi} -crop_to_cutline {src} {dst}".format(
-                gdal_bin_path=settings.GDAL_BIN_PATH,
-                aoi=EXTENT_PATH,
-                src=SRTM_DEM_PATH,
-                dst=srtm_clipped_path,
-            )
-        )
-    return srtm_clipped_path
+def lomas_mask():
+    """Write (or restore from cache) the mask of SRTM DEM pixels at the altitude
+    of lomas, clipped to extent"""
+    return elevation_mask(
+        os.path.join(MODIS_VI_TASKS_DATA_DIR, "srtm_lomas_mask.tif"),
+        dem_path=SRTM_DEM_PATH,
+        extent_path=EXTENT_PATH,
+        min_elevation=LOMAS_MIN,
+        max_elevation=LOMAS_MAX,
+    )
 
 
-def calculate_srtm_mask(srtm_path):
-    logger.info("Calculate SRTM mask")
-    with rasterio.open(srtm_path) as srtm_src:
-        srtm = srtm_src.read(1)
-        lomas_mask = (srtm >= LOMAS_MIN) & (srtm <= LOMAS_MAX)
-        return lomas_mask
+def build_masks(ndvi, pixelrel, lomas):
+    """
+    Build masks from a block of NDVI, pixel reliability and lomas mask images.
+
+    Returns the NDVI of vegetation on lomas (0 elsewhere), the vegetation mask
+    (1 for vegetation), the cloud mask (1 for clouds or snow/ice), and the
+    vegetation mask with clouds (2).
+
+    """
+    vegetation = (ndvi > THRESHOLD) & (lomas == 1)
+    # In pixel reliability, 2 is snow/ice and 3 are clouds
+    cloud = (pixelrel == 2) | (pixelrel == 3)
+
+    masked_ndvi = np.where(vegetation, ndvi, 0).astype(ndvi.dtype)
+    vegetation_cloud = np.where(cloud, 2, vegetation).astype(np.uint8)
+    return (
+        masked_ndvi,
+        vegetation.astype(np.uint8),
+        cloud.astype(np.uint8),
+        vegetation_cloud,
+    )
 
 
 def clip_with_aoi(src):
@@ -298,12 +255,9 @@ def clip_with_aoi(src):
     logger.info("Clip %s with AOI to %s", src, dst)
 
     os.makedirs(MVI_RESULTS_DIR, exist_ok=True)
-    if not os.path.exists(dst):
-        run_command(
-            "{gdal_bin_path}/gdalwarp -co COMPRESS=DEFLATE -co TILED=YES -of GTiff -cutline {aoi} -crop_to_cutline {src} {dst}".format(
-                gdal_bin_path=settings.GDAL_BIN_PATH, aoi=AOI_PATH, src=src, dst=dst
-            )
-        )
+    with cached_step("modis_vi.clip_with_aoi", inputs=[src, AOI_PATH], outputs=[dst]) as step:
+        if not step.cached:
+            gdal_ops.clip(src, dst, aoi=AOI_PATH)
 
 
 def create_rgb_rasters(scene_date, date_from, date_to):
@@ -319,58 +273,46 @@ def create_rgb_rasters(scene_date, date_from, date_to):
         slug="ndvi",
         defaults=dict(name="NDVI"),
     )
-    with open(dst_path, "rb") as f:
-        if raster.file:
-            raster.file.delete()
-        raster.file.save(f"ndvi.tif", File(f, name="ndvi.tif"))
+    save_raster_file(raster, dst_path, name="ndvi.tif")
     create_raster_tiles(raster, levels=(6, 13))
 
     src_path = os.path.join(MVI_RESULTS_DIR, f"{period_s}_vegetation_mask.tif")
     dst_path = os.path.join(MVI_RGB_DIR, f"{period_s}_vegetation_mask.tif")
-    logger.info("Create RGB vegetation mask raster")
-    write_vegetation_mask_rgb_raster(src_path=src_path, dst_path=dst_path)
+    logger.info("Create paletted vegetation mask raster")
+    write_vegetation_mask_paletted_raster(src_path=src_path, dst_path=dst_path)
     raster, _ = Raster.objects.update_or_create(
         source=Sources.MODIS_VI,
         date=scene_date,
         slug="vegetation",
         defaults=dict(name="Vegetation mask"),
     )
-    with open(dst_path, "rb") as f:
-        if raster.file:
-            raster.file.delete()
-        raster.file.save(f"vegetation.tif", File(f))
+    save_raster_file(raster, dst_path, name="vegetation.tif")
     create_raster_tiles(raster, levels=(6, 13))
 
     src_path = os.path.join(MVI_RESULTS_DIR, f"{period_s}_cloud_mask.tif")
     dst_path = os.path.join(MVI_RGB_DIR, f"{period_s}_cloud_mask.tif")
-    logger.info("Create RGB cloud mask raster")
-    write_cloud_mask_rgb_raster(src_path=src_path, dst_path=dst_path)
+    logger.info("Create paletted cloud mask raster")
+    write_cloud_mask_paletted_raster(src_path=src_path, dst_path=dst_path)
     raster, _ = Raster.objects.update_or_create(
         source=Sources.MODIS_VI,
         date=scene_date,
         slug="cloud",
         defaults=dict(name="Cloud mask"),
     )
-    with open(dst_path, "rb") as f:
-        if raster.file:
-            raster.file.delete()
-        raster.file.save(f"cloud.tif", File(f))
+    save_raster_file(raster, dst_path, name="cloud.tif")
     create_raster_tiles(raster, levels=(6, 13))
 
     src_path = os.path.join(MVI_RESULTS_DIR, f"{period_s}_vegetation_cloud_mask.tif")
     dst_path = os.path.join(MVI_RGB_DIR, f"{period_s}_vegetation_cloud_mask.tif")
-    logger.info("Create RGB vegetation+cloud mask raster")
-    write_vegetation_cloud_mask_rgb_raster(src_path=src_path, dst_path=dst_path)
+    logger.info("Create paletted vegetation+cloud mask raster")
+    write_vegetation_cloud_mask_paletted_raster(src_path=src_path, dst_path=dst_path)
     raster, _ = Raster.objects.update_or_create(
         source=Sources.MODIS_VI,
         date=scene_date,
         slug="vegetation-cloud",
         defaults=dict(name="Vegetation + Cloud mask"),
     )
-    with open(dst_path, "rb") as f:
-        if raster.file:
-            raster.file.delete()
-        raster.file.save(f"vegetation-cloud.tif", File(f))
+    save_raster_file(raster, dst_path, name="vegetation-cloud.tif")
     create_raster_tiles(raster, levels=(6, 13))
 
 
@@ -398,31 +340,16 @@ def write_ndvi_rgb_raster(img):
     return res
 
 
-@write_rgb_raster
-def write_cloud_mask_rgb_raster(img):
-    colormap = ["30a7ff"]
-    new_img = np.zeros((img.shape[0], img.shape[1], 3), dtype=np.uint8)
-    for i in range(len(colormap)):
-        new_img[img == i + 1] = hex_to_dec_string(colormap[i])
-    return new_img
+def write_cloud_mask_paletted_raster(*, src_path, dst_path):
+    write_paletted_raster(src_path, dst_path, colormap=["30a7ff"])
 
 
-@write_rgb_raster
-def write_vegetation_mask_rgb_raster(img):
-    colormap = ["149c01"]
-    new_img = np.zeros((img.shape[0], img.shape[1], 3), dtype=np.uint8)
-    for i in range(len(colormap)):
-        new_img[img == i + 1] = hex_to_dec_string(colormap[i])
-    return new_img
+def write_vegetation_mask_paletted_raster(*, src_path, dst_path):
+    write_paletted_raster(src_path, dst_path, colormap=["149c01"])
 
 
-@write_rgb_raster
-def write_vegetation_cloud_mask_rgb_raster(img):
-    colormap = ["149c01", "30a7ff"]
-    new_img = np.zeros((img.shape[0], img.shape[1], 3), dtype=np.uint8)
-    for i in range(len(colormap)):
-        new_img[img == i + 1] = hex_to_dec_string(colormap[i])
-    return new_img
+def write_vegetation_cloud_mask_paletted_raster(*, src_path, dst_path):
+    write_paletted_raster(src_path, dst_path, colormap=["149c01", "30a7ff"])
 
 
 def create_masks(scene_date, date_from, date_to):
@@ -432,100 +359,38 @@ def create_masks(scene_date, date_from, date_to):
     src_path = os.path.join(
         MVI_RESULTS_DIR, "{}_vegetation_cloud_mask.tif".format(period_s)
     )
-    dst_path = os.path.join(
-        MVI_RESULTS_DIR, "{}_vegetation_cloud_mask.geojson".format(period_s)
-    )
-    run_command(
-        '{gdal_bin_path}/gdal_polygonize.py {src} {dst} -b 1 -f "GeoJSON" DN'.format(
-            gdal_bin_path=settings.GDAL_BIN_PATH, src=src_path, dst=dst_path
-        )
-    )
-
-    logging.info("Reproject to epsg:4326")
-    data = gpd.read_file(dst_path)
-    data_proj = data.copy()
-    data_proj["geometry"] = data_proj["geometry"].to_crs(epsg=4326)
-    data_proj.to_file(dst_path)
+    polys_per_value = polygonize(src_path, dst_crs="EPSG:4326")
 
     logger.info("Load vegetation mask to DB")
-    create_vegetation_masks(dst_path, scene_date)
-
-
-def create_vegetation_masks(geojson_path, date):
-    ds = DataSource(geojson_path)
-    vegetation_polys = []
-    clouds_polys = []
-    for x in range(0, len(ds[0]) - 1):
-        geom = shapely.wkt.loads(ds[0][x].geom.wkt)
-        if str(ds[0][x]["DN"]) == "1":
-            vegetation_polys.append(geom)
-        elif str(ds[0][x]["DN"]) == "2":
-            clouds_polys.append(geom)
-        else:
-            pass
-    vegetation_mp = unary_union(vegetation_polys)
-    clouds_mp = unary_union(clouds_polys)
+    create_vegetation_masks(polys_per_value, scene_date)
 
+
+def create_vegetation_masks(polys_per_value, date):
     raster = Raster.objects.get(
         source=Sources.MODIS_VI, date=date, slug="vegetation-cloud"
     )
-    CoverageMask.objects.update_or_create(
-        date=date,
-        source=Sources.MODIS_VI,
-        kind="V",
-        defaults=dict(geom=GEOSGeometry(vegetation_mp.wkt), raster=raster),
-    )
-    CoverageMask.objects.update_or_create(
-        date=date,
-        source=Sources.MODIS_VI,
-        kind="C",
-        defaults=dict(geom=GEOSGeometry(clouds_mp.wkt), raster=raster),
-    )
+    # In vegetation+cloud mask, 1 is vegetation and 2 are clouds
+    for kind, value in [("V", 1), ("C", 2)]:
+        CoverageMask.objects.update_or_create(
+            date=date,
+            source=Sources.MODIS_VI,
+            kind=kind,
+            defaults=dict(
+                geom=multipolygon_to_geos(polys_per_value.get(value)), raster=raster
+            ),
+        )
 
 
-def generate_measurements(date):
-    logger.info("Generate measurements for each scope")
-
-    for scope in Scope.objects.all():
-        for kind in ["V", "C"]:
-            mask = CoverageMask.objects.filter(
-                date=date,
-                source=Sources.MODIS_VI,
-                kind=kind,
-            ).first()
-
-            # TODO Optimize: use JOINs with Scope and Mask instead of building the shape WKT
-            query = """
-                SELECT ST_Area(a.int) AS area,
-                    ST_Area(ST_Transform(ST_GeomFromText('{wkt_scope}', 4326), {srid})) as scope_area
-                FROM (
-                    SELECT ST_Intersection(
-                        ST_Transform(ST_GeomFromText('{wkt_scope}', 4326), {srid}),
-                        ST_Transform(ST_GeomFromText('{wkt_mask}', 4326), {srid})) AS int) a;
-                """.format(
-                wkt_scope=scope.geom.wkt, wkt_mask=mask.geom.wkt, srid=32718
-            )
-
-            try:
-                with connection.cursor() as cursor:
-                    cursor.execute(query)
-                    res = cursor.fetchall()
-                    area, scope_area = res[0]
-
-                measurement, created = CoverageMeasurement.objects.update_or_create(
-                    date=date,
-                    kind=kind,
-                    source=Sources.MODIS_VI,
-                    scope=scope,
-                    defaults=dict(area=area, perc_area=area / scope_area),
-                )
-                if created:
-                    logger.info(f"New measurement: {measurement}")
-            except DatabaseError as err:
-                logger.error(err)
-                logger.info(
-                    f"An error occurred! Skipping measurement for scope {scope.id}..."
-                )
+def generate_raster_measurements_from_mask(coverage_masks, date_from, date_to):
+    period_s = f'{date_from.strftime("%Y%m")}-{date_to.strftime("%Y%m")}'
+    cov_raster_path = os.path.join(
+        MVI_RESULTS_DIR, "{}_vegetation_cloud_mask.tif".format(period_s)
+    )
+    generate_raster_measurements(
+        coverage_masks,
+        cov_raster_path=cov_raster_path,
+        kinds_per_value={1: "V", 2: "C"},
+    )
 
 
 def clean_temp_files():
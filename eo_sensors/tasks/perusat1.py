@@ -10,11 +10,21 @@ from glob import glob
 
 from django.contrib.gis.gdal import DataSource
 from django.contrib.gis.geos import GEOSGeometry
-from django.core.files import File
 from eo_sensors.clients import SFTPClient
+from eo_sensors import gdal_ops
 from eo_sensors.models import Raster, Sources
 from eo_sensors.tasks import APP_DATA_DIR, TASKS_DATA_DIR
-from eo_sensors.utils import unzip, create_raster_tiles, run_command, write_rgb_raster, hex_to_dec_string, write_paletted_rgb_raster, create_raster
+from eo_sensors.utils import (
+    unzip,
+    create_raster_tiles,
+    write_rgb_raster,
+    hex_to_dec_string,
+    write_paletted_raster,
+    create_raster,
+    save_raster_file,
+)
+from eo_sensors.utils.percentiles import raster_percentiles
+from eo_sensors.utils.pipeline import process_blocks
 from jobs.utils import enqueue_job, job
 
 # Configure loggers
@@ -119,8 +129,6 @@ def pansharpen_scene(job):
 
 @job("processing")
 def create_tci_rgb_rasters(job):
-    from satlomasproc.chips.utils import calculate_raster_percentiles
-
     scene_dir = job.kwargs["scene_dir"]
 
     rasters = glob(os.path.join(scene_dir, "*.tif"))
@@ -131,16 +139,14 @@ def create_tci_rgb_rasters(job):
 
     scene_date = _extract_from_ps1_id(basename)
 
-    # Create virtual raster
-    vrt_path = os.path.join(tci_scene_dir, "tci.vrt")
-    os.makedirs(os.path.dirname(vrt_path), exist_ok=True)
-    logger.info("Generate virtual raster from TCI tiles into %s", vrt_path)
-    cmd = f"gdalbuildvrt {vrt_path} {' '.join(rasters)}"
-    run_command(cmd)
-    logger.info("%s written", vrt_path)
-
-    logger.info("Calculate raster percentiles (2, 98) from %s", vrt_path)
-    rescale_range = calculate_raster_percentiles(vrt_path, lower_cut=2, upper_cut=98)
+    os.makedirs(tci_scene_dir, exist_ok=True)
+    logger.info("Estimate raster percentiles (2, 98) from a sample of all TCI tiles")
+    rescale_range = raster_percentiles(
+        rasters,
+        lower_cut=2,
+        upper_cut=98,
+        cache_path=os.path.join(tci_scene_dir, "percentiles.json"),
+    )
 
     logger.info("Rescale intensities of all TCI tiles")
     with mp.Pool(mp.cpu_count()) as pool:
@@ -151,9 +157,19 @@ def create_tci_rgb_rasters(job):
     logger.info("Merge all rescaled tiles into a single JPEG compressed GeoTIFF")
     merged_path = os.path.join(tci_scene_dir, f'{basename}.tif')
     if not os.path.exists(merged_path):
-        run_command(f"gdalwarp -overwrite -multi -wo NUM_THREADS=ALL_CPUS -co TILED=YES -co COMPRESS=JPEG -co PHOTOMETRIC=YCBCR -co BIGTIFF=YES {' '.join(tif_paths)} {merged_path}")
-        logger.info("Add internval overviews to %s", merged_path)
-        run_command(f"gdaladdo --config COMPRESS_OVERVIEW JPEG --config PHOTOMETRIC_OVERVIEW YCBCR --config INTERLEAVE_OVERVIEW PIXEL {merged_path} 2 4 8 16")
+        # Tiles share the same grid, so mosaic them with an in-memory VRT
+        # instead of warping them
+        gdal_ops.translate(
+            gdal_ops.build_vrt(tif_paths),
+            merged_path,
+            creation_options=[
+                "TILED=YES",
+                "COMPRESS=JPEG",
+                "PHOTOMETRIC=YCBCR",
+                "BIGTIFF=YES",
+            ],
+        )
+        gdal_ops.build_overviews(merged_path, compress="JPEG", photometric="YCBCR")
 
     raster = create_tci_raster_object(merged_path, scene_date=scene_date)
     create_raster_tiles(raster, levels=(6, 18), n_jobs=mp.cpu_count())
@@ -166,7 +182,7 @@ def create_tci_rgb_rasters(job):
 
 
 def create_tci_raster_geotiff(src_path, *, tci_scene_dir, rescale_range):
-    from satlomasproc.chips.utils import rescale_intensity, sliding_windows
+    from satlomasproc.chips.utils import rescale_intensity
     import rasterio
     import numpy as np
 
@@ -178,24 +194,25 @@ def create_tci_raster_geotiff(src_path, *, tci_scene_dir, rescale_range):
         return dst_path
 
     logger.info("Rescale image %s into %s", src_path, dst_path)
-    os.makedirs(tci_scene_dir, exist_ok=True)
     with rasterio.open(src_path) as src:
-        profile = src.profile.copy()
-        profile.update(dtype=np.uint8, count=3, nodata=0, tiled=True)
-        try:
-            os.remove(dst_path)
-        except OSError:
-            pass
-        with rasterio.open(dst_path, "w", **profile) as dst:
-            for _, window in src.block_windows(1):
-                img = np.array([src.read(b, window=window) for b in BANDS])
-                nodata_mask = (img == src.nodata)
-                img = rescale_intensity(
-                    img, rescale_mode="values", rescale_range=rescale_range
-                )
-                img[nodata_mask] = 0
-                for b in BANDS:
-                    dst.write(img[b-1].astype(np.uint8), b, window=window)
+        nodata = src.nodata
+
+    def rescale(img):
+        nodata_mask = img == nodata
+        img = rescale_intensity(img, rescale_mode="values", rescale_range=rescale_range)
+        img[nodata_mask] = 0
+        return img
+
+    # Images are already rescaled in parallel, so use a single thread per image
+    process_blocks(
+        rescale,
+        [src_path],
+        [dst_path],
+        indexes=[list(BANDS)],
+        profiles=[dict(dtype=np.uint8, count=len(BANDS), nodata=0)],
+        n_jobs=1,
+        skip_empty=True,
+    )
 
     logger.info("%s written", dst_path)
     return dst_path
@@ -209,10 +226,7 @@ def create_tci_raster_object(tif_path, *, scene_date):
         slug=f"tci",
         defaults=dict(name="True-color image (RGB)"),
     )
-    with open(tif_path, "rb") as f:
-        if raster.file:
-            raster.file.delete()
-        raster.file.save(f"tci.tif", File(f, name="tci.tif"))
+    save_raster_file(raster, tif_path, name="tci.tif")
     return raster
 
 
@@ -353,12 +367,12 @@ def load_results(job):
 
 
 def create_use_raster(result_path, *, date):
-    loss_rgb_path = os.path.join(os.path.dirname(result_path), "ps1-use-rgb.tif")
-    if not os.path.exists(loss_rgb_path):
-        logger.info("Write paletted RGB raster %s into %s", result_path, loss_rgb_path)
-        write_paletted_rgb_raster(result_path, loss_rgb_path, colormap=COLORMAP)
+    use_path = os.path.join(os.path.dirname(result_path), "ps1-use-paletted.tif")
+    if not os.path.exists(use_path):
+        logger.info("Write paletted raster %s into %s", result_path, use_path)
+        write_paletted_raster(result_path, use_path, colormap=COLORMAP)
     create_raster(
-        loss_rgb_path,
+        use_path,
         cov_raster_path=result_path,
         kinds_per_value=CLASSES_PER_VALUE,
         source=Sources.PS1,
@@ -11,14 +11,15 @@ import numpy as np
 import rasterio
 from django.conf import settings
 from django.core.files import File
+from eo_sensors import gdal_ops
 from eo_sensors.models import Raster
 from eo_sensors.utils import (
-    run_command,
     run_otb_command,
-    sliding_windows,
     unzip,
-    write_rgb_raster,
+    write_rescaled_rgb_raster,
 )
+from eo_sensors.utils.pipeline import process_blocks
+from eo_sensors.utils.step_cache import cached_step
 from sentinelsat.sentinel import SentinelAPI, geojson_to_wkt, read_geojson
 
 APPDIR = os.path.dirname(eo_sensors.__file__)
@@ -128,19 +129,18 @@ def calibrate(product):
     dst_folder = os.path.join(S1_RAW_PATH, "proc", name, "calib")
     os.makedirs(dst_folder, exist_ok=True)
 
-    src = os.path.join(S1_RAW_PATH, name, "measurement", "*-vv-*.tiff")
-    dst = os.path.join(dst_folder, "vv.tiff")
-    if not os.path.exists(dst):
-        run_otb_command(
-            "otbcli_SARCalibration -in $(ls {src}) -out {dst}".format(src=src, dst=dst)
-        )
-
-    src = os.path.join(S1_RAW_PATH, name, "measurement", "*-vh-*.tiff")
-    dst = os.path.join(dst_folder, "vh.tiff")
-    if not os.path.exists(dst):
-        run_otb_command(
-            "otbcli_SARCalibration -in $(ls {src}) -out {dst}".format(src=src, dst=dst)
-        )
+    for pol in ["vv", "vh"]:
+        src = glob(
+            os.path.join(S1_RAW_PATH, name, "measurement", f"*-{pol}-*.tiff")
+        )[0]
+        dst = os.path.join(dst_folder, f"{pol}.tiff")
+        with cached_step("s1.calibrate", inputs=[src], outputs=[dst]) as step:
+            if not step.cached:
+                run_otb_command(
+                    "otbcli_SARCalibration -in {src} -out {dst}".format(
+                        src=src, dst=dst
+                    )
+                )
 
 
 def orthorectify(product):
@@ -150,29 +150,24 @@ def orthorectify(product):
     dst_folder = os.path.join(S1_RAW_PATH, "proc", name, "ortho")
     os.makedirs(dst_folder, exist_ok=True)
 
-    src = os.path.join(S1_RAW_PATH, "proc", name, "calib", "vv.tiff")
-    dst = os.path.join(dst_folder, "vv.tiff")
-    if not os.path.exists(dst):
-        run_otb_command(
-            "otbcli_OrthoRectification -io.in {src} -io.out {dst} -elev.geoid {geoid_path} -elev.dem {dem_path} -opt.gridspacing 50".format(
-                src=src,
-                dst=dst,
-                geoid_path=GEOID_PATH,
-                dem_path=DEM_PATH,
-            )
-        )
-
-    src = os.path.join(S1_RAW_PATH, "proc", name, "calib", "vh.tiff")
-    dst = os.path.join(dst_folder, "vh.tiff")
-    if not os.path.exists(dst):
-        run_otb_command(
-            "otbcli_OrthoRectification -io.in {src} -io.out {dst} -elev.geoid {geoid_path} -elev.dem {dem_path} -opt.gridspacing 50".format(
-                src=src,
-                dst=dst,
-                geoid_path=GEOID_PATH,
-                dem_path=DEM_PATH,
-            )
-        )
+    for pol in ["vv", "vh"]:
+        src = os.path.join(S1_RAW_PATH, "proc", name, "calib", f"{pol}.tiff")
+        dst = os.path.join(dst_folder, f"{pol}.tiff")
+        with cached_step(
+            "s1.orthorectify",
+            inputs=[src, GEOID_PATH, DEM_PATH],
+            outputs=[dst],
+            params=dict(gridspacing=50),
+        ) as step:
+            if not step.cached:
+                run_otb_command(
+                    "otbcli_OrthoRectification -io.in {src} -io.out {dst} -elev.geoid {geoid_path} -elev.dem {dem_path} -opt.gridspacing 50".format(
+                        src=src,
+                        dst=dst,
+                        geoid_path=GEOID_PATH,
+                        dem_path=DEM_PATH,
+                    )
+                )
 
 
 def despeckle(product):
@@ -182,19 +177,14 @@ def despeckle(product):
     dst_folder = os.path.join(S1_RAW_PATH, "proc", name, "despeck")
     os.makedirs(dst_folder, exist_ok=True)
 
-    src = os.path.join(S1_RAW_PATH, "proc", name, "ortho", "vv.tiff")
-    dst = os.path.join(dst_folder, "vv.tiff")
-    if not os.path.exists(dst):
-        run_otb_command(
-            "otbcli_Despeckle -in {src} -out {dst}".format(src=src, dst=dst)
-        )
-
-    src = os.path.join(S1_RAW_PATH, "proc", name, "ortho", "vh.tiff")
-    dst = os.path.join(dst_folder, "vh.tiff")
-    if not os.path.exists(dst):
-        run_otb_command(
-            "otbcli_Despeckle -in {src} -out {dst}".format(src=src, dst=dst)
-        )
+    for pol in ["vv", "vh"]:
+        src = os.path.join(S1_RAW_PATH, "proc", name, "ortho", f"{pol}.tiff")
+        dst = os.path.join(dst_folder, f"{pol}.tiff")
+        with cached_step("s1.despeckle", inputs=[src], outputs=[dst]) as step:
+            if not step.cached:
+                run_otb_command(
+                    "otbcli_Despeckle -in {src} -out {dst}".format(src=src, dst=dst)
+                )
 
 
 def clip(product):
@@ -204,29 +194,12 @@ def clip(product):
     dst_folder = os.path.join(S1_RAW_PATH, "proc", name, "clip")
     os.makedirs(dst_folder, exist_ok=True)
 
-    vv_src = os.path.join(S1_RAW_PATH, "proc", name, "despeck", "vv.tiff")
-    vv_dst = os.path.join(dst_folder, "vv.tiff")
-    if not os.path.exists(vv_dst):
-        run_command(
-            "{gdal_bin_path}/gdalwarp -of GTiff -cutline {aoi} -crop_to_cutline {src} {dst}".format(
-                gdal_bin_path=settings.GDAL_BIN_PATH,
-                aoi=AOI_PATH,
-                src=vv_src,
-                dst=vv_dst,
-            )
-        )
-
-    vh_src = os.path.join(S1_RAW_PATH, "proc", name, "despeck", "vh.tiff")
-    vh_dst = os.path.join(dst_folder, "vh.tiff")
-    if not os.path.exists(vh_dst):
-        run_command(
-            "{gdal_bin_path}/gdalwarp -of GTiff -cutline {aoi} -crop_to_cutline {src} {dst}".format(
-                gdal_bin_path=settings.GDAL_BIN_PATH,
-                aoi=AOI_PATH,
-                src=vh_src,
-                dst=vh_dst,
-            )
-        )
+    for pol in ["vv", "vh"]:
+        src = os.path.join(S1_RAW_PATH, "proc", name, "despeck", f"{pol}.tiff")
+        dst = os.path.join(dst_folder, f"{pol}.tiff")
+        with cached_step("s1.clip", inputs=[src, AOI_PATH], outputs=[dst]) as step:
+            if not step.cached:
+                gdal_ops.clip(src, dst, aoi=AOI_PATH, creation_options=[])
 
 
 def concatenate(product):
@@ -239,14 +212,17 @@ def concatenate(product):
     vv_src = os.path.join(S1_RAW_PATH, "proc", name, "clip", "vv.tiff")
     vh_src = os.path.join(S1_RAW_PATH, "proc", name, "clip", "vh.tiff")
     dst = os.path.join(dst_folder, "concatenate.tiff")
-    if not os.path.exists(dst):
-        run_otb_command(
-            "otbcli_ConcatenateImages -il {vv_src} {vh_src} -out {dst}".format(
-                vv_src=vv_src,
-                vh_src=vh_src,
-                dst=dst,
+    with cached_step(
+        "s1.concatenate", inputs=[vv_src, vh_src], outputs=[dst]
+    ) as step:
+        if not step.cached:
+            run_otb_command(
+                "otbcli_ConcatenateImages -il {vv_src} {vh_src} -out {dst}".format(
+                    vv_src=vv_src,
+                    vh_src=vh_src,
+                    dst=dst,
+                )
             )
-        )
 
 
 def superimpose(products):
@@ -287,33 +263,23 @@ def median(products, period):
 
     dst_path = os.path.join(S1_RES_PATH, str(period.pk), "median.tiff")
     if not os.path.exists(dst_path):
+        paths = [
+            os.path.join(
+                S1_RAW_PATH,
+                "proc",
+                "{}.SAFE".format(p["title"]),
+                "concatenate",
+                "aligned.tiff",
+            )
+            for p in products
+        ]
         with rasterio.open(ref_path) as src:
-            with rasterio.open(
-                dst_path,
-                "w",
-                driver="GTiff",
-                dtype=src.profile["dtype"],
-                width=src.shape[1],
-                height=src.shape[0],
-                count=src.count,
-                transform=src.profile["transform"],
-                crs=src.profile["crs"],
-            ) as dst:
-                for band in range(1, src.count + 1):
-                    for win in sliding_windows(1000, src.shape[1], src.shape[0]):
-                        imgs = []
-                        for p in products:
-                            name = "{}.SAFE".format(p["title"])
-                            path = os.path.join(
-                                S1_RAW_PATH, "proc", name, "concatenate", "aligned.tiff"
-                            )
-                            src = rasterio.open(path)
-                            w = src.read(band, window=win)
-                            imgs.append(w)
-
-                        wins = np.dstack(imgs)
-                        median = np.median(wins, axis=2)
-                        dst.write(median, window=win, indexes=band)
+            dtype = src.profile["dtype"]
+
+        def compute_median(*imgs):
+            return np.median(np.stack(imgs), axis=0).astype(dtype)
+
+        process_blocks(compute_median, paths, [dst_path], desc="median")
 
 
 def generate_vvvh(period):
@@ -350,11 +316,7 @@ def clip_result(period):
     )
     dst = os.path.join(RESULTS_PATH, dst_name)
     if not os.path.exists(dst):
-        run_command(
-            "{gdal_bin_path}/gdalwarp -of GTiff -cutline {aoi} -crop_to_cutline {src} {dst}".format(
-                gdal_bin_path=settings.GDAL_BIN_PATH, aoi=AOI_PATH, src=src, dst=dst
-            )
-        )
+        gdal_ops.clip(src, dst, aoi=AOI_PATH, creation_options=[])
 
 
 def create_rgb_rasters(period):
@@ -367,10 +329,9 @@ def create_rgb_rasters(period):
 
     if not os.path.exists(dst_path):
         logger.info("Build RGB Sentinel-1 raster")
-        # FIXME: Replace with rescale_byte and write_rgb
-        write_rgb_raster(
-            src_path=src_path,
-            dst_path=dst_path,
+        write_rescaled_rgb_raster(
+            src_path,
+            dst_path,
             bands=(1, 2, 3),
             in_range=((-0.0235941, 0.49517), (-0.00107017, 0.062705), (0.0, 0.0)),
         )
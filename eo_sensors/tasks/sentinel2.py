@@ -7,15 +7,17 @@ from datetime import datetime
 from glob import glob
 
 from django.conf import settings
-from django.core.files import File
+from eo_sensors import gdal_ops
 from eo_sensors.models import CoverageMask, CoverageMeasurement, Raster, Sources
 from eo_sensors.tasks import APP_DATA_DIR, TASKS_DATA_DIR
 from eo_sensors.utils import (
     create_raster,
     create_raster_tiles,
     run_command,
-    write_paletted_rgb_raster,
+    save_raster_file,
+    write_paletted_raster,
 )
+from eo_sensors.utils.step_cache import cached_step, restore_step
 from jobs.utils import job
 
 # Configure loggers
@@ -88,7 +90,7 @@ def process_period(job):
 
 
 def download_and_build_composite(date_from, date_to):
-    from eo_sensors.utils import clip, rescale_byte, unzip
+    from eo_sensors.utils import clip_rescale_cog, unzip
     from sentinelsat.sentinel import SentinelAPI, geojson_to_wkt, read_geojson
 
     period_s = "{dfrom}_{dto}".format(
@@ -96,9 +98,14 @@ def download_and_build_composite(date_from, date_to):
     )
     proc_scene_dir = os.path.join(PROC_DIR, period_s)
     tci_path = os.path.join(proc_scene_dir, "tci.tif")
+    mosaic_dir = os.path.join(proc_scene_dir, "mosaic")
 
-    if os.path.exists(tci_path):
-        logger.info("TCI file already generated at %s", tci_path)
+    # If the mosaic of this period was already built, and its TCI is cached,
+    # there is no need to query SciHub (nor to have credentials)
+    mosaic_rgb_paths = get_mosaic_rgb_paths(mosaic_dir)
+    if len(mosaic_rgb_paths) == 3 and restore_step(
+        "s2.tci", **tci_step_args(mosaic_rgb_paths, tci_path)
+    ):
         return tci_path
 
     if not settings.SCIHUB_USER or not settings.SCIHUB_PASS:
@@ -150,8 +157,6 @@ def download_and_build_composite(date_from, date_to):
             unzip(p, delete_zip=False)
 
     # Build mosaic
-    mosaic_dir = os.path.join(proc_scene_dir, "mosaic")
-    os.makedirs(mosaic_dir, exist_ok=True)
     # FIXME: Read bounds from EXTENT_UTM_PATH
     xmin, ymin, xmax, ymax = [
         261215.0000000000000000,
@@ -159,36 +164,58 @@ def download_and_build_composite(date_from, date_to):
         323691.8790999995544553,
         8719912.0846999995410442,
     ]
-    cmd = (
-        f"python3 {settings.S2M_CLI_PATH}/mosaic.py "
-        f"-te {xmin} {ymin} {xmax} {ymax} "
-        f"-e 32718 -res 10 -v "
-        f"-p {settings.S2M_NUM_JOBS} "
-        f"-o {mosaic_dir} {raw_dir}"
-    )
-    run_command(cmd)
+    products_dirs = sorted(glob(os.path.join(raw_dir, "*.SAFE")))
+    with cached_step(
+        "s2.mosaic",
+        inputs=products_dirs,
+        outputs=[mosaic_dir],
+        params=dict(extent=[xmin, ymin, xmax, ymax], epsg=32718, res=10),
+    ) as step:
+        if not step.cached:
+            os.makedirs(mosaic_dir, exist_ok=True)
+            cmd = (
+                f"python3 {settings.S2M_CLI_PATH}/mosaic.py "
+                f"-te {xmin} {ymin} {xmax} {ymax} "
+                f"-e 32718 -res 10 -v "
+                f"-p {settings.S2M_NUM_JOBS} "
+                f"-o {mosaic_dir} {raw_dir}"
+            )
+            run_command(cmd)
+
+    mosaic_rgb_paths = get_mosaic_rgb_paths(mosaic_dir)
+    logger.info("RGB paths: %s", mosaic_rgb_paths)
+
+    with cached_step("s2.tci", **tci_step_args(mosaic_rgb_paths, tci_path)) as step:
+        if not step.cached:
+            # Concatenate RGB bands from mosaic in a virtual raster.  Mosaic
+            # files are links to the step cache, so do not write next to them.
+            with tempfile.TemporaryDirectory() as tmpdir:
+                vrt_path = os.path.join(tmpdir, "tci.vrt")
+                gdal_ops.build_vrt(mosaic_rgb_paths, vrt_path, separate=True)
+
+                # Clip to extent and rescale virtual raster in a single pass
+                clip_rescale_cog(
+                    vrt_path, tci_path, aoi=EXTENT_UTM_PATH, in_range=(100, 3000)
+                )
+
+    return tci_path
+
 
-    # Get mosaic band rasters
-    mosaic_rgb_paths = [
+def get_mosaic_rgb_paths(mosaic_dir):
+    """Return paths of the RGB band rasters in +mosaic_dir+ that exist"""
+    paths = [
         glob(os.path.join(mosaic_dir, f"*_{band}.tif"))
         for band in ["B04", "B03", "B02"]
     ]
-    mosaic_rgb_paths = [p[0] for p in mosaic_rgb_paths if p]
-    logger.info("RGB paths: %s", mosaic_rgb_paths)
-
-    # Use gdalbuildvrt to concatenate RGB bands from mosaic
-    vrt_path = os.path.join(mosaic_dir, "tci.vrt")
-    cmd = f"gdalbuildvrt -separate {vrt_path} {' '.join(mosaic_rgb_paths)}"
-    run_command(cmd)
+    return [p[0] for p in paths if p]
 
-    # Clip to extent and rescale virtual raster
-    clipped_tci_path = os.path.join(mosaic_dir, "tci.tif")
-    clip(src=vrt_path, dst=clipped_tci_path, aoi=EXTENT_UTM_PATH)
 
-    # Rescale image
-    rescale_byte(src=clipped_tci_path, dst=tci_path, in_range=(100, 3000))
-
-    return tci_path
+def tci_step_args(mosaic_rgb_paths, tci_path):
+    return dict(
+        inputs=[*mosaic_rgb_paths, EXTENT_UTM_PATH],
+        outputs=[tci_path],
+        params=dict(in_range=[100, 3000]),
+    )
 
 
 def create_tci_raster(tif_path, *, date):
@@ -199,10 +226,7 @@ def create_tci_raster(tif_path, *, date):
         slug=f"s2-tci",
         defaults=dict(name="Sentinel-2 true-color image (RGB)"),
     )
-    with open(tif_path, "rb") as f:
-        if raster.file:
-            raster.file.delete()
-        raster.file.save(f"tci.tif", File(f, name="tci.tif"))
+    save_raster_file(raster, tif_path, name="tci.tif")
     create_raster_tiles(raster, levels=(6, 14), n_jobs=mp.cpu_count())
     return raster
 
@@ -303,11 +327,11 @@ def postprocess_scene(predict_chips_dir):
 
 def create_loss_raster(result_path, *, date):
     with tempfile.TemporaryDirectory() as tmpdir:
-        loss_rgb_path = os.path.join(tmpdir, "s2-loss-rgb.tif")
-        logger.info("Write paletted RGB raster %s into %s", result_path, loss_rgb_path)
-        write_paletted_rgb_raster(result_path, loss_rgb_path, colormap=COLORMAP)
+        loss_path = os.path.join(tmpdir, "s2-loss.tif")
+        logger.info("Write paletted raster %s into %s", result_path, loss_path)
+        write_paletted_raster(result_path, loss_path, colormap=COLORMAP)
         create_raster(
-            loss_rgb_path,
+            loss_path,
             cov_raster_path=result_path,
             kinds_per_value=CLASSES_PER_VALUE,
             source=Sources.SEN2,
@@ -0,0 +1,63 @@
+import tempfile
+from contextlib import contextmanager
+from unittest import mock
+
+import numpy as np
+import rasterio
+from eo_sensors.utils.step_cache import StepCache
+from rasterio.transform import from_origin
+
+# Grid of 10m pixels on UTM 18S, around Lima
+CRS = "EPSG:32718"
+TRANSFORM = from_origin(280000, 8660000, 10, 10)
+
+
+def write_raster(
+    path, data, *, crs=CRS, transform=TRANSFORM, nodata=None, block_size=256
+):
+    """Write +data+, a (bands, rows, cols) or (rows, cols) array, as a tiled
+    GeoTIFF to +path+"""
+    if data.ndim == 2:
+        data = data[np.newaxis, :]
+    count, height, width = data.shape
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        width=width,
+        height=height,
+        count=count,
+        dtype=data.dtype,
+        crs=crs,
+        transform=transform,
+        nodata=nodata,
+        tiled=True,
+        blockxsize=block_size,
+        blockysize=block_size,
+    ) as dst:
+        dst.write(data)
+    return path
+
+
+def read_raster(path):
+    with rasterio.open(path) as src:
+        return src.read()
+
+
+@contextmanager
+def temporary_step_cache(*, max_size=1024 ** 3):
+    """Use an empty step cache on a temporary directory"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = StepCache(tmpdir, max_size=max_size)
+        with mock.patch("eo_sensors.utils.step_cache._cache", cache):
+            yield cache
+
+
+class TemporaryDirectoryMixin:
+    """Create a temporary directory for each test, at `self.tmpdir`"""
+
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
@@ -0,0 +1,84 @@
+import numpy as np
+from django.test import SimpleTestCase
+from eo_sensors.utils.colormap import (
+    apply_discrete_cmap,
+    apply_lut,
+    build_lut,
+    cmap_lut,
+    palette_lut,
+)
+
+
+class BuildLutTest(SimpleTestCase):
+    def test_colors_by_value(self):
+        lut = build_lut({1: [255, 0, 0, 255], 3: [0, 0, 255, 128]})
+
+        self.assertEqual(lut.shape, (256, 4))
+        self.assertEqual(lut.dtype, np.uint8)
+        self.assertEqual(lut[1].tolist(), [255, 0, 0, 255])
+        self.assertEqual(lut[3].tolist(), [0, 0, 255, 128])
+
+    def test_values_without_color_are_transparent(self):
+        lut = build_lut({1: [255, 0, 0, 255]})
+
+        self.assertFalse(lut[0].any())
+        self.assertFalse(lut[2:].any())
+
+    def test_values_out_of_range_are_ignored(self):
+        lut = build_lut({-1: [255, 0, 0, 255], 256: [0, 255, 0, 255]})
+
+        self.assertFalse(lut.any())
+
+    def test_same_result_as_discrete_cmap(self):
+        colormap = {0: [0, 0, 0, 0], 1: [255, 255, 255, 255], 2: [255, 0, 0, 255]}
+        data = np.random.default_rng(0).integers(0, 3, size=(1, 16, 16))
+
+        rgb, alpha = apply_discrete_cmap(data, colormap)
+
+        for value, color in colormap.items():
+            mask = data[0] == value
+            self.assertTrue((rgb[:, mask].T == color[:3]).all())
+            self.assertTrue((alpha[mask] == color[3]).all())
+
+
+class PaletteLutTest(SimpleTestCase):
+    def test_class_colors(self):
+        lut = palette_lut(["#ff0000", None, "00c8ff"])
+
+        self.assertFalse(lut[0].any())
+        self.assertEqual(lut[1].tolist(), [255, 0, 0, 255])
+        self.assertFalse(lut[2].any())
+        self.assertEqual(lut[3].tolist(), [0, 200, 255, 255])
+        self.assertFalse(lut[4:].any())
+
+
+class ApplyLutTest(SimpleTestCase):
+    def test_apply_lut(self):
+        lut = palette_lut(["ff0000", "00ff00"])
+        data = np.array([[0, 1], [2, 3]], dtype=np.uint8)
+
+        res = apply_lut(data, lut)
+
+        self.assertEqual(res.shape, (2, 2, 4))
+        self.assertEqual(res[0, 1].tolist(), [255, 0, 0, 255])
+        self.assertEqual(res[1, 0].tolist(), [0, 255, 0, 255])
+        self.assertFalse(res[0, 0].any())
+        self.assertFalse(res[1, 1].any())
+
+    def test_values_out_of_range_are_transparent(self):
+        lut = np.full((256, 4), 255, dtype=np.uint8)
+        data = np.array([[-1, 0], [255, 256]], dtype=np.int16)
+
+        res = apply_lut(data, lut)
+
+        self.assertEqual(res[..., 3].tolist(), [[0, 255], [255, 0]])
+
+    def test_cmap_lut_is_cached_and_read_only(self):
+        cmap = [(0, "#000000"), (1, "#ffffff")]
+
+        lut = cmap_lut(cmap)
+
+        self.assertIs(cmap_lut([list(entry) for entry in cmap]), lut)
+        self.assertFalse(lut.flags.writeable)
+        self.assertEqual(lut[0].tolist(), [0, 0, 0, 255])
+        self.assertEqual(lut[255].tolist(), [255, 255, 255, 255])
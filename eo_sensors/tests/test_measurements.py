@@ -0,0 +1,155 @@
+import os
+from datetime import date
+
+import numpy as np
+from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.test import TestCase
+from eo_sensors.models import (
+    CoverageMask,
+    CoverageMaskPart,
+    CoverageMeasurement,
+    Raster,
+    Sources,
+)
+from eo_sensors.tests.helpers import (
+    TRANSFORM,
+    TemporaryDirectoryMixin,
+    temporary_step_cache,
+    write_raster,
+)
+from eo_sensors.utils import (
+    generate_measurements,
+    generate_raster_measurements,
+    multipolygon_to_geos,
+)
+from scopes.models import Scope
+from shapely.geometry import MultiPolygon as ShapelyMultiPolygon
+
+DATE = date(2021, 1, 31)
+KINDS_PER_VALUE = {1: "LS", 2: "CL"}
+
+
+def pixel_multipolygon(col_off, row_off, width, height):
+    """Multipolygon (in EPSG:4326) of a window of pixels of `TRANSFORM`"""
+    left, top = TRANSFORM * (col_off, row_off)
+    right, bottom = TRANSFORM * (col_off + width, row_off + height)
+    polygon = Polygon.from_bbox((left, bottom, right, top))
+    polygon.srid = 32718
+    return MultiPolygon(polygon.transform(4326, clone=True), srid=4326)
+
+
+class MeasurementsTest(TemporaryDirectoryMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # A scope of 100x100 pixels (1 km2), where the left half is lomas and
+        # the top 20 rows of the right half are clouds
+        self.scope = Scope.objects.create(
+            name="Scope",
+            scope_type=Scope.USER_DEFINED,
+            geom=pixel_multipolygon(0, 0, 100, 100),
+        )
+        raster = Raster.objects.create(
+            slug="s2-loss", date=DATE, source=Sources.SEN2, name="Loss"
+        )
+        self.masks = [
+            CoverageMask.objects.create(
+                date=DATE, source=Sources.SEN2, kind=kind, raster=raster, geom=geom
+            )
+            for kind, geom in [
+                ("LS", pixel_multipolygon(0, 0, 50, 100)),
+                ("CL", pixel_multipolygon(50, 0, 50, 20)),
+            ]
+        ]
+
+    def assertMeasurements(self, expected, *, delta):
+        measurements = CoverageMeasurement.objects.filter(scope=self.scope)
+        self.assertEqual(sorted(m.kind for m in measurements), sorted(expected))
+        for m in measurements:
+            self.assertEqual((m.date, m.source), (DATE, Sources.SEN2))
+            self.assertAlmostEqual(m.area, expected[m.kind], delta=delta)
+            self.assertAlmostEqual(m.perc_area, expected[m.kind] / 1e6, places=4)
+
+    def test_mask_parts(self):
+        for mask in self.masks:
+            parts = CoverageMaskPart.objects.filter(mask=mask)
+            self.assertTrue(parts.exists())
+            mask.refresh_from_db()
+            self.assertAlmostEqual(
+                sum(p.geom.area for p in parts), mask.geom_utm.area, delta=1
+            )
+
+    def test_generate_measurements(self):
+        generate_measurements(self.masks, [self.scope])
+
+        self.assertMeasurements(dict(LS=500000, CL=100000), delta=1)
+
+        # Measurements are updated in place
+        self.masks[0].geom = pixel_multipolygon(0, 0, 25, 100)
+        self.masks[0].save()
+        generate_measurements(self.masks, [self.scope])
+
+        self.assertMeasurements(dict(LS=250000, CL=100000), delta=1)
+
+    def test_generate_measurements_simplified(self):
+        generate_measurements(self.masks, [self.scope], simplify=1)
+
+        self.assertMeasurements(dict(LS=500000, CL=100000), delta=1)
+
+    def test_generate_raster_measurements(self):
+        data = np.zeros((100, 100), dtype=np.uint8)
+        data[:, :50] = 1
+        data[:20, 50:] = 2
+        path = write_raster(os.path.join(self.tmpdir, "loss.tif"), data)
+
+        with temporary_step_cache():
+            generate_raster_measurements(
+                self.masks,
+                [self.scope],
+                cov_raster_path=path,
+                kinds_per_value=KINDS_PER_VALUE,
+            )
+            self.assertMeasurements(dict(LS=500000, CL=100000), delta=1e-6)
+
+            # Measurements are updated in place
+            data[:, 25:50] = 0
+            write_raster(path, data)
+            generate_raster_measurements(
+                self.masks,
+                [self.scope],
+                cov_raster_path=path,
+                kinds_per_value=KINDS_PER_VALUE,
+            )
+
+        self.assertMeasurements(dict(LS=250000, CL=100000), delta=1e-6)
+
+    def test_same_measurements_from_raster_and_masks(self):
+        data = np.zeros((100, 100), dtype=np.uint8)
+        data[:, :50] = 1
+        data[:20, 50:] = 2
+        path = write_raster(os.path.join(self.tmpdir, "loss.tif"), data)
+
+        generate_measurements(self.masks, [self.scope])
+        vector_areas = {
+            m.kind: m.area for m in CoverageMeasurement.objects.filter(scope=self.scope)
+        }
+        with temporary_step_cache():
+            generate_raster_measurements(
+                self.masks,
+                [self.scope],
+                cov_raster_path=path,
+                kinds_per_value=KINDS_PER_VALUE,
+            )
+
+        self.assertMeasurements(vector_areas, delta=1)
+
+    def test_empty_mask(self):
+        mask = self.masks[1]
+        mask.geom = multipolygon_to_geos(ShapelyMultiPolygon())
+        mask.save()
+
+        mask.refresh_from_db()
+        self.assertTrue(mask.geom.empty)
+        self.assertFalse(CoverageMaskPart.objects.filter(mask=mask).exists())
+        generate_measurements(self.masks, [self.scope])
+
+        self.assertMeasurements(dict(LS=500000, CL=0), delta=1)
@@ -0,0 +1,106 @@
+import os
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+from eo_sensors.tests.helpers import TemporaryDirectoryMixin, write_raster
+from eo_sensors.utils import percentiles
+from eo_sensors.utils.percentiles import (
+    dkw_error,
+    dkw_sample_size,
+    raster_percentiles,
+)
+
+
+class RasterPercentilesTest(TemporaryDirectoryMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(0)
+        # Two bands with different distributions, and a nodata stripe
+        data = np.stack(
+            [
+                rng.normal(1000, 200, (600, 800)),
+                rng.exponential(300, (600, 800)) + 1,
+            ]
+        )
+        data = np.clip(data, 1, 65535).astype(np.uint16)
+        data[:, :, :100] = 0
+        self.data = data
+        self.paths = [
+            write_raster(
+                os.path.join(self.tmpdir, f"{i}.tif"),
+                data[:, i * 300 : (i + 1) * 300],
+                nodata=0,
+                block_size=64,
+            )
+            for i in range(2)
+        ]
+
+    def test_percentiles_within_max_error(self):
+        max_error = 0.01
+
+        res = raster_percentiles(self.paths, max_error=max_error, n_jobs=2)
+
+        self.assertEqual(len(res), 2)
+        for band, (low, high) in zip(self.data, res):
+            values = band[band != 0]
+            # Compare ranks of estimated percentiles, with some slack for
+            # ties of integer values
+            self.assertLessEqual(np.mean(values < low), 0.02 + max_error)
+            self.assertGreaterEqual(np.mean(values <= low), 0.02 - max_error)
+            self.assertLessEqual(np.mean(values < high), 0.98 + max_error)
+            self.assertGreaterEqual(np.mean(values <= high), 0.98 - max_error)
+
+    def test_small_rasters_are_read_whole(self):
+        res = raster_percentiles(self.paths, max_error=0.0001)
+
+        for band, (low, high) in zip(self.data, res):
+            values = band[band != 0]
+            self.assertEqual((low, high), tuple(np.percentile(values, [2, 98])))
+
+    def test_same_seed_same_result(self):
+        self.assertEqual(
+            raster_percentiles(self.paths, max_error=0.02, seed=1),
+            raster_percentiles(self.paths, max_error=0.02, seed=1),
+        )
+
+    def test_cache(self):
+        cache_path = os.path.join(self.tmpdir, "percentiles.json")
+        res = raster_percentiles(self.paths, max_error=0.02, cache_path=cache_path)
+
+        with mock.patch.object(
+            percentiles, "sample_raster", wraps=percentiles.sample_raster
+        ) as sample_raster:
+            self.assertEqual(
+                raster_percentiles(self.paths, max_error=0.02, cache_path=cache_path),
+                res,
+            )
+            sample_raster.assert_not_called()
+
+            # Parameters changed, so percentiles are computed again
+            raster_percentiles(
+                self.paths, upper_cut=50, max_error=0.02, cache_path=cache_path
+            )
+            self.assertEqual(sample_raster.call_count, len(self.paths))
+
+    def test_no_valid_pixels(self):
+        path = write_raster(
+            os.path.join(self.tmpdir, "empty.tif"),
+            np.zeros((1, 64, 64), dtype=np.uint16),
+            nodata=0,
+        )
+
+        with self.assertRaises(ValueError):
+            raster_percentiles([path])
+
+
+class DKWTest(SimpleTestCase):
+    def test_sample_size(self):
+        self.assertEqual(dkw_sample_size(0.005, 0.99), 105967)
+        for max_error, confidence in [(0.005, 0.99), (0.01, 0.95), (0.05, 0.5)]:
+            n = dkw_sample_size(max_error, confidence)
+            self.assertLessEqual(dkw_error(n, confidence), max_error)
+            self.assertGreater(dkw_error(n - 1, confidence), max_error)
+
+    def test_error_without_samples(self):
+        self.assertEqual(dkw_error(0, 0.99), 1.0)
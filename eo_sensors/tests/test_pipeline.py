@@ -0,0 +1,162 @@
+import os
+
+import numpy as np
+import rasterio
+from django.test import SimpleTestCase
+from eo_sensors.tests.helpers import (
+    TRANSFORM,
+    TemporaryDirectoryMixin,
+    read_raster,
+    write_raster,
+)
+from eo_sensors.utils.pipeline import process_blocks, reduce_blocks, sliding_windows
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+
+class ProcessBlocksTest(TemporaryDirectoryMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(0)
+        self.a = rng.integers(0, 1000, (2, 300, 500), dtype=np.uint16)
+        self.b = rng.integers(0, 1000, (1, 300, 500), dtype=np.uint16)
+        self.a_path = write_raster(
+            os.path.join(self.tmpdir, "a.tif"), self.a, block_size=128
+        )
+        self.b_path = write_raster(
+            os.path.join(self.tmpdir, "b.tif"), self.b, block_size=128
+        )
+
+    def test_same_result_as_whole_arrays(self):
+        dst_path = os.path.join(self.tmpdir, "dst.tif")
+
+        stats = process_blocks(
+            lambda a, b: a.astype(np.float32) * 2 + b,
+            [self.a_path, self.b_path],
+            [dst_path],
+            n_jobs=2,
+        )
+
+        self.assertEqual(stats["blocks"], 3 * 4)
+        self.assertEqual(stats["skipped"], 0)
+        expected = self.a.astype(np.float32) * 2 + self.b
+        np.testing.assert_array_equal(read_raster(dst_path), expected)
+        with rasterio.open(dst_path) as dst:
+            self.assertEqual(dst.dtypes, ("float32", "float32"))
+            self.assertEqual(dst.transform, TRANSFORM)
+
+    def test_unordered_multiple_outputs(self):
+        sum_path = os.path.join(self.tmpdir, "sum.tif")
+        diff_path = os.path.join(self.tmpdir, "diff.tif")
+
+        process_blocks(
+            lambda a, b: (a + b, a.astype(np.int32) - b),
+            [self.a_path, self.b_path],
+            [sum_path, diff_path],
+            indexes=[[2], None],
+            profiles=[dict(dtype="uint16"), {}],
+            n_jobs=2,
+            ordered=False,
+        )
+
+        np.testing.assert_array_equal(read_raster(sum_path), self.a[1:] + self.b)
+        np.testing.assert_array_equal(
+            read_raster(diff_path), self.a[1:].astype(np.int32) - self.b
+        )
+
+    def test_window(self):
+        dst_path = os.path.join(self.tmpdir, "dst.tif")
+        window = Window(10, 20, 100, 50)
+
+        process_blocks(
+            lambda block, a: np.full(a.shape, block.col_off, dtype=np.uint16) + a,
+            [self.a_path],
+            [dst_path],
+            window=window,
+            windows=sliding_windows(32, 100, 50),
+            pass_window=True,
+        )
+
+        with rasterio.open(dst_path) as dst:
+            self.assertEqual((dst.width, dst.height), (100, 50))
+            self.assertEqual(dst.transform, TRANSFORM * TRANSFORM.translation(10, 20))
+            img = dst.read()
+        crop = self.a[:, 20:70, 10:110]
+        col_offs = np.arange(100) // 32 * 32
+        np.testing.assert_array_equal(img, crop + col_offs)
+
+    def test_skip_empty(self):
+        data = np.ones((1, 256, 256), dtype=np.uint8)
+        data[:, :128, :128] = 0
+        src_path = write_raster(
+            os.path.join(self.tmpdir, "src.tif"), data, nodata=0, block_size=128
+        )
+        dst_path = os.path.join(self.tmpdir, "dst.tif")
+        calls = []
+
+        def func(img):
+            calls.append(img)
+            return img * 2
+
+        stats = process_blocks(func, [src_path], [dst_path], skip_empty=True)
+
+        self.assertEqual(stats["blocks"], 3)
+        self.assertEqual(stats["skipped"], 1)
+        self.assertEqual(len(calls), 3)
+        np.testing.assert_array_equal(read_raster(dst_path), data * 2)
+
+    def test_different_grids(self):
+        other_path = write_raster(
+            os.path.join(self.tmpdir, "other.tif"),
+            self.b,
+            transform=from_origin(0, 0, 10, 10),
+        )
+
+        with self.assertRaises(ValueError):
+            process_blocks(
+                lambda a, b: a,
+                [self.a_path, other_path],
+                [os.path.join(self.tmpdir, "dst.tif")],
+            )
+
+
+class ReduceBlocksTest(TemporaryDirectoryMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = np.random.default_rng(0).integers(
+            0, 10, (1, 300, 500), dtype=np.uint8
+        )
+        self.path = write_raster(
+            os.path.join(self.tmpdir, "src.tif"), self.data, nodata=0, block_size=128
+        )
+
+    def test_sum_of_results(self):
+        hist = reduce_blocks(
+            lambda img: np.bincount(img.ravel(), minlength=10),
+            [self.path],
+            n_jobs=2,
+        )
+
+        np.testing.assert_array_equal(hist, np.bincount(self.data.ravel()))
+
+    def test_concatenate_lists(self):
+        res = reduce_blocks(
+            lambda block, img: [(block.row_off, block.col_off)],
+            [self.path],
+            windows=sliding_windows(200, 500, 300),
+            pass_window=True,
+        )
+
+        # Results are added in block order
+        self.assertEqual(
+            res, [(0, 0), (0, 200), (0, 400), (200, 0), (200, 200), (200, 400)]
+        )
+
+    def test_no_blocks_processed(self):
+        path = write_raster(
+            os.path.join(self.tmpdir, "empty.tif"),
+            np.zeros((1, 64, 64), dtype=np.uint8),
+            nodata=0,
+        )
+
+        self.assertIsNone(reduce_blocks(np.sum, [path], skip_empty=True))
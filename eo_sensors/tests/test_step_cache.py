@@ -0,0 +1,174 @@
+import os
+
+from django.test import SimpleTestCase
+from eo_sensors.tests.helpers import TemporaryDirectoryMixin, temporary_step_cache
+from eo_sensors.utils.step_cache import StepCache, cached_step, restore_step
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+def read_file(path):
+    with open(path) as f:
+        return f.read()
+
+
+class StepCacheTest(TemporaryDirectoryMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = StepCache(os.path.join(self.tmpdir, "cache"), max_size=1024)
+        self.input = write_file(os.path.join(self.tmpdir, "input.txt"), "input")
+
+    def test_store_and_restore(self):
+        output = write_file(os.path.join(self.tmpdir, "output.txt"), "output")
+        key = self.cache.step_key("step", inputs=[self.input])
+        self.cache.store(key, "step", [output])
+        os.remove(output)
+
+        self.assertTrue(self.cache.restore(key, [output]))
+        self.assertEqual(read_file(output), "output")
+
+    def test_store_and_restore_directory(self):
+        output = os.path.join(self.tmpdir, "output")
+        write_file(os.path.join(output, "a.txt"), "a")
+        write_file(os.path.join(output, "b", "c.txt"), "c")
+        key = self.cache.step_key("step", inputs=[self.input])
+        self.cache.store(key, "step", [output])
+
+        dst = os.path.join(self.tmpdir, "restored")
+        self.assertTrue(self.cache.restore(key, [dst]))
+        self.assertEqual(read_file(os.path.join(dst, "a.txt")), "a")
+        self.assertEqual(read_file(os.path.join(dst, "b", "c.txt")), "c")
+
+    def test_restore_missing_entry(self):
+        key = self.cache.step_key("step", inputs=[self.input])
+        output = os.path.join(self.tmpdir, "output.txt")
+
+        self.assertFalse(self.cache.restore(key, [output]))
+        self.assertFalse(os.path.exists(output))
+
+    def test_restore_incomplete_entry(self):
+        output = write_file(os.path.join(self.tmpdir, "output.txt"), "output")
+        key = self.cache.step_key("step", inputs=[self.input])
+        self.cache.store(key, "step", [output])
+        os.remove(os.path.join(self.cache._entry_dir(key), "0"))
+
+        self.assertFalse(self.cache.restore(key, [output]))
+        # Entry is deleted
+        self.assertFalse(os.path.exists(self.cache._entry_dir(key)))
+
+    def test_store_missing_output(self):
+        key = self.cache.step_key("step", inputs=[self.input])
+
+        with self.assertRaises(RuntimeError):
+            self.cache.store(key, "step", [os.path.join(self.tmpdir, "missing")])
+
+    def test_step_key(self):
+        key = self.cache.step_key("step", inputs=[self.input], params=dict(a=1))
+
+        # Keys depend on contents of inputs, not on their paths
+        other = write_file(os.path.join(self.tmpdir, "other", "input.txt"), "input")
+        self.assertEqual(
+            self.cache.step_key("step", inputs=[other], params=dict(a=1)), key
+        )
+        for other_key in [
+            self.cache.step_key("other", inputs=[self.input], params=dict(a=1)),
+            self.cache.step_key("step", inputs=[self.input], params=dict(a=2)),
+            self.cache.step_key(
+                "step", inputs=[self.input], params=dict(a=1), version=2
+            ),
+        ]:
+            self.assertNotEqual(other_key, key)
+
+        write_file(self.input, "changed")
+        self.assertNotEqual(
+            self.cache.step_key("step", inputs=[self.input], params=dict(a=1)), key
+        )
+
+    def test_gc_evicts_least_recently_used(self):
+        cache = StepCache(os.path.join(self.tmpdir, "small"), max_size=25)
+        keys = []
+        for i in range(3):
+            output = write_file(os.path.join(self.tmpdir, f"{i}.txt"), f"output-{i}.")
+            key = cache.step_key("step", inputs=[self.input], params=dict(i=i))
+            cache.store(key, "step", [output])
+            keys.append(key)
+            if i == 1:
+                # Use first entry, so that the second one is evicted instead
+                cache.restore(keys[0], [os.path.join(self.tmpdir, "0.txt")])
+
+        output = os.path.join(self.tmpdir, "restored.txt")
+        self.assertTrue(cache.restore(keys[0], [output]))
+        self.assertFalse(cache.restore(keys[1], [output]))
+        self.assertTrue(cache.restore(keys[2], [output]))
+
+
+class CachedStepTest(TemporaryDirectoryMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.input = write_file(os.path.join(self.tmpdir, "input.txt"), "input")
+        self.output = os.path.join(self.tmpdir, "output.txt")
+        self.runs = 0
+
+    def run_step(self, content="output"):
+        with cached_step(
+            "step", inputs=[self.input], outputs=[self.output], params=dict(a=1)
+        ) as step:
+            if not step.cached:
+                self.runs += 1
+                write_file(self.output, content)
+        return step
+
+    def test_cache_hit_restores_outputs(self):
+        with temporary_step_cache():
+            self.assertFalse(self.run_step().cached)
+            with open(self.output, "rb") as f:
+                expected = f.read()
+            os.remove(self.output)
+
+            self.assertTrue(self.run_step(content="other").cached)
+
+        self.assertEqual(self.runs, 1)
+        with open(self.output, "rb") as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_changed_input_runs_step_again(self):
+        with temporary_step_cache():
+            self.run_step()
+            write_file(self.input, "changed")
+
+            self.assertFalse(self.run_step(content="other").cached)
+
+        self.assertEqual(self.runs, 2)
+        self.assertEqual(read_file(self.output), "other")
+
+    def test_failed_step_is_not_cached(self):
+        with temporary_step_cache():
+            with self.assertRaises(ValueError):
+                with cached_step("step", inputs=[self.input], outputs=[self.output]):
+                    write_file(self.output, "partial")
+                    raise ValueError
+
+            self.assertFalse(
+                restore_step("step", inputs=[self.input], outputs=[self.output])
+            )
+
+    def test_restore_step(self):
+        with temporary_step_cache():
+            self.run_step()
+            os.remove(self.output)
+
+            self.assertTrue(
+                restore_step(
+                    "step",
+                    inputs=[self.input],
+                    outputs=[self.output],
+                    params=dict(a=1),
+                )
+            )
+
+        self.assertEqual(read_file(self.output), "output")
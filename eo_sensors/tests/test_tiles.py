@@ -0,0 +1,201 @@
+import os
+
+import numpy as np
+import rasterio
+from django.test import SimpleTestCase
+from eo_sensors.tests.helpers import TemporaryDirectoryMixin, write_raster
+from eo_sensors.tiles import (
+    TILE_SIZE,
+    WEB_MERCATOR_CRS,
+    block_manifest,
+    dirty_tiles,
+    overview_tile,
+    tile_range,
+)
+from rasterio.warp import transform, transform_bounds
+
+LEVELS = (10, 15)
+BLOCK_SIZE = 64
+
+
+class BlockManifestTest(TemporaryDirectoryMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = np.random.default_rng(0).integers(
+            1, 255, (3, 300, 400), dtype=np.uint8
+        )
+        self.path = write_raster(os.path.join(self.tmpdir, "src.tif"), self.data)
+
+    def manifest(self, path, **kwargs):
+        return block_manifest(path, levels=LEVELS, block_size=100, **kwargs)
+
+    def test_blocks(self):
+        manifest = self.manifest(self.path)
+
+        self.assertEqual(
+            set(manifest["blocks"]),
+            {f"{row}/{col}" for row in (0, 100, 200) for col in (0, 100, 200, 300)},
+        )
+        self.assertEqual(manifest["meta"]["levels"], list(LEVELS))
+        self.assertEqual(manifest["meta"]["block_size"], 100)
+
+    def test_same_manifest_for_same_pixels(self):
+        other_path = write_raster(os.path.join(self.tmpdir, "other.tif"), self.data)
+
+        self.assertEqual(
+            self.manifest(self.path, n_jobs=1), self.manifest(other_path, n_jobs=4)
+        )
+
+    def test_only_modified_block_changes(self):
+        data = self.data.copy()
+        data[1, 150, 250] += 1
+        other_path = write_raster(os.path.join(self.tmpdir, "other.tif"), data)
+
+        old, new = self.manifest(self.path), self.manifest(other_path)
+
+        self.assertEqual(old["meta"], new["meta"])
+        self.assertEqual(
+            [key for key in old["blocks"] if old["blocks"][key] != new["blocks"][key]],
+            ["100/200"],
+        )
+
+
+class DirtyTilesTest(TemporaryDirectoryMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = np.random.default_rng(0).integers(
+            1, 255, (1, 1024, 1024), dtype=np.uint8
+        )
+        self.old_path = write_raster(os.path.join(self.tmpdir, "old.tif"), self.data)
+        self.old_manifest = self.manifest(self.old_path)
+
+    def manifest(self, path, levels=LEVELS):
+        return block_manifest(path, levels=levels, block_size=BLOCK_SIZE)
+
+    def modify(self, row, col):
+        data = self.data.copy()
+        data[0, row, col] += 1
+        path = write_raster(os.path.join(self.tmpdir, "new.tif"), data)
+        return path, self.manifest(path)
+
+    def base_tile(self, path, row, col):
+        """Tile at max zoom level that contains the center of a pixel"""
+        with rasterio.open(path) as src:
+            x, y = src.xy(row, col)
+            crs = src.crs
+        xs, ys = transform(crs, WEB_MERCATOR_CRS, [x], [y])
+        min_x, min_y, _, _ = tile_range((xs[0], ys[0], xs[0], ys[0]), LEVELS[1])
+        return min_x, min_y
+
+    def test_unchanged_raster(self):
+        self.assertEqual(
+            dirty_tiles(self.old_path, self.old_manifest, self.old_manifest), set()
+        )
+
+    def test_whole_pyramid_if_meta_changed(self):
+        new_manifest = self.manifest(self.old_path, levels=(10, 16))
+
+        self.assertIsNone(dirty_tiles(self.old_path, None, self.old_manifest))
+        self.assertIsNone(dirty_tiles(self.old_path, self.old_manifest, new_manifest))
+
+    def test_modified_block_and_ancestors(self):
+        row, col = 600, 300
+        new_path, new_manifest = self.modify(row, col)
+
+        dirty = dirty_tiles(new_path, self.old_manifest, new_manifest)
+
+        x, y = self.base_tile(new_path, row, col)
+        min_zoom, max_zoom = LEVELS
+        for z in range(max_zoom, min_zoom - 1, -1):
+            shift = max_zoom - z
+            self.assertIn((x >> shift, y >> shift, z), dirty)
+        # Only tiles of the modified block (and their ancestors) are dirty
+        self.assertEqual({z for _, _, z in dirty}, set(range(min_zoom, max_zoom + 1)))
+        with rasterio.open(new_path) as src:
+            bounds = transform_bounds(src.crs, WEB_MERCATOR_CRS, *src.bounds)
+        min_x, min_y, max_x, max_y = tile_range(bounds, max_zoom)
+        all_tiles = (max_x - min_x + 1) * (max_y - min_y + 1)
+        base_tiles = [(tx, ty) for tx, ty, z in dirty if z == max_zoom]
+        self.assertLess(len(base_tiles), all_tiles)
+        for tx, ty in base_tiles:
+            self.assertLessEqual(abs(tx - x), 1)
+            self.assertLessEqual(abs(ty - y), 1)
+
+
+class OverviewTileTest(SimpleTestCase):
+    def rgba_tile(self, color, alpha=255):
+        tile = np.empty((4, TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+        tile[:3] = np.array(color, dtype=np.uint8)[:, np.newaxis, np.newaxis]
+        tile[3] = alpha
+        return tile
+
+    def test_no_children(self):
+        self.assertIsNone(overview_tile({}))
+        self.assertIsNone(overview_tile({(0, 0): None, (1, 1): None}))
+
+    def test_quadrants(self):
+        colors = {
+            (0, 0): (255, 0, 0),
+            (1, 0): (0, 255, 0),
+            (0, 1): (0, 0, 255),
+            (1, 1): (10, 20, 30),
+        }
+
+        tile = overview_tile({k: self.rgba_tile(c) for k, c in colors.items()})
+
+        half = TILE_SIZE // 2
+        self.assertEqual(tile.shape, (4, TILE_SIZE, TILE_SIZE))
+        self.assertEqual(tile.dtype, np.uint8)
+        for (dx, dy), color in colors.items():
+            quadrant = tile[
+                :, dy * half : (dy + 1) * half, dx * half : (dx + 1) * half
+            ]
+            self.assertTrue((quadrant[:3].T == color).all())
+            self.assertTrue((quadrant[3] == 255).all())
+
+    def test_missing_children_are_transparent(self):
+        tile = overview_tile({(1, 0): self.rgba_tile((255, 0, 0)), (0, 1): None})
+
+        half = TILE_SIZE // 2
+        self.assertTrue((tile[3, :half, half:] == 255).all())
+        self.assertFalse(tile[3, half:, :].any())
+        self.assertFalse(tile[3, :, :half].any())
+
+    def test_transparent_pixels_do_not_darken_colors(self):
+        child = self.rgba_tile((200, 100, 50))
+        # A transparent black pixel on each 2x2 block
+        child[:, ::2, ::2] = 0
+
+        tile = overview_tile({(0, 0): child})
+
+        half = TILE_SIZE // 2
+        quadrant = tile[:, :half, :half]
+        self.assertTrue((quadrant[:3].T == (200, 100, 50)).all())
+        self.assertTrue((quadrant[3] == (3 * 255 + 2) // 4).all())
+
+    def test_fully_transparent(self):
+        self.assertIsNone(overview_tile({(0, 0): self.rgba_tile((255, 0, 0), 0)}))
+
+    def test_paletted_takes_most_frequent_class(self):
+        child = np.zeros((1, TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+        # Blocks of [[2, 1], [1, 0]]: 1 is the most frequent class
+        child[0, ::2, ::2] = 2
+        child[0, ::2, 1::2] = 1
+        child[0, 1::2, ::2] = 1
+
+        tile = overview_tile({(1, 1): child})
+
+        half = TILE_SIZE // 2
+        self.assertEqual(tile.shape, (1, TILE_SIZE, TILE_SIZE))
+        self.assertTrue((tile[0, half:, half:] == 1).all())
+        self.assertFalse(tile[0, :half].any())
+        self.assertFalse(tile[0, :, :half].any())
+
+    def test_paletted_ignores_transparent_pixels(self):
+        child = np.zeros((1, TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+        child[0, ::2, ::2] = 3
+
+        tile = overview_tile({(0, 0): child})
+
+        half = TILE_SIZE // 2
+        self.assertTrue((tile[0, :half, :half] == 3).all())
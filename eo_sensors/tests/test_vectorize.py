@@ -0,0 +1,159 @@
+import os
+
+import numpy as np
+from django.test import SimpleTestCase
+from eo_sensors.tests.helpers import TRANSFORM, TemporaryDirectoryMixin, write_raster
+from eo_sensors.utils.vectorize import (
+    as_multipolygon,
+    parallel_union,
+    polygonize,
+    reproject_geometry,
+)
+from rasterio.warp import transform
+from shapely.geometry import (
+    GeometryCollection,
+    LineString,
+    MultiPolygon,
+    Point,
+    Polygon,
+    box,
+)
+from shapely.ops import unary_union
+
+PIXEL_AREA = 10 * 10
+
+
+class ParallelUnionTest(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # Touching and overlapping squares, with some holes between them
+        self.geoms = [
+            box(x, y, x + size, y + size)
+            for x, y, size in zip(
+                rng.integers(0, 100, 2000),
+                rng.integers(0, 100, 2000),
+                rng.choice([1, 1.5, 3], 2000),
+            )
+        ]
+
+    def test_same_result_as_unary_union(self):
+        expected = unary_union(self.geoms)
+
+        res = parallel_union(self.geoms, n_jobs=2, min_size=0)
+
+        self.assertAlmostEqual(res.area, expected.area)
+        self.assertAlmostEqual(res.symmetric_difference(expected).area, 0)
+        self.assertEqual(
+            len(as_multipolygon(res).geoms), len(as_multipolygon(expected).geoms)
+        )
+
+    def test_small_inputs_are_merged_at_once(self):
+        res = parallel_union(self.geoms[:10], n_jobs=2)
+
+        self.assertTrue(res.equals(unary_union(self.geoms[:10])))
+
+
+class PolygonizeTest(TemporaryDirectoryMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        data = np.zeros((200, 200), dtype=np.uint8)
+        # A square across the edges of 4 blocks, with a hole
+        data[40:90, 40:90] = 1
+        data[60:70, 60:70] = 0
+        # Two separate squares of another value
+        data[150:160, 10:30] = 2
+        data[150:160, 150:170] = 2
+        # Nodata
+        data[180:, 180:] = 255
+        self.path = write_raster(
+            os.path.join(self.tmpdir, "src.tif"), data, nodata=255, block_size=64
+        )
+
+    def test_polygons_by_value(self):
+        res = polygonize(self.path, n_jobs=2)
+
+        self.assertEqual(set(res), {1, 2})
+        for geom in res.values():
+            self.assertIsInstance(geom, MultiPolygon)
+
+        # Parts cut by block edges are dissolved
+        self.assertEqual(len(res[1].geoms), 1)
+        self.assertEqual(len(res[1].geoms[0].interiors), 1)
+        self.assertAlmostEqual(res[1].area, (50 * 50 - 10 * 10) * PIXEL_AREA)
+        left, top = TRANSFORM * (40, 40)
+        right, bottom = TRANSFORM * (90, 90)
+        self.assertEqual(res[1].bounds, (left, bottom, right, top))
+
+        self.assertEqual(len(res[2].geoms), 2)
+        self.assertAlmostEqual(res[2].area, 2 * 10 * 20 * PIXEL_AREA)
+
+    def test_polygons_on_other_crs(self):
+        res = polygonize(self.path, dst_crs="EPSG:4326")
+
+        left, top = TRANSFORM * (40, 40)
+        right, bottom = TRANSFORM * (90, 90)
+        (lon_min, lon_max), (lat_min, lat_max) = transform(
+            "EPSG:32718", "EPSG:4326", [left, right], [bottom, top]
+        )
+        for v, expected in zip(res[1].bounds, (lon_min, lat_min, lon_max, lat_max)):
+            self.assertAlmostEqual(v, expected, places=4)
+
+    def test_empty_raster(self):
+        path = write_raster(
+            os.path.join(self.tmpdir, "empty.tif"), np.zeros((64, 64), dtype=np.uint8)
+        )
+
+        self.assertEqual(polygonize(path), {})
+
+
+class ReprojectGeometryTest(SimpleTestCase):
+    def test_pixel_coordinates(self):
+        geom = Polygon(
+            [(0, 0), (10, 0), (10, 10), (0, 10)], [[(2, 2), (4, 2), (4, 4), (2, 4)]]
+        )
+
+        res = reproject_geometry(geom, TRANSFORM, "EPSG:32718")
+
+        self.assertIsInstance(res, MultiPolygon)
+        self.assertEqual(len(res.geoms), 1)
+        polygon = res.geoms[0]
+        self.assertEqual(
+            list(polygon.exterior.coords),
+            [TRANSFORM * xy for xy in geom.exterior.coords],
+        )
+        self.assertEqual(
+            list(polygon.interiors[0].coords),
+            [TRANSFORM * xy for xy in geom.interiors[0].coords],
+        )
+        self.assertAlmostEqual(res.area, (100 - 4) * PIXEL_AREA)
+
+    def test_other_crs(self):
+        geom = MultiPolygon([box(0, 0, 1, 1), box(5, 5, 6, 6)])
+
+        res = reproject_geometry(geom, TRANSFORM, "EPSG:32718", "EPSG:4326")
+
+        self.assertEqual(len(res.geoms), 2)
+        for polygon, part in zip(res.geoms, geom.geoms):
+            xs, ys = zip(*[TRANSFORM * xy for xy in part.exterior.coords])
+            lons, lats = transform("EPSG:32718", "EPSG:4326", xs, ys)
+            np.testing.assert_allclose(
+                np.array(polygon.exterior.coords), np.column_stack([lons, lats])
+            )
+
+    def test_empty_geometry(self):
+        res = reproject_geometry(GeometryCollection(), TRANSFORM, "EPSG:32718")
+
+        self.assertTrue(res.is_empty)
+
+
+class AsMultipolygonTest(SimpleTestCase):
+    def test_as_multipolygon(self):
+        polygon = box(0, 0, 1, 1)
+        collection = GeometryCollection(
+            [polygon, Point(5, 5), LineString([(0, 0), (2, 2)])]
+        )
+
+        self.assertEqual(list(as_multipolygon(polygon).geoms), [polygon])
+        self.assertEqual(list(as_multipolygon(collection).geoms), [polygon])
+        multipolygon = MultiPolygon([polygon])
+        self.assertIs(as_multipolygon(multipolygon), multipolygon)
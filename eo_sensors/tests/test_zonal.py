@@ -0,0 +1,152 @@
+import math
+import os
+
+import numpy as np
+from django.test import SimpleTestCase
+from eo_sensors.tests.helpers import (
+    CRS,
+    TRANSFORM,
+    TemporaryDirectoryMixin,
+    temporary_step_cache,
+    write_raster,
+)
+from eo_sensors.utils.zonal import (
+    EARTH_RADIUS,
+    pack_layers,
+    pixel_row_areas,
+    zonal_areas,
+)
+from rasterio.crs import CRS as RasterioCRS
+from rasterio.transform import from_origin
+from rasterio.warp import transform_geom
+from shapely.geometry import box, mapping
+
+PIXEL_AREA = 10 * 10
+
+
+def pixel_box(col_off, row_off, width, height):
+    """GeoJSON geometry (in EPSG:4326) of a window of pixels of `TRANSFORM`"""
+    left, top = TRANSFORM * (col_off, row_off)
+    right, bottom = TRANSFORM * (col_off + width, row_off + height)
+    return transform_geom(CRS, "EPSG:4326", mapping(box(left, bottom, right, top)))
+
+
+class ZonalAreasTest(TemporaryDirectoryMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = np.random.default_rng(0).integers(
+            0, 4, (200, 300), dtype=np.uint8
+        )
+        self.path = write_raster(
+            os.path.join(self.tmpdir, "src.tif"), self.data, block_size=64
+        )
+
+    def expected_areas(self, col_off, row_off, width, height, *, ignore=(0,)):
+        window = self.data[row_off : row_off + height, col_off : col_off + width]
+        values, counts = np.unique(window, return_counts=True)
+        return {
+            int(v): float(c * PIXEL_AREA)
+            for v, c in zip(values, counts)
+            if v not in ignore
+        }
+
+    def test_areas_from_pixel_counts(self):
+        geoms = {"a": pixel_box(10, 20, 100, 50), "b": pixel_box(150, 100, 64, 64)}
+
+        with temporary_step_cache():
+            areas = zonal_areas(self.path, geoms, n_values=4, n_jobs=2)
+
+        self.assertEqual(set(areas), {"a", "b"})
+        for key, window in [("a", (10, 20, 100, 50)), ("b", (150, 100, 64, 64))]:
+            expected = self.expected_areas(*window, ignore=())
+            self.assertEqual(set(areas[key]), set(expected))
+            for value, area in expected.items():
+                self.assertAlmostEqual(areas[key][value], area, places=6)
+
+    def test_overlapping_geometries(self):
+        geoms = {1: pixel_box(0, 0, 100, 100), 2: pixel_box(50, 50, 100, 100)}
+
+        with temporary_step_cache():
+            areas = zonal_areas(self.path, geoms, n_values=4)
+
+        for key, window in [(1, (0, 0, 100, 100)), (2, (50, 50, 100, 100))]:
+            for value, area in self.expected_areas(*window, ignore=()).items():
+                self.assertAlmostEqual(areas[key][value], area, places=6)
+
+    def test_nodata_and_values_out_of_range(self):
+        path = write_raster(
+            os.path.join(self.tmpdir, "nodata.tif"), self.data, nodata=0
+        )
+        geoms = {"a": pixel_box(0, 0, 300, 200)}
+
+        with temporary_step_cache():
+            areas = zonal_areas(path, geoms, n_values=3)
+
+        self.assertEqual(
+            areas["a"], self.expected_areas(0, 0, 300, 200, ignore=(0, 3))
+        )
+
+    def test_geometry_outside_raster(self):
+        geoms = {"a": pixel_box(1000, 1000, 10, 10)}
+
+        with temporary_step_cache():
+            self.assertEqual(zonal_areas(self.path, geoms, n_values=4), {"a": {}})
+
+    def test_label_layers_are_cached(self):
+        geoms = {"a": pixel_box(10, 20, 100, 50)}
+
+        with temporary_step_cache() as cache:
+            areas = zonal_areas(self.path, geoms, n_values=4)
+            self.assertEqual(zonal_areas(self.path, geoms, n_values=4), areas)
+            with cache._connect() as conn:
+                steps = conn.execute("SELECT step FROM entries").fetchall()
+
+        self.assertEqual(steps, [("zonal.label_layers",)])
+
+
+class PackLayersTest(SimpleTestCase):
+    def test_disjoint_shapes_share_a_layer(self):
+        shapes = [box(0, 0, 1, 1), box(2, 0, 3, 1), box(0, 2, 1, 3)]
+
+        self.assertEqual(pack_layers(shapes), [0, 0, 0])
+
+    def test_touching_shapes_share_a_layer(self):
+        shapes = [box(0, 0, 1, 1), box(1, 0, 2, 1)]
+
+        self.assertEqual(pack_layers(shapes), [0, 0])
+
+    def test_overlapping_shapes(self):
+        shapes = [
+            box(0, 0, 2, 2),
+            box(1, 1, 4, 4),
+            box(3, 3, 5, 5),
+            box(1.5, 0, 2.5, 1),
+        ]
+
+        layers = pack_layers(shapes)
+
+        for i, a in enumerate(shapes):
+            for j, b in enumerate(shapes[i + 1 :], i + 1):
+                if a.overlaps(b):
+                    self.assertNotEqual(layers[i], layers[j])
+        # Larger shapes are assigned first
+        self.assertEqual(layers[1], 0)
+        self.assertEqual(max(layers), 1)
+
+
+class PixelRowAreasTest(SimpleTestCase):
+    def test_projected(self):
+        areas = pixel_row_areas(TRANSFORM, RasterioCRS.from_string(CRS), 3)
+
+        np.testing.assert_array_equal(areas, [PIXEL_AREA] * 3)
+
+    def test_geographic(self):
+        # A row of 1x1 degree pixels, south of the equator
+        areas = pixel_row_areas(
+            from_origin(-77, 0, 1, 1), RasterioCRS.from_epsg(4326), 1
+        )
+
+        # Area of the spherical cell, about 12,364 km2
+        expected = EARTH_RADIUS ** 2 * math.radians(1) * math.sin(math.radians(1))
+        self.assertAlmostEqual(areas[0], expected, delta=1)
+        self.assertAlmostEqual(areas[0] / 1e6, 12364, delta=1)
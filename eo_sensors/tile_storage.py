@@ -0,0 +1,124 @@
+"""
+Storage of pre-rendered tiles on disk: versioned tile directories published
+by swapping a symlink, their block manifests, and their deletion.
+
+Only depends on the standard library and Django settings, so that it can be
+used from the web server (e.g. when deleting rasters).
+
+"""
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import uuid
+
+from django.conf import settings
+
+# Configure logger
+logger = logging.getLogger(__name__)
+out_handler = logging.StreamHandler(sys.stdout)
+out_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+out_handler.setLevel(logging.INFO)
+logger.addHandler(out_handler)
+logger.setLevel(logging.INFO)
+
+# Name of the block checksums manifest stored along tiles (see
+# `eo_sensors.tiles.block_manifest`)
+MANIFEST_NAME = ".blocks.json"
+
+
+def tiles_versions_dir(raster):
+    # Keep versions inside TILES_DIR so that publishing is a rename within the
+    # same filesystem
+    return os.path.join(settings.TILES_DIR, ".versions", raster.path())
+
+
+def published_tiles_version(raster):
+    """Return the version directory of the currently published tiles of
+    +raster+, or None if there are none"""
+    tiles_dir = os.path.join(settings.TILES_DIR, raster.path()).rstrip("/")
+    if not os.path.islink(tiles_dir):
+        return None
+    version_dir = os.path.realpath(tiles_dir)
+    return version_dir if os.path.isdir(version_dir) else None
+
+
+def load_block_manifest(tiles_dir):
+    try:
+        with open(os.path.join(tiles_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def publish_tiles(src, dst):
+    """
+    Publish tiles directory +src+ at +dst+ by atomically swapping a symlink.
+
+    Readers see either the previous or the new pyramid, never a partial one.
+    The previously published version, and tiles published before versioning,
+    are deleted in background.  Other versions next to +src+ are left alone,
+    as they might be still being rendered by another job.
+
+    """
+    dst = dst.rstrip("/")
+    versions_dir = os.path.dirname(src)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+    old_versions = []
+    if os.path.islink(dst):
+        old_versions.append(os.path.realpath(dst))
+    elif os.path.isdir(dst):
+        # Tiles published before versioning: move them aside, so that the
+        # symlink can take their place
+        legacy_dir = os.path.join(versions_dir, f"legacy-{uuid.uuid4().hex[:8]}")
+        logger.info("Move legacy tiles directory %s to %s", dst, legacy_dir)
+        os.rename(dst, legacy_dir)
+
+    tmp_link = f"{dst}.{uuid.uuid4().hex[:8]}.tmp"
+    os.symlink(os.path.relpath(src, os.path.dirname(dst)), tmp_link)
+    os.replace(tmp_link, dst)
+    logger.info("Published %s at %s", src, dst)
+
+    # Including legacy directories left by interrupted runs
+    old_versions.extend(
+        os.path.join(versions_dir, name)
+        for name in os.listdir(versions_dir)
+        if name.startswith("legacy-")
+    )
+    old_versions = [
+        path
+        for path in old_versions
+        if os.path.exists(path) and os.path.realpath(path) != os.path.realpath(src)
+    ]
+    if old_versions:
+        delete_in_background(old_versions)
+
+
+def delete_in_background(paths):
+    # Run in a separate session, so that it outlives the (forked) job process
+    logger.info("Delete in background: %s", paths)
+    subprocess.Popen(["rm", "-rf", *paths], start_new_session=True)
+
+
+def delete_raster_tiles(raster):
+    """Delete published tiles of +raster+, all their versions, and its MBTiles
+    archive (called when a raster is deleted)"""
+    tiles_dir = os.path.join(settings.TILES_DIR, raster.path()).rstrip("/")
+    if os.path.islink(tiles_dir):
+        logger.info("Delete %s", tiles_dir)
+        os.remove(tiles_dir)
+    elif os.path.exists(tiles_dir):
+        logger.info("Delete %s", tiles_dir)
+        shutil.rmtree(tiles_dir, ignore_errors=True)
+
+    versions_dir = tiles_versions_dir(raster)
+    if os.path.exists(versions_dir):
+        delete_in_background([versions_dir])
+
+    archive_path = raster.tiles_archive_path()
+    if os.path.exists(archive_path):
+        logger.info("Delete %s", archive_path)
+        os.remove(archive_path)
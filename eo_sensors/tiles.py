@@ -0,0 +1,848 @@
+import hashlib
+import json
+import logging
+import math
+import multiprocessing as mp
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.enums import ColorInterp, Resampling
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.io import MemoryFile
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
+from tqdm import tqdm
+
+# Configure logger
+logger = logging.getLogger(__name__)
+out_handler = logging.StreamHandler(sys.stdout)
+out_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+out_handler.setLevel(logging.INFO)
+logger.addHandler(out_handler)
+logger.setLevel(logging.INFO)
+
+TILE_SIZE = 256
+WEB_MERCATOR_CRS = "EPSG:3857"
+# Half the length of the Web Mercator world extent, in meters
+ORIGIN_SHIFT = math.pi * 6378137
+
+# Size of the blocks of source pixels compared when re-tiling, in pixels
+BLOCK_SIZE = 512
+
+# Renderer used by tiling worker processes (see `_init_worker`)
+_renderer = None
+# Encoded empty tile (see `empty_tile`)
+_empty_tile = None
+
+
+def tile_bounds(x, y, z):
+    """Return Web Mercator bounds (left, bottom, right, top) of XYZ tile"""
+    size = 2 * ORIGIN_SHIFT / 2 ** z
+    left = x * size - ORIGIN_SHIFT
+    top = ORIGIN_SHIFT - y * size
+    return left, top - size, left + size, top
+
+
+def tile_range(bounds, z):
+    """Return range (min_x, min_y, max_x, max_y) of XYZ tiles covering Web
+    Mercator +bounds+ at zoom level +z+"""
+    left, bottom, right, top = bounds
+    size = 2 * ORIGIN_SHIFT / 2 ** z
+    max_index = 2 ** z - 1
+
+    def clamp(v):
+        return min(max(v, 0), max_index)
+
+    return (
+        clamp(math.floor((left + ORIGIN_SHIFT) / size)),
+        clamp(math.floor((ORIGIN_SHIFT - top) / size)),
+        clamp(math.ceil((right + ORIGIN_SHIFT) / size) - 1),
+        clamp(math.ceil((ORIGIN_SHIFT - bottom) / size) - 1),
+    )
+
+
+def raster_colormap(src):
+    """Return the color map of a single-band paletted dataset, or None if
+    dataset is not paletted"""
+    if src.count != 1:
+        return None
+    try:
+        return src.colormap(1)
+    except ValueError:
+        return None
+
+
+def read_tile(src, x, y, z, *, resampling=Resampling.average):
+    """Read XYZ tile from an open dataset.
+
+    Returns a (bands + 1, 256, 256) uint8 array, where the last band is the
+    alpha band, or None if the tile is fully transparent.  For paletted
+    datasets, returns a (1, 256, 256) array of color indexes instead, where 0
+    is transparent.
+
+    """
+    transform = from_bounds(*tile_bounds(x, y, z), TILE_SIZE, TILE_SIZE)
+    if raster_colormap(src) is not None:
+        # Color indexes are classes, so they can't be interpolated
+        with WarpedVRT(
+            src,
+            crs=WEB_MERCATOR_CRS,
+            transform=transform,
+            width=TILE_SIZE,
+            height=TILE_SIZE,
+            resampling=Resampling.nearest,
+            nodata=0,
+        ) as vrt:
+            data = vrt.read(1)
+        if not data.any():
+            return None
+        return data[np.newaxis, :].astype(np.uint8)
+
+    alpha_bands = [
+        i for i, ci in zip(src.indexes, src.colorinterp) if ci == ColorInterp.alpha
+    ]
+    data_bands = [i for i in src.indexes if i not in alpha_bands][:3]
+    add_alpha = src.nodata is None and not alpha_bands
+    with WarpedVRT(
+        src,
+        crs=WEB_MERCATOR_CRS,
+        transform=transform,
+        width=TILE_SIZE,
+        height=TILE_SIZE,
+        resampling=resampling,
+        add_alpha=add_alpha,
+    ) as vrt:
+        mask = vrt.dataset_mask()
+        if not mask.any():
+            return None
+        data = vrt.read(indexes=data_bands)
+    return np.concatenate([data.astype(np.uint8), mask[np.newaxis, :]])
+
+
+def overview_tile(children):
+    """Build a tile from its four children tiles by averaging 2x2 pixel blocks.
+
+    +children+ is a dictionary of child tiles by (dx, dy) offset, where
+    missing or None children are considered transparent.  Paletted (single
+    band) tiles take the most frequent color index of each block instead.
+
+    """
+    children = {k: t for k, t in children.items() if t is not None}
+    if not children:
+        return None
+
+    count = next(iter(children.values())).shape[0]
+    mosaic = np.zeros((count, TILE_SIZE * 2, TILE_SIZE * 2), dtype=np.uint32)
+    for (dx, dy), tile in children.items():
+        mosaic[
+            :,
+            dy * TILE_SIZE : (dy + 1) * TILE_SIZE,
+            dx * TILE_SIZE : (dx + 1) * TILE_SIZE,
+        ] = tile
+
+    if count == 1:
+        return _mode_overview(mosaic[0])
+
+    # Weight color values by alpha, so that transparent pixels do not darken
+    # the borders of the overview tile
+    blocks = (TILE_SIZE, 2, TILE_SIZE, 2)
+    alpha = mosaic[-1]
+    alpha_sum = alpha.reshape(blocks).sum(axis=(1, 3))
+    if not alpha_sum.any():
+        return None
+    color_sum = (mosaic[:-1] * alpha).reshape((count - 1, *blocks)).sum(axis=(2, 4))
+    color = color_sum // np.maximum(alpha_sum, 1)
+
+    res = np.empty((count, TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+    res[:-1] = color
+    res[-1] = (alpha_sum + 2) // 4
+    return res
+
+
+def _mode_overview(mosaic):
+    """Reduce 2x2 blocks of color indexes to their most frequent non-zero
+    index (ties go to the first one in the block)"""
+    blocks = (
+        mosaic.reshape(TILE_SIZE, 2, TILE_SIZE, 2)
+        .transpose(0, 2, 1, 3)
+        .reshape(TILE_SIZE, TILE_SIZE, 4)
+    )
+    counts = (blocks[..., :, np.newaxis] == blocks[..., np.newaxis, :]).sum(axis=-1)
+    counts[blocks == 0] = 0
+    best = counts.argmax(axis=-1)[..., np.newaxis]
+    res = np.take_along_axis(blocks, best, axis=-1)[..., 0]
+    if not res.any():
+        return None
+    return res[np.newaxis, :].astype(np.uint8)
+
+
+def encode_png(tile, colormap=None):
+    """Encode a tile array as PNG.
+
+    If +colormap+ is given, +tile+ must be a single band of color indexes,
+    and it is encoded as an 8-bit indexed PNG (with a tRNS chunk for
+    transparent colors).
+
+    """
+    count, height, width = tile.shape
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        with MemoryFile() as memfile:
+            with memfile.open(
+                driver="PNG", width=width, height=height, count=count, dtype=tile.dtype
+            ) as dst:
+                dst.write(tile)
+                if colormap:
+                    dst.write_colormap(1, colormap)
+            return memfile.read()
+
+
+def decode_png(data):
+    """Decode a PNG tile as written by `encode_png` into a tile array"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        with MemoryFile(data) as memfile:
+            with memfile.open() as src:
+                return src.read()
+
+
+def render_tile(src_path, x, y, z, *, resampling=Resampling.average):
+    """Render a single XYZ tile from a raster as PNG.
+
+    Fully transparent tiles are rendered as an empty transparent tile.  Reads
+    are done through the raster's internal overviews when available, so this
+    is cheap for any zoom level on a tiled raster with overviews.
+
+    """
+    with rasterio.open(src_path) as src:
+        tile = read_tile(src, x, y, z, resampling=resampling)
+        colormap = raster_colormap(src)
+    if tile is None:
+        return empty_tile()
+    return encode_png(tile, colormap=colormap)
+
+
+def empty_tile():
+    """Return a fully transparent PNG tile"""
+    global _empty_tile
+    if _empty_tile is None:
+        _empty_tile = encode_png(np.zeros((2, TILE_SIZE, TILE_SIZE), dtype=np.uint8))
+    return _empty_tile
+
+
+class TileCache:
+    """Bounded LRU cache of encoded tiles, both in memory and on disk.
+
+    Recently used tiles are kept in memory, up to +max_items+ tiles.  All
+    tiles are also stored in +cache_dir+, and when the total size of cached
+    files exceeds +max_size+ bytes, least recently used files are removed.
+    Disk cache can be shared between processes.
+
+    """
+
+    def __init__(self, cache_dir, *, max_items, max_size):
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._disk_size = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Update modification time to mark file as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        self._set_memory(key, data)
+        return data
+
+    def set(self, key, data):
+        self._set_memory(key, data)
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = self._scan_disk_size()
+            else:
+                self._disk_size += len(data)
+            if self._disk_size > self.max_size:
+                self._evict()
+
+    def _set_memory(self, key, data):
+        with self._lock:
+            self._items[key] = data
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, *key.split("/"))
+
+    def _files(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def _scan_disk_size(self):
+        return sum(size for _, size, _ in self._files())
+
+    def _evict(self):
+        """Remove least recently used files until disk cache is at most 80%
+        of its maximum size"""
+        files = sorted(self._files(), key=lambda f: f[2])
+        size = sum(s for _, s, _ in files)
+        target = self.max_size * 0.8
+        for path, file_size, _ in files:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+        logger.info("Evicted tiles from disk cache (size is now %d bytes)", size)
+        self._disk_size = size
+
+
+class TileRenderer:
+    """Renders and writes a quadtree of tiles, from the base zoom level of the
+    pyramid up to some tile.
+
+    Base tiles are read from the source dataset, and parent tiles are built in
+    memory from their children, depth-first, so that only a few tiles per zoom
+    level are held in memory at the same time.
+
+    Tiles of paletted datasets are written as indexed PNGs with +colormap+
+    (by default, the color map of the source dataset).
+
+    """
+
+    def __init__(self, src_path, writer, *, tile_ranges, resampling, colormap=None):
+        self.src = rasterio.open(src_path) if src_path else None
+        self.writer = writer
+        self.tile_ranges = tile_ranges
+        self.max_zoom = max(tile_ranges)
+        self.resampling = resampling
+        if self.src and colormap is None:
+            colormap = raster_colormap(self.src)
+        self.colormap = colormap
+        self.stats = {}
+        # Set of (x, y, z) tiles to re-render on `update`, and tiles already
+        # rendered elsewhere
+        self.dirty = None
+        self.rendered = {}
+
+    def render(self, x, y, z):
+        """Render tile and all its descendants, and return tile array"""
+        min_x, min_y, max_x, max_y = self.tile_ranges[z]
+        if not (min_x <= x <= max_x and min_y <= y <= max_y):
+            return None
+
+        if z == self.max_zoom:
+            start = time.perf_counter()
+            tile = read_tile(self.src, x, y, z, resampling=self.resampling)
+        else:
+            children = {
+                (dx, dy): self.render(2 * x + dx, 2 * y + dy, z + 1)
+                for dy in range(2)
+                for dx in range(2)
+            }
+            start = time.perf_counter()
+            tile = overview_tile(children)
+
+        if tile is not None:
+            self.write(x, y, z, tile)
+        self._add_stats(z, tile is not None, time.perf_counter() - start)
+        return tile
+
+    def update(self, x, y, z):
+        """Re-render tile if it is dirty, or read it as it is currently
+        written otherwise, and return tile array.
+
+        Dirty descendants are re-rendered as well, and tiles that became
+        transparent are removed.
+
+        """
+        min_x, min_y, max_x, max_y = self.tile_ranges[z]
+        if not (min_x <= x <= max_x and min_y <= y <= max_y):
+            return None
+        if (x, y, z) in self.rendered:
+            return self.rendered.pop((x, y, z))
+        if (x, y, z) not in self.dirty:
+            return self.read(x, y, z)
+
+        if z == self.max_zoom:
+            start = time.perf_counter()
+            tile = read_tile(self.src, x, y, z, resampling=self.resampling)
+        else:
+            children = {
+                (dx, dy): self.update(2 * x + dx, 2 * y + dy, z + 1)
+                for dy in range(2)
+                for dx in range(2)
+            }
+            start = time.perf_counter()
+            tile = overview_tile(children)
+
+        if tile is not None:
+            self.write(x, y, z, tile)
+        else:
+            self.writer.remove(x, y, z)
+        self._add_stats(z, tile is not None, time.perf_counter() - start)
+        return tile
+
+    def build_overview(self, x, y, z, *, children):
+        """Build and write tile from already rendered children"""
+        start = time.perf_counter()
+        tile = overview_tile(children)
+        if tile is not None:
+            self.write(x, y, z, tile)
+        self._add_stats(z, tile is not None, time.perf_counter() - start)
+        return tile
+
+    def write(self, x, y, z, tile):
+        self.writer.write(x, y, z, encode_png(tile, colormap=self.colormap))
+
+    def read(self, x, y, z):
+        data = self.writer.read(x, y, z)
+        return decode_png(data) if data is not None else None
+
+    def _add_stats(self, z, written, seconds):
+        tiles, secs = self.stats.get(z, (0, 0.0))
+        self.stats[z] = (tiles + int(written), secs + seconds)
+
+
+class DirectoryTileWriter:
+    """Writes tiles as `{z}/{x}/{y}.png` files inside a directory.
+
+    If +replace+ is true, existing tiles are replaced with a new file instead
+    of being overwritten, so that files hard linked from another directory are
+    left untouched.
+
+    """
+
+    def __init__(self, path, *, replace=False):
+        self.path = path
+        self.replace = replace
+        self._dirs = set()
+
+    def write(self, x, y, z, data):
+        tile_dir = os.path.join(self.path, str(z), str(x))
+        if tile_dir not in self._dirs:
+            os.makedirs(tile_dir, exist_ok=True)
+            self._dirs.add(tile_dir)
+        path = os.path.join(tile_dir, f"{y}.png")
+        if self.replace:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        else:
+            with open(path, "wb") as f:
+                f.write(data)
+
+    def read(self, x, y, z):
+        try:
+            with open(os.path.join(self.path, str(z), str(x), f"{y}.png"), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def remove(self, x, y, z):
+        try:
+            os.remove(os.path.join(self.path, str(z), str(x), f"{y}.png"))
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        pass
+
+
+class MBTilesWriter:
+    """Writes tiles into a MBTiles archive (a single SQLite database).
+
+    Tiles are written to a temporary file next to +path+, which replaces
+    +path+ atomically when the writer is closed.
+
+    """
+
+    def __init__(self, path, *, name, bounds, levels):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+        self.conn = sqlite3.connect(self.tmp_path)
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+        self.conn.execute(
+            "CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, "
+            "tile_row INTEGER, tile_data BLOB)"
+        )
+        metadata = dict(
+            name=name,
+            type="overlay",
+            version="1.1",
+            format="png",
+            bounds=",".join(str(v) for v in bounds),
+            minzoom=levels[0],
+            maxzoom=levels[1],
+        )
+        self.conn.executemany(
+            "INSERT INTO metadata (name, value) VALUES (?, ?)",
+            [(k, str(v)) for k, v in metadata.items()],
+        )
+
+    def write(self, x, y, z, data):
+        # MBTiles rows follow the TMS scheme (i.e. origin at bottom-left)
+        self.conn.execute(
+            "INSERT INTO tiles (zoom_level, tile_column, tile_row, tile_data) "
+            "VALUES (?, ?, ?, ?)",
+            (z, x, 2 ** z - 1 - y, sqlite3.Binary(data)),
+        )
+
+    def close(self):
+        self.conn.execute(
+            "CREATE UNIQUE INDEX tile_index "
+            "ON tiles (zoom_level, tile_column, tile_row)"
+        )
+        self.conn.commit()
+        self.conn.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class BufferTileWriter:
+    """Keeps written tiles in a list, to be written by another process"""
+
+    def __init__(self):
+        self.tiles = []
+
+    def write(self, x, y, z, data):
+        self.tiles.append((x, y, z, data))
+
+    def close(self):
+        pass
+
+
+def read_mbtiles_tile(path, x, y, z):
+    """Read XYZ tile from a MBTiles archive, or return None if tile does not
+    exist"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        row = conn.execute(
+            "SELECT tile_data FROM tiles "
+            "WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, 2 ** z - 1 - y),
+        ).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+def generate_tiles(
+    src_path,
+    dst,
+    *,
+    levels,
+    n_jobs=None,
+    resampling=Resampling.average,
+    format="dir",
+    dirty=None,
+):
+    """Generate a XYZ tile pyramid of PNG tiles from a raster.
+
+    If +format+ is "dir", tiles are written to the +dst+ directory as
+    `{z}/{x}/{y}.png` files.  If +format+ is "mbtiles", tiles are written to a
+    single MBTiles archive at +dst+.  Fully transparent tiles are not written.
+
+    Single-band rasters with a color table (see
+    `eo_sensors.utils.write_paletted_raster`) are tiled as 8-bit indexed PNGs,
+    using nearest resampling and the most frequent class for overviews.
+
+    If +dirty+ is a set of (x, y, z) tiles (see `dirty_tiles`), +dst+ must be a
+    directory that already holds the pyramid of a previous version of the
+    raster, and only dirty tiles are re-rendered.
+
+    The pyramid is split into subtrees that are rendered in parallel by a pool
+    of +n_jobs+ processes, and the remaining upper zoom levels are built from
+    the subtrees' top tiles in memory.
+
+    Returns a dictionary with the number of tiles written and elapsed time,
+    both in total and per zoom level.
+
+    """
+    if not n_jobs:
+        n_jobs = mp.cpu_count()
+    min_zoom, max_zoom = levels
+
+    with rasterio.open(src_path) as src:
+        bounds = transform_bounds(
+            src.crs, WEB_MERCATOR_CRS, *src.bounds, densify_pts=21
+        )
+        lnglat_bounds = transform_bounds(
+            src.crs, "EPSG:4326", *src.bounds, densify_pts=21
+        )
+        colormap = raster_colormap(src)
+    tile_ranges = {z: tile_range(bounds, z) for z in range(min_zoom, max_zoom + 1)}
+
+    split_zoom = _split_zoom(tile_ranges, n_jobs=n_jobs)
+    min_x, min_y, max_x, max_y = tile_ranges[split_zoom]
+    tasks = [
+        (x, y, split_zoom)
+        for y in range(min_y, max_y + 1)
+        for x in range(min_x, max_x + 1)
+        if dirty is None or (x, y, split_zoom) in dirty
+    ]
+    logger.info(
+        "Render %d subtrees from zoom %d to %d with %d processes",
+        len(tasks),
+        split_zoom,
+        max_zoom,
+        n_jobs,
+    )
+
+    if dirty is not None and format != "dir":
+        raise ValueError("Only tiles in directories can be updated")
+    if format == "mbtiles":
+        writer = MBTilesWriter(
+            dst, name=os.path.basename(src_path), bounds=lnglat_bounds, levels=levels
+        )
+    elif format == "dir":
+        writer = DirectoryTileWriter(dst, replace=dirty is not None)
+    else:
+        raise ValueError(f"Unknown tiles format: {format}")
+
+    start = time.time()
+    stats = {}
+    tiles = {}
+    with mp.Pool(
+        n_jobs,
+        initializer=_init_worker,
+        initargs=(src_path, dst, format, tile_ranges, resampling, dirty),
+    ) as pool:
+        for x, y, tile, subtree_stats, subtree_tiles in tqdm(
+            pool.imap_unordered(_render_subtree, tasks), total=len(tasks)
+        ):
+            if tile is not None or dirty is not None:
+                tiles[(x, y)] = tile
+            for t in subtree_tiles:
+                writer.write(*t)
+            _merge_stats(stats, subtree_stats)
+
+    # Build the rest of the pyramid from the top tiles of each subtree
+    renderer = TileRenderer(
+        None,
+        writer,
+        tile_ranges=tile_ranges,
+        resampling=resampling,
+        colormap=colormap,
+    )
+    if dirty is not None:
+        # Siblings of dirty tiles are read from the previous pyramid
+        renderer.dirty = dirty
+        renderer.rendered = {(x, y, split_zoom): t for (x, y), t in tiles.items()}
+        for x, y, z in sorted(dirty):
+            if z == min_zoom and split_zoom > min_zoom:
+                renderer.update(x, y, z)
+    else:
+        for z in range(split_zoom - 1, min_zoom - 1, -1):
+            parents = {}
+            for (x, y), tile in tiles.items():
+                parents.setdefault((x // 2, y // 2), {})[(x % 2, y % 2)] = tile
+            tiles = {}
+            for (x, y), children in parents.items():
+                tile = renderer.build_overview(x, y, z, children=children)
+                if tile is not None:
+                    tiles[(x, y)] = tile
+    _merge_stats(stats, renderer.stats)
+    writer.close()
+
+    elapsed = time.time() - start
+    total = sum(n for n, _ in stats.values())
+    logger.info(
+        "%d tiles written in %.2f seconds (%.2f tiles/s)",
+        total,
+        elapsed,
+        total / elapsed if elapsed else 0,
+    )
+    return dict(
+        tiles=total,
+        seconds=elapsed,
+        zooms={z: dict(tiles=n, seconds=s) for z, (n, s) in sorted(stats.items())},
+    )
+
+
+def block_manifest(src_path, *, levels, block_size=BLOCK_SIZE, n_jobs=None):
+    """Return a manifest of a raster to be tiled at zoom +levels+, with the
+    checksums of its blocks of +block_size+ pixels, read and hashed by a pool
+    of +n_jobs+ threads"""
+    if not n_jobs:
+        n_jobs = mp.cpu_count()
+    with rasterio.open(src_path) as src:
+        colormap = raster_colormap(src)
+        meta = dict(
+            crs=src.crs.to_string(),
+            transform=list(src.transform)[:6],
+            width=src.width,
+            height=src.height,
+            dtypes=list(src.dtypes),
+            nodata=src.nodata,
+            colorinterp=[ci.name for ci in src.colorinterp],
+            colormap=colormap,
+            levels=list(levels),
+            block_size=block_size,
+        )
+        windows = [
+            Window(
+                col_off,
+                row_off,
+                min(block_size, src.width - col_off),
+                min(block_size, src.height - row_off),
+            )
+            for row_off in range(0, src.height, block_size)
+            for col_off in range(0, src.width, block_size)
+        ]
+
+    # Datasets can't be shared between threads, so each one opens its own
+    local = threading.local()
+    datasets = []
+    lock = threading.Lock()
+
+    def checksum(window):
+        src = getattr(local, "src", None)
+        if src is None:
+            src = local.src = rasterio.open(src_path)
+            with lock:
+                datasets.append(src)
+        return hashlib.sha1(src.read(window=window).tobytes()).hexdigest()
+
+    try:
+        with ThreadPoolExecutor(n_jobs) as pool:
+            checksums = list(pool.map(checksum, windows))
+    finally:
+        for src in datasets:
+            src.close()
+    blocks = {
+        f"{window.row_off}/{window.col_off}": digest
+        for window, digest in zip(windows, checksums)
+    }
+    # Normalize types (e.g. tuples and int keys) as they are stored in JSON
+    return json.loads(json.dumps(dict(meta=meta, blocks=blocks)))
+
+
+def dirty_tiles(src_path, old_manifest, new_manifest):
+    """Return the set of (x, y, z) tiles that changed between two versions of
+    a raster, given their block manifests (see `block_manifest`).
+
+    Returns None if the whole pyramid must be rendered again (e.g. raster
+    extent, resolution or zoom levels changed).
+
+    """
+    if old_manifest is None or old_manifest["meta"] != new_manifest["meta"]:
+        return None
+    meta = new_manifest["meta"]
+    block_size = meta["block_size"]
+    min_zoom, max_zoom = meta["levels"]
+    changed = [
+        key
+        for key, checksum in new_manifest["blocks"].items()
+        if old_manifest["blocks"].get(key) != checksum
+    ]
+
+    base_tiles = set()
+    with rasterio.open(src_path) as src:
+        for key in changed:
+            row_off, col_off = (int(v) for v in key.split("/"))
+            # Add a pixel around the block, as resampling can spread changes
+            window = Window(col_off - 1, row_off - 1, block_size + 2, block_size + 2)
+            bounds = transform_bounds(
+                src.crs, WEB_MERCATOR_CRS, *src.window_bounds(window), densify_pts=21
+            )
+            min_x, min_y, max_x, max_y = tile_range(bounds, max_zoom)
+            base_tiles.update(
+                (x, y) for y in range(min_y, max_y + 1) for x in range(min_x, max_x + 1)
+            )
+
+    # All ancestors of changed base tiles change as well
+    dirty = set()
+    tiles = base_tiles
+    for z in range(max_zoom, min_zoom - 1, -1):
+        dirty.update((x, y, z) for x, y in tiles)
+        tiles = {(x // 2, y // 2) for x, y in tiles}
+    return dirty
+
+
+def _split_zoom(tile_ranges, *, n_jobs):
+    """Return the lowest zoom level with enough tiles to keep all processes
+    busy, which is where the pyramid is split into subtrees"""
+    for z in sorted(tile_ranges):
+        min_x, min_y, max_x, max_y = tile_ranges[z]
+        if (max_x - min_x + 1) * (max_y - min_y + 1) >= 4 * n_jobs:
+            return z
+    return max(tile_ranges)
+
+
+def _merge_stats(stats, other):
+    for z, (tiles, secs) in other.items():
+        cur_tiles, cur_secs = stats.get(z, (0, 0.0))
+        stats[z] = (cur_tiles + tiles, cur_secs + secs)
+
+
+def _init_worker(src_path, dst, format, tile_ranges, resampling, dirty):
+    global _renderer
+    # Workers write tiles directly only into directories.  Otherwise, tiles
+    # are sent back to the main process, which is the only one writing to
+    # the archive.
+    if format == "dir":
+        writer = DirectoryTileWriter(dst, replace=dirty is not None)
+    else:
+        writer = BufferTileWriter()
+    _renderer = TileRenderer(
+        src_path, writer, tile_ranges=tile_ranges, resampling=resampling
+    )
+    _renderer.dirty = dirty
+
+
+def _render_subtree(task):
+    x, y, z = task
+    _renderer.stats = {}
+    if _renderer.dirty is not None:
+        tile = _renderer.update(x, y, z)
+    else:
+        tile = _renderer.render(x, y, z)
+    tiles = []
+    if isinstance(_renderer.writer, BufferTileWriter):
+        tiles, _renderer.writer.tiles = _renderer.writer.tiles, []
+    return x, y, tile, _renderer.stats, tiles
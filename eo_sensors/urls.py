@@ -8,6 +8,14 @@ router = SimpleRouter()
 router.register(r"rasters", views.RasterViewSet)
 
 urlpatterns = [
+    url(
+        r"^rasters/(?P<pk>\d+)/tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.png$",
+        views.RasterTileView.as_view(),
+    ),
+    url(
+        r"^rasters/(?P<pk>\d+)/mbtiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.png$",
+        views.RasterArchiveTileView.as_view(),
+    ),
     url(r"^", include(router.urls)),
     url(r"^download-raster/(?P<pk>[^/]+)$", views.RasterDownloadView.as_view()),
     url(r"^coverage/?", views.CoverageView.as_view()),
@@ -1,28 +1,53 @@
 import logging
+import math
 import multiprocessing as mp
 import os
 import shutil
 import subprocess
 import sys
+import json
 import tempfile
+import time
+import uuid
 import zipfile
 
-from multiprocessing.pool import ThreadPool
-from functools import partial
+from functools import wraps
 import numpy as np
 import rasterio
+import rasterio.shutil
 from django.conf import settings
 from django.contrib.gis.gdal import GDALRaster
 from django.contrib.gis.geos import GEOSGeometry
 from django.core.files import File
 from django.db import DatabaseError, connection, transaction
-from eo_sensors.models import CoverageMask, CoverageMeasurement, Raster
-from rasterio.windows import Window
+from eo_sensors import gdal_ops
+from eo_sensors.models import CoverageMask, Raster
+from eo_sensors.tile_storage import (
+    MANIFEST_NAME,
+    load_block_manifest,
+    publish_tiles,
+    published_tiles_version,
+    tiles_versions_dir,
+)
+from eo_sensors.tiles import (
+    block_manifest,
+    dirty_tiles,
+    generate_tiles,
+    raster_colormap,
+)
+from eo_sensors.utils.colormap import apply_lut, palette_lut
+from eo_sensors.utils.pipeline import process_blocks, sliding_windows
+from eo_sensors.utils.vectorize import as_multipolygon, polygonize
+from eo_sensors.utils.zonal import zonal_areas
+from osgeo import gdal
+from rasterio.enums import ColorInterp, MaskFlags, Resampling
+from rasterio.env import GDALVersion
+from rasterio.features import geometry_mask, geometry_window
+from rasterio.windows import transform as window_transform
 from satlomasproc.chips.utils import reproject_shape
 from scopes.models import Scope
 from shapely.geometry import box
 from skimage import exposure
-from tqdm import tqdm
 
 # Configure logger
 logger = logging.getLogger(__name__)
@@ -57,67 +82,125 @@ def unzip(zip_name, extract_folder=None, delete_zip=True):
         os.remove(zip_name)
 
 
-def sliding_windows(size, width, height):
-    """Slide a window of +size+ pixels"""
-    for i in range(0, height, size):
-        for j in range(0, width, size):
-            yield Window(j, i, min(width - j, size), min(height - i, size))
+def write_rescaled_rgb_raster(src_path, dst_path, *, in_range, bands=None, n_jobs=None):
+    """
+    Rescale +bands+ of +src_path+ (all bands by default) to bytes, using an
+    input range per band, and write them to +dst_path+ with 0 as nodata.
 
-
-# TODO: check if used, if not, delete
-def write_rgb_raster(bands=[], *, src_path, dst_path, in_range):
-    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-    with rasterio.open(src_path) as src:
-        profile = src.profile.copy()
-        profile.update(
-            count=3, dtype=np.uint8, compress="deflate", tiled=True, nodata=0
+    """
+    if not bands:
+        with rasterio.open(src_path) as src:
+            bands = list(range(1, src.count + 1))
+
+    def rescale(img):
+        return np.array(
+            [
+                exposure.rescale_intensity(
+                    band, in_range=in_range[i], out_range=(1, 255)
+                ).astype(np.uint8)
+                for i, band in enumerate(img)
+            ]
         )
-        height, width = src.shape[0], src.shape[1]
-        if not bands:
-            bands = range(1, src.count + 1)
-        with rasterio.open(dst_path, "w", **profile) as dst:
-            windows = list(sliding_windows(1000, width, height))
-            for window in tqdm(windows):
-                img = np.dstack([src.read(b, window=window) for b in bands])
-                new_img = np.dstack(
-                    [
-                        exposure.rescale_intensity(
-                            img[:, :, i], in_range=in_range[i], out_range=(1, 255)
-                        ).astype(np.uint8)
-                        for i in range(img.shape[2])
-                    ]
-                )
-                for i in range(3):
-                    dst.write(new_img[:, :, i], i + 1, window=window)
 
+    process_blocks(
+        rescale,
+        [src_path],
+        [dst_path],
+        indexes=[list(bands)],
+        profiles=[dict(count=len(bands), dtype="uint8", nodata=0)],
+        n_jobs=n_jobs,
+    )
 
-def clip(src, dst, *, aoi):
-    # Make sure directory exists, and if file exists, delete to overwrite
-    os.makedirs(os.path.dirname(dst), exist_ok=True)
-    if os.path.exists(dst):
-        os.unlink(dst)
 
+def clip(src, dst, *, aoi):
     logger.info("Clip raster %s to %s using %s as cutline", src, dst, aoi)
-    gdalwarp_bin = f"{settings.GDAL_BIN_PATH}/gdalwarp"
-    run_command(
-        f"{gdalwarp_bin} -of GTiff -co COMPRESS=DEFLATE -co TILED=YES -cutline {aoi} -crop_to_cutline {src} {dst}"
-    )
+    gdal_ops.clip(src, dst, aoi=aoi)
 
 
 def rescale_byte(src, dst, *, in_range):
-    # Make sure directory exists, and if file exists, delete to overwrite
-    os.makedirs(os.path.dirname(dst), exist_ok=True)
-    if os.path.exists(dst):
-        os.unlink(dst)
-
     logger.info("Rescale raster %s to %s with input range %s", src, dst, in_range)
-    gdal_translate_bin = f"{settings.GDAL_BIN_PATH}/gdal_translate"
-    run_command(
-        f"{gdal_translate_bin} -of GTiff -ot Byte "
-        f"-scale {' '.join(str(v) for v in in_range)} 1 255 -a_nodata 0 "
-        f"-co COMPRESS=DEFLATE -co TILED=YES "
-        f"{src} {dst}"
+    gdal_ops.translate(
+        src,
+        dst,
+        outputType=gdal.GDT_Byte,
+        scaleParams=[[*in_range, 1, 255]],
+        noData=0,
+    )
+
+
+def clip_rescale_cog(src_path, dst_path, *, aoi, in_range, n_jobs=None):
+    """
+    Clip raster +src_path+ to the geometries of +aoi+ (a vector file), and
+    rescale all bands from +in_range+ to bytes, writing a Cloud-Optimized
+    GeoTIFF with overviews to +dst_path+.
+
+    Equivalent to `clip` followed by `rescale_byte` and `add_overviews`, but
+    source pixels are read only once, in-process: blocks are cropped, masked
+    and rescaled in parallel into a temporary tiled raster, which is then
+    copied as a COG (overviews are computed from it by the COG driver).
+    Valid pixels are rescaled to 1..255, and 0 is nodata.
+
+    """
+    import geopandas as gpd
+
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+
+    with rasterio.open(src_path) as src:
+        shapes = list(gpd.read_file(aoi).to_crs(src.crs).geometry)
+        window = geometry_window(src, shapes)
+        transform = src.window_transform(window)
+        src_nodata = src.nodata
+
+    min_v, max_v = in_range
+    scale = 254 / (max_v - min_v)
+
+    def clip_and_rescale(block, img):
+        outside = geometry_mask(
+            shapes,
+            out_shape=(block.height, block.width),
+            transform=window_transform(block, transform),
+        )
+        res = np.clip(np.round((img.astype(np.float32) - min_v) * scale + 1), 1, 255)
+        res = res.astype(np.uint8)
+        res[:, outside] = 0
+        if src_nodata is not None:
+            res[img == src_nodata] = 0
+        return res
+
+    logger.info(
+        "Clip raster %s using %s and rescale from %s into COG %s",
+        src_path,
+        aoi,
+        in_range,
+        dst_path,
     )
+    tmp_path = f"{dst_path}.tmp.tif"
+    try:
+        process_blocks(
+            clip_and_rescale,
+            [src_path],
+            [tmp_path],
+            window=window,
+            pass_window=True,
+            profiles=[
+                dict(dtype="uint8", nodata=0, blockxsize=512, blockysize=512)
+            ],
+            n_jobs=n_jobs,
+            desc="clip_rescale_cog",
+        )
+        rasterio.shutil.copy(
+            tmp_path,
+            dst_path,
+            driver="COG",
+            compress="DEFLATE",
+            predictor="2",
+            overview_resampling="AVERAGE",
+            num_threads="ALL_CPUS",
+            bigtiff="IF_SAFER",
+        )
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 def create_raster(
@@ -136,13 +219,8 @@ def create_raster(
         source=source, date=date, slug=slug, defaults=dict(name=name)
     )
 
-    # If raster already has a file, delete it
-    if raster.file:
-        raster.file.delete()
-
-    # Store RGB raster on `file` field
-    with open(rgb_raster_path, "rb") as f:
-        raster.file.save(f"{slug}.tif", File(f, name=f"{slug}.tif"))
+    # Store RGB raster on `file` field, as a COG
+    save_raster_file(raster, rgb_raster_path, name=f"{slug}.tif")
 
     # Generate tiles for map view
     create_raster_tiles(raster, levels=zoom_range, n_jobs=mp.cpu_count())
@@ -152,87 +230,229 @@ def create_raster(
         masks = create_coverage_masks(
             raster, cov_raster_path=cov_raster_path, kinds_per_value=kinds_per_value
         )
-        generate_measurements(masks, simplify=simplify)
+        if settings.EO_SENSORS_MEASUREMENTS_ENGINE == "raster":
+            generate_raster_measurements(
+                masks, cov_raster_path=cov_raster_path, kinds_per_value=kinds_per_value
+            )
+        else:
+            generate_measurements(masks, simplify=simplify)
 
 
-def write_paletted_rgb_raster(src_path, dst_path, *, colormap):
+def save_raster_file(raster, src_path, *, name):
+    """
+    Store raster +src_path+ as the file of +raster+, named +name+.
+
+    Files are always stored as Cloud-Optimized GeoTIFFs (tiled, with
+    overviews, and metadata at the start of the file), so that subregions and
+    overviews can be read with a few range requests.  The layout of the
+    stored file is recorded in `extra_fields["layout"]`.
+
+    """
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(src_path)) as tmpdir:
+        cog_path = os.path.join(tmpdir, name)
+        write_cog(src_path, cog_path)
+        layout = cog_layout(cog_path)
+
+        if raster.file:
+            raster.file.delete(save=False)
+        raster.extra_fields = {**(raster.extra_fields or {}), "layout": layout}
+        with open(cog_path, "rb") as f:
+            raster.file.save(name, File(f, name=name))
+
+
+def write_cog(src_path, dst_path):
+    """
+    Write raster +src_path+ as a Cloud-Optimized GeoTIFF at +dst_path+.
+
+    Byte RGB images are JPEG compressed (as YCbCr), unless they have nodata
+    or a mask, as JPEG artifacts would smear their borders.  Other rasters are
+    DEFLATE compressed.  Overviews of +src_path+ are reused if it has any,
+    otherwise they are computed (using the mode for rasters with a color
+    table, and the average for the rest).
+
+    The COG driver needs GDAL 3.1, with older versions the raster is written
+    with `write_tiled_gtiff` instead.
+
+    """
     with rasterio.open(src_path) as src:
-        profile = src.profile.copy()
-        profile.update(count=4, dtype="uint8", compress="deflate", tiled=True)
-        del profile["nodata"]
-
-        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-
-        with rasterio.open(dst_path, "w", **profile) as dst:
-            for _, window in src.block_windows(1):
-                img = src.read(1, window=window)
-
-                new_img = np.zeros((img.shape[0], img.shape[1], 3), dtype=np.uint8)
-                for i in range(len(colormap)):
-                    if colormap[i]:
-                        color = hex_to_dec_string(colormap[i])
-                        new_img[img == (i + 1), :] = color
-                mask = (img != 0).astype(np.uint8) * 255
-
-                for i in range(new_img.shape[2]):
-                    dst.write(new_img[:, :, i], i + 1, window=window)
-                # Write alpha band
-                dst.write(mask, 4, window=window)
+        if src.tags(ns="IMAGE_STRUCTURE").get("LAYOUT") == "COG":
+            logger.info("%s is already a COG, copy it", src_path)
+            shutil.copyfile(src_path, dst_path)
+            return
+        paletted = raster_colormap(src) is not None
+        masked = any(MaskFlags.all_valid not in flags for flags in src.mask_flag_enums)
+        jpeg = (
+            src.count == 3 and src.dtypes[0] == "uint8" and not paletted and not masked
+        )
+        float_dtype = np.issubdtype(np.dtype(src.dtypes[0]), np.floating)
+
+    resampling = "MODE" if paletted else "AVERAGE"
+    predictor = "3" if float_dtype else "2"
+
+    if not GDALVersion.runtime().at_least("3.1"):
+        if jpeg:
+            options = dict(compress="JPEG", jpeg_quality=85, photometric="YCBCR")
+        else:
+            options = dict(compress="DEFLATE", predictor=predictor)
+        write_tiled_gtiff(src_path, dst_path, resampling=resampling, **options)
+        return
+
+    options = dict(
+        blocksize=512,
+        overview_resampling=resampling,
+        num_threads="ALL_CPUS",
+        bigtiff="IF_SAFER",
+    )
+    if jpeg:
+        options.update(compress="JPEG", quality=85)
+    else:
+        options.update(compress="DEFLATE", predictor=predictor)
+
+    logger.info("Write %s as COG into %s", src_path, dst_path)
+    rasterio.shutil.copy(src_path, dst_path, driver="COG", **options)
+
+
+def write_tiled_gtiff(src_path, dst_path, *, resampling, block_size=512, **options):
+    """
+    Write raster +src_path+ as a tiled GeoTIFF at +dst_path+, with overviews
+    stored before the image data, like a COG but without the COG driver.
+    Extra +options+ are GTiff creation options.
+
+    Overviews of +src_path+ are reused if it has any, otherwise they are
+    computed on a temporary tiled copy, with +resampling+, down to a single
+    block.
+
+    """
+    logger.info("Write %s as tiled GeoTIFF with overviews into %s", src_path, dst_path)
+    profile = dict(
+        driver="GTiff",
+        tiled=True,
+        blockxsize=block_size,
+        blockysize=block_size,
+        num_threads="ALL_CPUS",
+        bigtiff="IF_SAFER",
+    )
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(dst_path)) as tmpdir:
+        with rasterio.open(src_path) as src:
+            has_overviews = bool(src.overviews(1))
+            size = max(src.width, src.height)
+        if not has_overviews:
+            levels = []
+            while size > block_size:
+                levels.append(2 ** (len(levels) + 1))
+                size = math.ceil(size / 2)
+            tmp_path = os.path.join(tmpdir, "tiled.tif")
+            rasterio.shutil.copy(src_path, tmp_path, compress="DEFLATE", **profile)
+            if levels:
+                with rasterio.open(tmp_path, "r+") as tmp:
+                    tmp.build_overviews(levels, Resampling[resampling.lower()])
+            src_path = tmp_path
+        rasterio.shutil.copy(
+            src_path, dst_path, copy_src_overviews=True, **profile, **options
+        )
+
+
+def cog_layout(path):
+    """Describe the internal layout of raster at +path+"""
+    with rasterio.open(path) as src:
+        structure = src.tags(ns="IMAGE_STRUCTURE")
+        return dict(
+            format="COG" if structure.get("LAYOUT") == "COG" else src.driver,
+            compress=structure.get("COMPRESSION"),
+            block_size=list(src.block_shapes[0]),
+            overviews=src.overviews(1),
+            size=os.path.getsize(path),
+        )
+
+
+def write_paletted_rgb_raster(src_path, dst_path, *, colormap):
+    lut = palette_lut(colormap)
+
+    def paint(img):
+        # RGBA bands, where classes without color are transparent
+        return np.transpose(apply_lut(img[0], lut), [2, 0, 1])
+
+    process_blocks(
+        paint,
+        [src_path],
+        [dst_path],
+        profiles=[dict(count=4, dtype="uint8", nodata=None)],
+    )
     add_overviews(dst_path)
 
 
-def add_overviews(src_path):
-    logger.info("Add internal compressed overviews to %s", src_path)
-    run_command(
-        f"gdaladdo --config COMPRESS_OVERVIEW JPEG --config INTERLEAVE_OVERVIEW PIXEL {src_path} 2 4 8 16"
+def write_paletted_raster(src_path, dst_path, *, colormap):
+    """
+    Write class raster +src_path+ as a single-band raster with a color table
+
+    Class value `i + 1` is painted with +colormap[i]+ (an RGB hex string),
+    while 0 and classes with a None color are transparent.  Unlike
+    `write_paletted_rgb_raster`, classes are kept as they are, so tiles can be
+    encoded as 8-bit indexed PNGs.
+
+    """
+    process_blocks(
+        lambda img: img[0],
+        [src_path],
+        [dst_path],
+        profiles=[dict(count=1, dtype="uint8", nodata=0)],
+        skip_empty=True,
     )
+    with rasterio.open(dst_path, "r+") as dst:
+        dst.write_colormap(1, build_color_table(colormap))
+    add_overviews(dst_path, resampling="mode", compress="DEFLATE")
+
+
+def build_color_table(colormap):
+    lut = palette_lut(colormap)
+    return {i: tuple(int(v) for v in lut[i]) for i in range(len(colormap) + 1)}
+
+
+def add_overviews(src_path, *, resampling="nearest", compress="JPEG"):
+    gdal_ops.build_overviews(src_path, resampling=resampling, compress=compress)
 
 
 def create_coverage_masks(raster, *, cov_raster_path, kinds_per_value):
-    import geopandas as gpd
     from shapely.ops import unary_union
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        logger.info("Polygonize mask")
-        geojson_path = os.path.join(tmpdir, "mask.geojson")
-        run_command(
-            '{gdal_bin_path}/gdal_polygonize.py {src} {dst} -b 1 -f "GeoJSON" DN'.format(
-                gdal_bin_path=settings.GDAL_BIN_PATH,
-                src=cov_raster_path,
-                dst=geojson_path,
-            )
+    logger.info("Polygonize mask")
+    polys_per_value = polygonize(cov_raster_path, dst_crs="EPSG:4326")
+
+    logger.info("Group all polygons by kind")
+    polys_per_kind = {}
+    for value, poly in polys_per_value.items():
+        kind = kinds_per_value[value]
+        polys_per_kind.setdefault(kind, []).append(poly)
+
+    # Create a CoverageMask for each kind by merging all polygons into a
+    # single multipolygon
+    logger.info("Create CoverageMask for each kind")
+    masks = []
+    for kind, polys in polys_per_kind.items():
+        geom = as_multipolygon(unary_union(polys))
+        mask, _ = CoverageMask.objects.update_or_create(
+            date=raster.date,
+            source=raster.source,
+            kind=kind,
+            defaults=dict(geom=multipolygon_to_geos(geom), raster=raster),
         )
+        masks.append(mask)
 
-        logging.info("Reproject to epsg:4326")
-        gdf = gpd.read_file(geojson_path)
-        gdf["geometry"] = gdf["geometry"].to_crs(epsg=4326)
-
-        logging.info("Group all features by kind")
-        polys_per_kind = {}
-        for _, row in gdf.iterrows():
-            if not row["DN"]:
-                continue
-            dn = int(row["DN"])
-            kind = kinds_per_value[dn]
-            if kind not in polys_per_kind:
-                polys_per_kind[kind] = []
-            polys_per_kind[kind].append(row["geometry"])
-
-        # Create a CoverageMask for each kind by merging all polygons into a
-        # single multipolygon
-        logging.info("Create CoverageMask for each kind")
-        masks = []
-        for kind, polys in polys_per_kind.items():
-            geom = unary_union(polys)
-            mask, _ = CoverageMask.objects.update_or_create(
-                date=raster.date,
-                source=raster.source,
-                kind=kind,
-                defaults=dict(geom=GEOSGeometry(geom.wkt), raster=raster),
-            )
-            masks.append(mask)
+    return masks
+
+
+def multipolygon_to_geos(geom):
+    """
+    Convert Shapely multipolygon +geom+ (in EPSG:4326) to a GEOS geometry, to
+    be stored in a MultiPolygonField.
 
-        return masks
+    Empty multipolygons (or None) are built on the Django side, as Shapely
+    writes them as an empty GeometryCollection, which the field rejects.
+
+    """
+    if geom is None or geom.is_empty:
+        return GEOSGeometry("MULTIPOLYGON EMPTY", srid=4326)
+    return GEOSGeometry(geom.wkb_hex, srid=4326)
 
 
 def hex_to_dec_string(value):
@@ -253,42 +473,168 @@ def select_sql(query, *params):
         return res
 
 
+# Area of each mask on each scope, from the projected mask parts that overlap
+# the scope (bounding box prefilter), and area of the scope
+MEASUREMENT_AREAS_SQL = """
+    CREATE TEMPORARY TABLE measurement_areas ON COMMIT DROP AS
+    SELECT m.date, s.id AS scope_id, m.source, m.kind,
+        COALESCE(SUM(ST_Area(ST_Intersection({part_geom}, s.geom))), 0) AS area,
+        s.area AS scope_area
+    FROM eo_sensors_coveragemask AS m
+    CROSS JOIN (
+        SELECT id, geom, ST_Area(geom) AS area
+        FROM (
+            SELECT id, ST_Transform(geom, %(srid)s) AS geom FROM scopes_scope
+            WHERE %(scope_ids)s::integer[] IS NULL OR id = ANY(%(scope_ids)s)
+        ) AS t
+    ) AS s
+    LEFT JOIN eo_sensors_coveragemaskpart AS p
+        ON p.mask_id = m.id AND p.geom && s.geom
+    WHERE m.id = ANY(%(mask_ids)s)
+    GROUP BY m.id, m.date, m.source, m.kind, s.id, s.area
+"""
+
+# Same as `MEASUREMENT_AREAS_SQL`, from areas computed elsewhere (a VALUES list
+# of (date, scope_id, source, kind, area, scope_area) rows)
+MEASUREMENT_AREAS_VALUES_SQL = """
+    CREATE TEMPORARY TABLE measurement_areas ON COMMIT DROP AS
+    SELECT date::date, scope_id::integer, source, kind,
+        area::double precision, scope_area::double precision
+    FROM (VALUES {values}) AS t (date, scope_id, source, kind, area, scope_area)
+"""
+
+UPSERT_MEASUREMENTS_SQL = """
+    INSERT INTO eo_sensors_coveragemeasurement
+        (date, scope_id, source, kind, area, perc_area, created_at, updated_at)
+    SELECT date, scope_id, source, kind, area,
+        CASE WHEN scope_area > 0 THEN area / scope_area ELSE 0 END, now(), now()
+    FROM measurement_areas
+    ON CONFLICT (date, scope_id, source, kind) DO UPDATE
+    SET area = EXCLUDED.area,
+        perc_area = EXCLUDED.perc_area,
+        updated_at = EXCLUDED.updated_at
+"""
+
+
 def generate_measurements(coverage_masks, scopes=None, simplify=None):
+    """
+    Generate measurements of +coverage_masks+ for each scope (or only for
+    +scopes+), in a single transaction on the database.
+
+    Areas of all (mask, scope) pairs are computed in one set-based query over
+    the projected mask parts (see `CoverageMaskPart`), which PostgreSQL can
+    run with parallel workers.  Then, all measurements are inserted or
+    updated with one INSERT ... ON CONFLICT.  If +simplify+ is given, parts
+    are simplified with that tolerance (in meters) first.
+
+    If that fails (e.g. because of an invalid scope geometry), measurements
+    are generated scope by scope instead, skipping scopes that fail.
+
+    """
     logger.info("Generate measurements for each scope")
 
-    if not scopes:
-        scopes = Scope.objects.all()
+    part_geom = "p.geom"
+    if simplify:
+        part_geom = "ST_MakeValid(ST_Simplify(p.geom, %(simplify)s))"
+    params = dict(
+        srid=32718,
+        mask_ids=[mask.pk for mask in coverage_masks],
+        scope_ids=[scope.pk for scope in scopes] if scopes else None,
+        simplify=simplify,
+    )
 
-    with ThreadPool(mp.cpu_count()) as pool:
-        worker = partial(
-            _generate_measurements, coverage_masks=coverage_masks, simplify=simplify
+    start = time.time()
+    try:
+        count = upsert_measurements(params, part_geom=part_geom)
+    except DatabaseError as err:
+        logger.error(err)
+        logger.info("An error occurred! Generate measurements scope by scope...")
+        count = 0
+        for scope in scopes or Scope.objects.all():
+            try:
+                count += upsert_measurements(
+                    dict(params, scope_ids=[scope.pk]), part_geom=part_geom
+                )
+            except DatabaseError as err:
+                logger.error(err)
+                logger.info(
+                    f"An error occurred! Skipping measurement for scope {scope.id}..."
+                )
+    logger.info("%d measurements generated in %.2f seconds", count, time.time() - start)
+
+
+def upsert_measurements(params, *, part_geom):
+    """Compute areas and upsert measurements with +params+ (see
+    `MEASUREMENT_AREAS_SQL`), in a transaction.  Returns the number of
+    measurements."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Parallel plans are only used for queries, not for inserts, so areas
+        # are computed into a temporary table first
+        cursor.execute(
+            "SET LOCAL max_parallel_workers_per_gather = %s",
+            [settings.EO_SENSORS_MEASUREMENTS_DB_WORKERS],
         )
-        pool.map(worker, scopes)
+        cursor.execute(MEASUREMENT_AREAS_SQL.format(part_geom=part_geom), params)
+        return _upsert_measurement_areas(cursor)
+
+
+def _upsert_measurement_areas(cursor):
+    cursor.execute(UPSERT_MEASUREMENTS_SQL)
+    count = cursor.rowcount
+    # Not dropped on commit if called inside an outer transaction
+    cursor.execute("DROP TABLE measurement_areas")
+    return count
+
+
+def generate_raster_measurements(
+    coverage_masks, scopes=None, *, cov_raster_path, kinds_per_value
+):
+    """
+    Generate measurements of +coverage_masks+ for each scope from pixel counts
+    of the coverage raster +cov_raster_path+ (see `eo_sensors.utils.zonal`),
+    instead of intersecting mask and scope polygons.  +kinds_per_value+ maps
+    raster values to mask kinds.
 
+    Measurements are inserted or updated with the same INSERT ... ON CONFLICT
+    as `generate_measurements`, in a single transaction.
 
-def _generate_measurements(scope, simplify=None, *, coverage_masks):
-    logger.info(f"Scope: %s", scope)
-    scope.geom.transform(32718)
-    scope_area = scope.geom.area
+    """
+    logger.info("Generate measurements for each scope from %s", cov_raster_path)
 
-    for mask in coverage_masks:
-        mask.geom.transform(32718)
-        mask_geom = mask.geom
-        if simplify:
-            mask_geom = mask_geom.simplify(3.0, preserve_topology=False)
+    if not scopes:
+        scopes = Scope.objects.all()
+    scopes = list(scopes)
 
-        inter_geom = scope.geom.intersection(mask_geom)
-        area = inter_geom.area
+    areas = zonal_areas(
+        cov_raster_path,
+        {scope.pk: json.loads(scope.geom.json) for scope in scopes},
+        n_values=max(kinds_per_value) + 1,
+    )
 
-        measurement, created = CoverageMeasurement.objects.update_or_create(
-            date=mask.date,
-            kind=mask.kind,
-            source=mask.source,
-            scope=scope,
-            defaults=dict(area=area, perc_area=area / scope_area),
+    rows = []
+    for scope in scopes:
+        scope_area = scope.geom.transform(32718, clone=True).area
+        area_per_kind = {}
+        for value, area in areas[scope.pk].items():
+            kind = kinds_per_value.get(value)
+            if kind:
+                area_per_kind[kind] = area_per_kind.get(kind, 0) + area
+
+        for mask in coverage_masks:
+            area = float(area_per_kind.get(mask.kind, 0))
+            rows.append((mask.date, scope.pk, mask.source, mask.kind, area, scope_area))
+    if not rows:
+        return
+
+    start = time.time()
+    values = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(rows))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            MEASUREMENT_AREAS_VALUES_SQL.format(values=values),
+            [v for row in rows for v in row],
         )
-        if created:
-            logger.info(f"New measurement: {measurement}")
+        count = _upsert_measurement_areas(cursor)
+    logger.info("%d measurements generated in %.2f seconds", count, time.time() - start)
 
 
 # @deprecated?
@@ -317,43 +663,92 @@ def generate_raster_tiles(raster, zoom_range=(4, 18)):
 
 
 def create_raster_tiles(raster, n_jobs=None, *, levels):
-    gdal2tiles = settings.GDAL2TILES_BIN_PATH
+    if settings.DYNAMIC_TILES:
+        logger.info("Dynamic tiles enabled, skip pre-rendering tiles of %s", raster)
+        return
+
     if not n_jobs:
         n_jobs = settings.GDAL2TILES_NUM_JOBS
 
-    media_dir = settings.MEDIA_ROOT
-    tiles_dir = os.path.join(media_dir, "tiles")
-
     src = raster.file.path
-    dst = os.path.join(tiles_dir, raster.path())
-    tmp_dst = os.path.join("/dev/shm", "tiles", raster.path())
-    zoom_range = f"{levels[0]}-{levels[1]}"
+    dirty = None
+    if settings.TILES_FORMAT == "mbtiles":
+        # Archive file is replaced atomically after writing all tiles
+        dst = raster.tiles_archive_path()
+    else:
+        # Render into a new version directory, and publish it when complete
+        dst = os.path.join(
+            tiles_versions_dir(raster),
+            f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}",
+        )
 
-    logger.info("Delete %s", tmp_dst)
-    if os.path.exists(tmp_dst):
-        shutil.rmtree(tmp_dst, ignore_errors=True)
+        # If there is a previous version of the tiles, re-render only the
+        # tiles that changed since then.  The manifest is stored with the new
+        # version, for the next time.
+        manifest = block_manifest(src, levels=levels, n_jobs=n_jobs)
+        prev_dir = published_tiles_version(raster)
+        if prev_dir:
+            dirty = dirty_tiles(src, load_block_manifest(prev_dir), manifest)
+        if dirty is not None:
+            logger.info(
+                "%d tiles changed since version at %s, update only those",
+                len(dirty),
+                prev_dir,
+            )
+            # Hard link previous tiles, changed tiles are replaced by new files
+            shutil.copytree(
+                prev_dir,
+                dst,
+                copy_function=os.link,
+                ignore=shutil.ignore_patterns(MANIFEST_NAME),
+            )
 
-    cmd = f"{gdal2tiles} --processes {n_jobs} -w none -n -z {zoom_range} {src} {tmp_dst}"
-    run_command(cmd)
+    logger.info("Generate tiles of %s into %s (zoom levels %s)", src, dst, levels)
+    generate_tiles(
+        src,
+        dst,
+        levels=levels,
+        n_jobs=n_jobs,
+        format=settings.TILES_FORMAT,
+        dirty=dirty,
+    )
 
-    logger.info("Move files from %s to %s", tmp_dst, os.path.dirname(dst[:-1]))
-    if os.path.exists(dst):
-        shutil.rmtree(dst, ignore_errors=True)
-    run_command(f"cp -a {tmp_dst} {os.path.dirname(dst[:-1])}/")
-    shutil.rmtree(tmp_dst, ignore_errors=True)
+    if settings.TILES_FORMAT != "mbtiles":
+        os.makedirs(dst, exist_ok=True)
+        with open(os.path.join(dst, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f)
+        publish_tiles(dst, os.path.join(settings.TILES_DIR, raster.path()))
 
 
 def write_rgb_raster(func):
-    def wrapper(*, src_path, dst_path):
-        with rasterio.open(src_path) as src:
-            img = src.read(1)
-            profile = src.profile.copy()
-        new_img = func(img)
-        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-        profile.update(count=new_img.shape[2], dtype=np.uint8)
-        with rasterio.open(dst_path, "w", **profile) as dst:
-            for i in range(new_img.shape[2]):
-                dst.write(new_img[:, :, i], i + 1)
+    """
+    Decorator for functions that turn a single-band image into a (rows, cols,
+    bands) RGB or RGBA image.
+
+    The decorated function reads the raster at +src_path+ block by block,
+    applies the function on blocks in a thread pool of +n_jobs+ threads, and
+    writes a tiled, compressed raster to +dst_path+ (see `process_blocks`).
+
+    """
+
+    @wraps(func)
+    def wrapper(*, src_path, dst_path, n_jobs=None):
+        process_blocks(
+            lambda img: np.transpose(func(img[0]), [2, 0, 1]),
+            [src_path],
+            [dst_path],
+            profiles=[dict(dtype="uint8", nodata=None, predictor=2)],
+            n_jobs=n_jobs,
+            desc=func.__name__,
+        )
+        with rasterio.open(dst_path, "r+") as dst:
+            if dst.count == 4:
+                dst.colorinterp = [
+                    ColorInterp.red,
+                    ColorInterp.green,
+                    ColorInterp.blue,
+                    ColorInterp.alpha,
+                ]
 
     return wrapper
 
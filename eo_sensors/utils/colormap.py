@@ -1,5 +1,6 @@
+from functools import lru_cache
 from numbers import Number
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 
@@ -7,6 +8,8 @@ HexColor = str
 # TODO: Represent ColorMap as a Dict[Number, HexColor]
 ColorMap = List[Tuple[Number, HexColor]]
 DiscreteColorMap = Dict[Number, List[int]]
+# Lookup table of RGBA colors (256x4 uint8 array), indexed by byte value
+LUT = np.ndarray
 
 
 def rescale_to_byte(v, min_value, max_value) -> np.ndarray:
@@ -16,6 +19,7 @@ def rescale_to_byte(v, min_value, max_value) -> np.ndarray:
 
 
 def hex_to_dec_string(value):
+    value = value.lstrip("#")
     return np.array(
         [int(value[i:j], 16) for i, j in [(0, 2), (2, 4), (4, 6)]] + [255], np.uint8
     )
@@ -34,7 +38,7 @@ def build_lut_cmap(cmap: ColorMap) -> DiscreteColorMap:
             prev_v = cmap[i - 1][0]
             min_v = rescale_to_byte(prev_v, min_value=min_value, max_value=max_value)
             max_v = rescale_to_byte(v, min_value=min_value, max_value=max_value)
-            values = np.arange(min_v, max_v + 1, dtype=np.uint8)
+            values = np.arange(int(min_v), int(max_v) + 1).astype(np.uint8)
 
             prev_rgb_color = hex_to_dec_string(cmap[i - 1][1][1:])
             colors = np.round(
@@ -46,10 +50,57 @@ def build_lut_cmap(cmap: ColorMap) -> DiscreteColorMap:
     return {v: list(color) for v, color in res}
 
 
+def build_lut(colormap: DiscreteColorMap) -> LUT:
+    """Build lookup table from a discrete color map. Values without color are
+    transparent."""
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    for k, v in colormap.items():
+        if 0 <= k <= 255:
+            lut[int(k)] = v
+    return lut
+
+
+@lru_cache(maxsize=32)
+def _cmap_lut(cmap: Tuple[Tuple[Number, HexColor], ...]) -> LUT:
+    lut = build_lut(build_lut_cmap(list(cmap)))
+    lut.flags.writeable = False
+    return lut
+
+
+def cmap_lut(cmap: ColorMap) -> LUT:
+    """Build (or get the already built) lookup table of a continuous color map,
+    for data rescaled to 1-255 (see `rescale_to_byte`)"""
+    return _cmap_lut(tuple(tuple(entry) for entry in cmap))
+
+
+def palette_lut(colors: List[Optional[HexColor]]) -> LUT:
+    """Build lookup table for class values, where class `i + 1` is painted
+    with +colors[i]+, and 0 and classes with a None color are transparent"""
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    for i, color in enumerate(colors):
+        if color:
+            lut[i + 1] = hex_to_dec_string(color)
+    return lut
+
+
+def apply_lut(data: np.ndarray, lut: LUT) -> np.ndarray:
+    """Apply lookup table to a 2D array with a single gather, and return a
+    (rows, cols, 4) RGBA array.  Values out of the 0-255 range are
+    transparent."""
+    if data.dtype == np.uint8:
+        return lut[data]
+    out_of_range = (data < 0) | (data > 255)
+    res = lut[np.clip(data, 0, 255).astype(np.uint8)]
+    if out_of_range.any():
+        res[out_of_range] = 0
+    return res
+
+
 def apply_cmap(data: np.ndarray, colormap: ColorMap) -> Tuple[np.ndarray, np.ndarray]:
     """Apply colormap to data"""
-    discrete_cmap = build_lut_cmap(colormap)
-    return apply_discrete_cmap(data, discrete_cmap)
+    res = apply_lut(data[0], cmap_lut(colormap))
+    data = np.transpose(res, [2, 0, 1])
+    return data[:-1], data[-1]
 
 
 def apply_discrete_cmap(
@@ -76,11 +127,7 @@ def apply_discrete_cmap(
             assert data.shape == (3, 256, 256)
 
     """
-    res = np.zeros((data.shape[1], data.shape[2], 4), dtype=np.uint8)
-
-    for k, v in colormap.items():
-        res[data[0] == k] = v
-
+    res = apply_lut(data[0], build_lut(colormap))
     data = np.transpose(res, [2, 0, 1])
 
     return data[:-1], data[-1]
@@ -0,0 +1,183 @@
+import json
+import logging
+import math
+import multiprocessing as mp
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+# Configure logger
+logger = logging.getLogger(__name__)
+out_handler = logging.StreamHandler(sys.stdout)
+out_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+out_handler.setLevel(logging.INFO)
+logger.addHandler(out_handler)
+logger.setLevel(logging.INFO)
+
+
+def raster_percentiles(
+    paths,
+    *,
+    lower_cut=2,
+    upper_cut=98,
+    max_error=0.005,
+    confidence=0.99,
+    n_jobs=None,
+    cache_path=None,
+    seed=0,
+):
+    """
+    Estimate +lower_cut+ and +upper_cut+ percentiles of each band over all
+    rasters +paths+ (e.g. the tiles of a scene), from a sample of pixels.
+
+    Sample size is chosen so that, by the Dvoretzky-Kiefer-Wolfowitz
+    inequality, estimated percentiles are within +max_error+ (as a fraction
+    of rank, e.g. 0.005 is half a percentile) of the true ones with
+    probability +confidence+.  The inequality holds for independent samples,
+    so pixels are drawn one by one, uniformly at random (see
+    `sample_raster`), from every raster in proportion to its size, in
+    parallel using +n_jobs+ threads.  Nodata pixels are ignored.
+
+    If +cache_path+ is given, results are stored there as JSON, and reused
+    while rasters and parameters do not change.
+
+    Returns a list of (low, high) tuples, one per band.
+
+    """
+    if not n_jobs:
+        n_jobs = mp.cpu_count()
+
+    key = dict(
+        files=[_file_key(path) for path in sorted(paths)],
+        lower_cut=lower_cut,
+        upper_cut=upper_cut,
+        max_error=max_error,
+        confidence=confidence,
+        seed=seed,
+        # Sampling method, bump when changing it
+        version=2,
+    )
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            logger.info("Use cached percentiles from %s", cache_path)
+            return [tuple(r) for r in cached["percentiles"]]
+
+    n_samples = dkw_sample_size(max_error, confidence)
+    sizes = []
+    for path in paths:
+        with rasterio.open(path) as src:
+            sizes.append(src.width * src.height)
+    total = sum(sizes)
+
+    rngs = [
+        np.random.default_rng(seq)
+        for seq in np.random.SeedSequence(seed).spawn(len(paths))
+    ]
+    with ThreadPoolExecutor(n_jobs) as pool:
+        samples = list(
+            pool.map(
+                lambda args: sample_raster(*args),
+                [
+                    (path, math.ceil(n_samples * size / total), rng)
+                    for path, size, rng in zip(paths, sizes, rngs)
+                ],
+            )
+        )
+
+    n_blocks = sum(blocks for _, blocks in samples)
+    samples = [values for values, _ in samples]
+
+    percentiles = []
+    for band_samples in zip(*samples):
+        values = np.concatenate(band_samples)
+        if not len(values):
+            raise ValueError("No valid pixels found to compute percentiles")
+        low, high = np.percentile(values, [lower_cut, upper_cut])
+        percentiles.append((float(low), float(high)))
+    n_valid = min(
+        sum(len(s) for s in band_samples) for band_samples in zip(*samples)
+    )
+    logger.info(
+        "Percentiles (%s, %s) from %d sampled pixels, read from %d blocks "
+        "(rank error <= %.4f with %d%% confidence): %s",
+        lower_cut,
+        upper_cut,
+        n_valid,
+        n_blocks,
+        dkw_error(n_valid, confidence),
+        confidence * 100,
+        percentiles,
+    )
+
+    if cache_path:
+        with open(cache_path, "w") as f:
+            json.dump(dict(key=key, percentiles=percentiles), f)
+
+    return percentiles
+
+
+def sample_raster(path, n, rng):
+    """
+    Sample +n+ pixels of raster +path+ uniformly at random, with replacement
+    (or take all of them, if it has less), and return valid values of each
+    band, and the number of blocks read.
+
+    Pixels are drawn independently, as pixels of the same block are
+    correlated, but only blocks that hold sampled pixels are read.
+
+    """
+    with rasterio.open(path) as src:
+        if n >= src.width * src.height:
+            img = src.read(masked=True).reshape(src.count, -1)
+            n_blocks = len(list(src.block_windows(1)))
+        else:
+            img, n_blocks = _sample_pixels(src, n, rng)
+    return [np.ma.asarray(band).compressed() for band in img], n_blocks
+
+
+def dkw_sample_size(max_error, confidence):
+    """Samples needed so that the empirical CDF is within +max_error+ of the
+    true CDF with probability +confidence+"""
+    return math.ceil(math.log(2 / (1 - confidence)) / (2 * max_error ** 2))
+
+
+def dkw_error(n, confidence):
+    """Maximum error of the empirical CDF of +n+ samples with probability
+    +confidence+"""
+    return math.sqrt(math.log(2 / (1 - confidence)) / (2 * n)) if n else 1.0
+
+
+def _sample_pixels(src, n, rng):
+    idxs = rng.integers(0, src.width * src.height, n)
+    rows, cols = np.divmod(idxs, src.width)
+    block_height, block_width = src.block_shapes[0]
+    block_cols = math.ceil(src.width / block_width)
+    block_idxs = (rows // block_height) * block_cols + cols // block_width
+
+    # Read blocks in file order, and take their sampled pixels
+    order = np.argsort(block_idxs, kind="stable")
+    block_idxs, starts = np.unique(block_idxs[order], return_index=True)
+    imgs = []
+    for block_idx, pixels in zip(block_idxs, np.split(order, starts[1:])):
+        row_off = block_idx // block_cols * block_height
+        col_off = block_idx % block_cols * block_width
+        window = Window(
+            col_off,
+            row_off,
+            min(block_width, src.width - col_off),
+            min(block_height, src.height - row_off),
+        )
+        img = src.read(window=window, masked=True)
+        imgs.append(img[:, rows[pixels] - row_off, cols[pixels] - col_off])
+    return np.ma.concatenate(imgs, axis=1), len(block_idxs)
+
+
+def _file_key(path):
+    st = os.stat(path)
+    return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
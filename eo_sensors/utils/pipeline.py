@@ -0,0 +1,337 @@
+import logging
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import rasterio
+from rasterio.dtypes import in_dtype_range
+from rasterio.windows import Window
+from tqdm import tqdm
+
+# Configure logger
+logger = logging.getLogger(__name__)
+out_handler = logging.StreamHandler(sys.stdout)
+out_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+out_handler.setLevel(logging.INFO)
+logger.addHandler(out_handler)
+logger.setLevel(logging.INFO)
+
+# Creation options of output rasters, unless overriden
+DEFAULT_PROFILE = dict(
+    driver="GTiff", tiled=True, blockxsize=256, blockysize=256, compress="deflate"
+)
+
+
+def process_blocks(
+    func,
+    src_paths,
+    dst_paths,
+    *,
+    profiles=None,
+    indexes=None,
+    window=None,
+    windows=None,
+    pass_window=False,
+    n_jobs=None,
+    ordered=True,
+    skip_empty=False,
+    desc=None,
+):
+    """
+    Apply +func+ to rasters +src_paths+ block by block, and write results into
+    rasters +dst_paths+.
+
+    All input rasters must share the same grid.  For each block, +func+ is
+    called with one (bands, rows, cols) array per input (bands can be selected
+    with +indexes+, a list of band indexes per input), and must return one
+    array per output, either (bands, rows, cols) or (rows, cols).  If there is
+    a single output, it can return the array itself.
+
+    Outputs are created with the profile of the first input, updated with
+    `DEFAULT_PROFILE` and with +profiles+ (a dict of overrides per output).
+    Band count and dtype are taken from the results of +func+ if they are not
+    overriden.
+
+    Blocks are read and processed by a pool of +n_jobs+ threads, and written
+    by the calling thread, either in order or as soon as they are done (if
+    +ordered+ is false).  Only a few blocks are held in memory at the same
+    time.  By default, blocks are the internal blocks of the first input, but
+    an iterable of +windows+ can be given instead.
+
+    If +window+ is given, only that window of the inputs is processed, and
+    outputs cover that window only (i.e. inputs are cropped).  In that case,
+    blocks are squares of 512 pixels of the output, and +windows+ are relative
+    to the output too.  If +pass_window+ is true, +func+ is called with the
+    (output) window of the block as first argument.
+
+    If +skip_empty+ is true, blocks where all inputs are nodata are not
+    processed, and left empty (i.e. nodata, or zero) on outputs.
+
+    Returns a dictionary with the number of blocks processed and skipped, and
+    elapsed time.
+
+    """
+    if not n_jobs:
+        n_jobs = mp.cpu_count()
+    if profiles is None:
+        profiles = [{} for _ in dst_paths]
+    if indexes is None:
+        indexes = [None for _ in src_paths]
+
+    with rasterio.open(src_paths[0]) as src:
+        base_profile = src.profile.copy()
+        if window is not None:
+            window = window.round_offsets().round_lengths()
+            base_profile.update(
+                width=window.width,
+                height=window.height,
+                transform=src.window_transform(window),
+            )
+            if windows is None:
+                windows = sliding_windows(512, window.width, window.height)
+        elif windows is None:
+            windows = [w for _, w in src.block_windows(1)]
+        windows = list(windows)
+    _check_grids(src_paths)
+
+    reader = _BlockReader(src_paths, indexes, skip_empty=skip_empty)
+    writer = _BlockWriter(dst_paths, base_profile, profiles)
+
+    def process(block):
+        src_block = block
+        if window is not None:
+            src_block = Window(
+                window.col_off + block.col_off,
+                window.row_off + block.row_off,
+                block.width,
+                block.height,
+            )
+        imgs = reader.read(src_block)
+        if imgs is None:
+            return block, None
+        res = func(block, *imgs) if pass_window else func(*imgs)
+        if len(dst_paths) == 1 and not isinstance(res, (list, tuple)):
+            res = [res]
+        return block, res
+
+    start = time.time()
+    stats = dict(blocks=0, skipped=0)
+
+    def write(result):
+        block, res = result
+        if res is None:
+            stats["skipped"] += 1
+        else:
+            writer.write(block, res)
+            stats["blocks"] += 1
+        progress.update()
+
+    max_pending = 2 * n_jobs
+    try:
+        with ThreadPoolExecutor(n_jobs) as pool, tqdm(
+            total=len(windows), desc=desc
+        ) as progress:
+            pending = deque()
+            for block in windows:
+                pending.append(pool.submit(process, block))
+                if len(pending) < max_pending:
+                    continue
+                if ordered:
+                    write(pending.popleft().result())
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pending.remove(future)
+                        write(future.result())
+            while pending:
+                write(pending.popleft().result())
+    finally:
+        writer.close()
+        reader.close()
+
+    stats["seconds"] = time.time() - start
+    pixels = sum(w.width * w.height for w in windows)
+    logger.info(
+        "%s: %d blocks processed, %d skipped, in %.2f seconds (%.2f Mpixels/s)",
+        desc or ", ".join(os.path.basename(p) for p in dst_paths),
+        stats["blocks"],
+        stats["skipped"],
+        stats["seconds"],
+        pixels / stats["seconds"] / 1e6 if stats["seconds"] else 0,
+    )
+    return stats
+
+
+def reduce_blocks(
+    func,
+    src_paths,
+    *,
+    indexes=None,
+    windows=None,
+    pass_window=False,
+    n_jobs=None,
+    skip_empty=False,
+    desc=None,
+):
+    """
+    Apply +func+ to rasters +src_paths+ block by block, and return the sum of
+    its results (e.g. histograms or counts, or lists to concatenate), or None
+    if no block was processed.  Results are added in place, in block order.
+
+    Inputs, +indexes+, +windows+, +pass_window+ and +skip_empty+ work as in
+    `process_blocks`, and blocks are processed by a pool of +n_jobs+ threads.
+
+    """
+    if not n_jobs:
+        n_jobs = mp.cpu_count()
+    if indexes is None:
+        indexes = [None for _ in src_paths]
+
+    if windows is None:
+        with rasterio.open(src_paths[0]) as src:
+            windows = [w for _, w in src.block_windows(1)]
+    windows = list(windows)
+    _check_grids(src_paths)
+
+    reader = _BlockReader(src_paths, indexes, skip_empty=skip_empty)
+
+    def process(block):
+        imgs = reader.read(block)
+        if imgs is None:
+            return None
+        return func(block, *imgs) if pass_window else func(*imgs)
+
+    start = time.time()
+    total = None
+
+    def accumulate(res):
+        nonlocal total
+        if res is not None:
+            if total is None:
+                total = res
+            else:
+                total += res
+        progress.update()
+
+    max_pending = 2 * n_jobs
+    try:
+        with ThreadPoolExecutor(n_jobs) as pool, tqdm(
+            total=len(windows), desc=desc
+        ) as progress:
+            pending = deque()
+            for block in windows:
+                pending.append(pool.submit(process, block))
+                if len(pending) >= max_pending:
+                    accumulate(pending.popleft().result())
+            while pending:
+                accumulate(pending.popleft().result())
+    finally:
+        reader.close()
+
+    logger.info(
+        "%s: %d blocks reduced in %.2f seconds",
+        desc or ", ".join(os.path.basename(p) for p in src_paths),
+        len(windows),
+        time.time() - start,
+    )
+    return total
+
+
+def sliding_windows(size, width, height):
+    """Slide a window of +size+ pixels"""
+    for i in range(0, height, size):
+        for j in range(0, width, size):
+            yield Window(j, i, min(width - j, size), min(height - i, size))
+
+
+def _check_grids(src_paths):
+    grid = None
+    for path in src_paths:
+        with rasterio.open(path) as src:
+            src_grid = (src.width, src.height, src.transform)
+        if grid is None:
+            grid = src_grid
+        # Allow for rounding errors on transforms written by other tools
+        elif src_grid[:2] != grid[:2] or not src_grid[2].almost_equals(grid[2]):
+            raise ValueError(f"{path} is not on the same grid as {src_paths[0]}")
+
+
+class _BlockReader:
+    """Reads blocks of a set of rasters from multiple threads (each thread
+    has its own dataset handles, as they can't be shared)"""
+
+    def __init__(self, paths, indexes, *, skip_empty):
+        self.paths = paths
+        self.indexes = indexes
+        self.skip_empty = skip_empty
+        self._local = threading.local()
+        self._datasets = []
+        self._lock = threading.Lock()
+
+    def read(self, window):
+        datasets = getattr(self._local, "datasets", None)
+        if datasets is None:
+            datasets = [rasterio.open(path) for path in self.paths]
+            self._local.datasets = datasets
+            with self._lock:
+                self._datasets.extend(datasets)
+
+        imgs = [
+            src.read(idx, window=window) for src, idx in zip(datasets, self.indexes)
+        ]
+        if self.skip_empty and all(
+            src.nodata is not None and np.all(img == src.nodata)
+            for src, img in zip(datasets, imgs)
+        ):
+            return None
+        return imgs
+
+    def close(self):
+        for src in self._datasets:
+            src.close()
+
+
+class _BlockWriter:
+    """Opens output rasters on the first written block, so that band count
+    and dtype can be taken from results"""
+
+    def __init__(self, paths, base_profile, profiles):
+        self.paths = paths
+        self.base_profile = base_profile
+        self.profiles = profiles
+        self._datasets = [None for _ in paths]
+
+    def write(self, window, imgs):
+        for i, img in enumerate(imgs):
+            if img.ndim == 2:
+                img = img[np.newaxis, :]
+            if self._datasets[i] is None:
+                self._datasets[i] = self._open(i, count=img.shape[0], dtype=img.dtype)
+            dst = self._datasets[i]
+            dst.write(img.astype(dst.dtypes[0], copy=False), window=window)
+
+    def close(self):
+        for i, dst in enumerate(self._datasets):
+            # Create outputs even if no block was written (all were skipped)
+            if dst is None:
+                dst = self._open(i, count=self.base_profile["count"], dtype=None)
+            dst.close()
+
+    def _open(self, i, *, count, dtype):
+        profile = self.base_profile.copy()
+        profile.update(DEFAULT_PROFILE)
+        profile.update(count=count)
+        if dtype is not None:
+            profile.update(dtype=dtype)
+        profile.update(self.profiles[i])
+        # Drop nodata inherited from input if it does not fit the output dtype
+        nodata = profile.get("nodata")
+        if nodata is not None and not in_dtype_range(nodata, profile["dtype"]):
+            profile["nodata"] = None
+        os.makedirs(os.path.dirname(os.path.abspath(self.paths[i])), exist_ok=True)
+        return rasterio.open(self.paths[i], "w", **profile)
@@ -0,0 +1,68 @@
+import logging
+import os
+import sys
+import tempfile
+
+from eo_sensors import gdal_ops
+from eo_sensors.utils.pipeline import process_blocks
+from eo_sensors.utils.step_cache import cached_step
+
+# Configure logger
+logger = logging.getLogger(__name__)
+out_handler = logging.StreamHandler(sys.stdout)
+out_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+out_handler.setLevel(logging.INFO)
+logger.addHandler(out_handler)
+logger.setLevel(logging.INFO)
+
+# Creation options of elevation masks: 1 bit per pixel, compressed
+MASK_PROFILE = dict(
+    count=1,
+    dtype="uint8",
+    nodata=None,
+    nbits=1,
+    compress="deflate",
+    predictor=1,
+    blockxsize=512,
+    blockysize=512,
+)
+
+
+def elevation_mask(dst_path, *, dem_path, extent_path, min_elevation, max_elevation):
+    """
+    Write a mask of pixels of DEM +dem_path+ between +min_elevation+ and
+    +max_elevation+ (inclusive), clipped to +extent_path+, into +dst_path+.
+
+    The mask is a 1-bit compressed GeoTIFF on the grid of the clipped DEM, so
+    it can also be used as the reference grid to align other rasters to.  It
+    is stored on the step cache, keyed by the contents of the DEM and the
+    extent, and the thresholds, so it is only computed once.
+
+    Returns +dst_path+.
+
+    """
+    with cached_step(
+        "srtm.elevation_mask",
+        inputs=[dem_path, extent_path],
+        outputs=[dst_path],
+        params=dict(min_elevation=min_elevation, max_elevation=max_elevation),
+    ) as step:
+        if not step.cached:
+            logger.info(
+                "Build elevation mask (%s-%s) of %s",
+                min_elevation,
+                max_elevation,
+                dem_path,
+            )
+            with tempfile.TemporaryDirectory() as tmpdir:
+                clipped_path = os.path.join(tmpdir, "dem.vrt")
+                gdal_ops.clip(dem_path, clipped_path, aoi=extent_path, format="VRT")
+                process_blocks(
+                    lambda dem: (dem >= min_elevation) & (dem <= max_elevation),
+                    [clipped_path],
+                    [dst_path],
+                    indexes=[1],
+                    profiles=[MASK_PROFILE],
+                    desc="elevation mask",
+                )
+    return dst_path
@@ -0,0 +1,338 @@
+"""
+Content-addressed cache of processing steps.
+
+A step is identified by its name, a version, its parameters, and the content
+of its input files.  When a step is run again with the same key, its outputs
+are restored from the cache (as hard links) instead of running it again, no
+matter where the inputs are, or which period is being processed.
+
+    with cached_step(
+        "s1.calibrate", inputs=[src], outputs=[dst], params=dict(pol="vv")
+    ) as step:
+        if not step.cached:
+            run_otb_command(...)
+
+Outputs of a cached step are hard links to the files in the cache, so they
+must not be modified in place afterwards.
+
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Configure logger
+logger = logging.getLogger(__name__)
+out_handler = logging.StreamHandler(sys.stdout)
+out_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+out_handler.setLevel(logging.INFO)
+logger.addHandler(out_handler)
+logger.setLevel(logging.INFO)
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    step TEXT NOT NULL,
+    outputs TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used_at ON entries (last_used_at);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    path TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+"""
+
+
+class StepCache:
+    """
+    Cache of step outputs stored at +path+, with an SQLite index.  Least
+    recently used entries are deleted when the cache grows larger than
+    +max_size+ bytes.
+
+    """
+
+    def __init__(self, path, *, max_size):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(self.objects_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @property
+    def objects_dir(self):
+        return os.path.join(self.path, "objects")
+
+    def step_key(self, name, *, inputs, params=None, version=1):
+        """Hash of step +name+, +version+, +params+ and contents of +inputs+"""
+        key = dict(
+            step=name,
+            version=version,
+            params=params or {},
+            inputs=[self.fingerprint(path) for path in inputs],
+        )
+        return hashlib.sha256(
+            json.dumps(key, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def fingerprint(self, path):
+        """
+        Content hash of a file, or of all files in a directory.
+
+        Hashes are memoized by path, inode, size and modification time, so
+        each file is read only once.
+
+        """
+        if os.path.isdir(path):
+            h = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    h.update(os.path.relpath(file_path, path).encode())
+                    h.update(self.fingerprint(file_path).encode())
+            return h.hexdigest()
+
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT digest FROM fingerprints "
+                "WHERE path = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+                (path, st.st_ino, st.st_size, st.st_mtime_ns),
+            ).fetchone()
+        if row:
+            return row[0]
+
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self._remember_fingerprint(path, digest)
+        return digest
+
+    def restore(self, key, outputs):
+        """Link cached outputs of step +key+ into +outputs+ paths.  Returns
+        False if there is no (valid) entry for this key"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT outputs FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        if not row:
+            return False
+
+        entry_outputs = json.loads(row[0])
+        entry_dir = self._entry_dir(key)
+        if len(entry_outputs) != len(outputs) or not all(
+            os.path.exists(os.path.join(entry_dir, str(i)))
+            for i in range(len(outputs))
+        ):
+            logger.warning("Cache entry %s is incomplete, delete it", key)
+            self._delete(key)
+            return False
+
+        for i, (dst, output) in enumerate(zip(outputs, entry_outputs)):
+            _remove(dst)
+            os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+            _link(os.path.join(entry_dir, str(i)), dst)
+            if not os.path.isdir(dst):
+                self._remember_fingerprint(dst, output["digest"])
+
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE entries SET last_used_at = ? WHERE key = ?", (time.time(), key)
+            )
+        return True
+
+    def store(self, key, name, outputs):
+        """Store +outputs+ of step +name+ under +key+"""
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f"{entry_dir}.{uuid.uuid4().hex[:8]}.tmp"
+        os.makedirs(tmp_dir)
+        try:
+            entry_outputs = []
+            for i, path in enumerate(outputs):
+                if not os.path.exists(path):
+                    raise RuntimeError(f"Step {name} did not write output {path}")
+                _link(path, os.path.join(tmp_dir, str(i)))
+                entry_outputs.append(dict(digest=self.fingerprint(path)))
+            _remove(entry_dir)
+            os.rename(tmp_dir, entry_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(key, step, outputs, size, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, name, json.dumps(entry_outputs), _du(entry_dir), now, now),
+            )
+        self.gc()
+
+    def gc(self):
+        """Delete least recently used entries until the cache fits in
+        `max_size` bytes"""
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_size:
+                return
+            rows = conn.execute(
+                "SELECT key, size FROM entries ORDER BY last_used_at"
+            ).fetchall()
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            logger.info("Evict step cache entry %s (%d bytes)", key, size)
+            self._delete(key)
+            total -= size
+
+    def _delete(self, key):
+        _remove(self._entry_dir(key))
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _remember_fingerprint(self, path, digest):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO fingerprints "
+                "(path, inode, size, mtime_ns, digest) VALUES (?, ?, ?, ?, ?)",
+                (path, st.st_ino, st.st_size, st.st_mtime_ns, digest),
+            )
+
+    def _entry_dir(self, key):
+        return os.path.join(self.objects_dir, key[:2], key)
+
+    def _connect(self):
+        # Connection context managers only commit, so close connections when
+        # done with them
+        return _closing_connection(os.path.join(self.path, "index.sqlite3"))
+
+
+class Step:
+    def __init__(self, name, key, *, cached):
+        self.name = name
+        self.key = key
+        self.cached = cached
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = StepCache(
+            settings.EO_SENSORS_STEP_CACHE_DIR,
+            max_size=settings.EO_SENSORS_STEP_CACHE_SIZE * 1024 ** 2,
+        )
+    return _cache
+
+
+@contextmanager
+def cached_step(name, *, inputs, outputs, params=None, version=1):
+    """
+    Run a processing step only if its outputs are not cached.
+
+    The step is keyed by its +name+, +version+, +params+ and the contents of
+    its +inputs+ (files or directories).  If there is an entry for that key,
+    +outputs+ are restored from the cache, and `step.cached` is true, so the
+    body should not run the step.  Otherwise, existing +outputs+ are deleted
+    first, and stored in the cache when the body finishes without errors.
+
+    Bump +version+ when the step changes in a way that invalidates its
+    previous outputs.
+
+    """
+    cache = get_cache()
+    key = cache.step_key(name, inputs=inputs, params=params, version=version)
+    cached = cache.restore(key, outputs)
+    if cached:
+        logger.info("Step %s is cached (%s), skip it", name, key[:12])
+    else:
+        # Stale outputs might be links to cached files, so never write on them
+        for path in outputs:
+            _remove(path)
+    step = Step(name, key, cached=cached)
+    yield step
+    if not cached:
+        cache.store(key, name, outputs)
+
+
+def restore_step(name, *, inputs, outputs, params=None, version=1):
+    """
+    Restore +outputs+ of a step from the cache, without running it.  The step
+    is keyed as in `cached_step`.  Returns False if there is no entry for it.
+
+    Useful to skip the work needed to prepare the inputs of a step (e.g.
+    downloads) when its outputs are already cached.
+
+    """
+    cache = get_cache()
+    key = cache.step_key(name, inputs=inputs, params=params, version=version)
+    if not cache.restore(key, outputs):
+        return False
+    logger.info("Step %s is cached (%s), restored its outputs", name, key[:12])
+    return True
+
+
+@contextmanager
+def _closing_connection(path):
+    conn = sqlite3.connect(path, timeout=60)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _link(src, dst):
+    if os.path.isdir(src):
+        shutil.copytree(src, dst, copy_function=_link_file)
+    else:
+        _link_file(src, dst)
+
+
+def _link_file(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Cache is on another file system
+        shutil.copy2(src, dst)
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _du(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path)
+        for name in files
+    )
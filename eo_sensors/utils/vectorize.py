@@ -0,0 +1,202 @@
+import logging
+import math
+import multiprocessing as mp
+import sys
+
+import numpy as np
+import rasterio
+from affine import Affine
+from eo_sensors.utils.pipeline import reduce_blocks
+from rasterio.features import shapes
+from rasterio.warp import transform as transform_coords
+from shapely.geometry import MultiPolygon, Polygon, shape
+from shapely.ops import unary_union
+from shapely.strtree import STRtree
+
+# Configure logger
+logger = logging.getLogger(__name__)
+out_handler = logging.StreamHandler(sys.stdout)
+out_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+out_handler.setLevel(logging.INFO)
+logger.addHandler(out_handler)
+logger.setLevel(logging.INFO)
+
+# Minimum number of geometries to merge in parallel
+PARALLEL_UNION_MIN_SIZE = 10000
+
+
+def polygonize(src_path, *, band=1, dst_crs=None, n_jobs=None):
+    """
+    Polygonize band +band+ of raster +src_path+ in-process, and return a dict
+    of multipolygons by pixel value, in +dst_crs+ (or in the CRS of the
+    raster).  Zero and nodata pixels are ignored.
+
+    Polygons are merged with `parallel_union`, in pixel coordinates (see
+    `polygonize_blocks`), and coordinates of each merged multipolygon are then
+    transformed all at once.
+
+    """
+    with rasterio.open(src_path) as src:
+        transform, crs = src.transform, src.crs
+
+    values, geoms = polygonize_blocks(src_path, band=band, n_jobs=n_jobs)
+    logger.info("%d polygons found, merge them by value", len(geoms))
+
+    res = {}
+    for value in np.unique(values):
+        geom = parallel_union(geoms[values == value], n_jobs=n_jobs)
+        res[int(value)] = reproject_geometry(geom, transform, crs, dst_crs)
+    return res
+
+
+def polygonize_blocks(src_path, *, band=1, n_jobs=None):
+    """
+    Polygonize band +band+ of raster +src_path+ block by block, in parallel
+    using +n_jobs+ threads.  Zero and nodata pixels are ignored.
+
+    Polygons are in pixel coordinates, so that polygons cut by block edges
+    share exactly the same vertices and are dissolved when merged.
+
+    Returns an array of pixel values and an array of polygons.
+
+    """
+    with rasterio.open(src_path) as src:
+        nodata = src.nodata
+
+    def vectorize(block, img):
+        mask = img != 0
+        if nodata is not None:
+            mask &= img != nodata
+        if not mask.any():
+            return None
+        return [
+            (value, shape(geom))
+            for geom, value in shapes(
+                img,
+                mask=mask,
+                transform=Affine.translation(block.col_off, block.row_off),
+            )
+        ]
+
+    pairs = reduce_blocks(
+        vectorize,
+        [src_path],
+        indexes=[band],
+        pass_window=True,
+        n_jobs=n_jobs,
+        desc="polygonize",
+    )
+    pairs = pairs or []
+    values = np.array([value for value, _ in pairs])
+    # Fill one by one, as numpy would try to unpack geometries otherwise
+    geoms = np.empty(len(pairs), dtype=object)
+    for i, (_, geom) in enumerate(pairs):
+        geoms[i] = geom
+    return values, geoms
+
+
+def parallel_union(geoms, *, n_jobs=None, min_size=PARALLEL_UNION_MIN_SIZE):
+    """
+    Union of +geoms+, computed with a pool of +n_jobs+ processes.
+
+    Geometries are bucketed on a grid of cells by the center of their bounds,
+    each cell is merged on a process, and then cells are merged
+    hierarchically (2x2 cells at a time) until there is a single one left.
+    When merging cells, only polygons whose bounds intersect polygons of
+    another cell are merged again, the rest are kept as they are.  The result
+    is the same as `unary_union(geoms)`, as a point set.
+
+    With less than +min_size+ geometries, or a single job, they are merged
+    on a single `unary_union` call.
+
+    """
+    if not n_jobs:
+        n_jobs = mp.cpu_count()
+    geoms = list(geoms)
+    if n_jobs == 1 or len(geoms) < min_size:
+        return unary_union(geoms)
+
+    # Side of the grid, as a power of 2, with about 4 cells per process
+    side = 2 ** math.ceil(math.log2(math.sqrt(4 * n_jobs)))
+    bounds = np.array([geom.bounds for geom in geoms])
+    xs = (bounds[:, 0] + bounds[:, 2]) / 2
+    ys = (bounds[:, 1] + bounds[:, 3]) / 2
+    cols = _grid_index(xs, side)
+    rows = _grid_index(ys, side)
+
+    cell_idxs = cols * side + rows
+    order = np.argsort(cell_idxs, kind="stable")
+    cell_idxs, starts = np.unique(cell_idxs[order], return_index=True)
+    buckets = [[geoms[i] for i in idxs] for idxs in np.split(order, starts[1:])]
+    keys = [(idx // side, idx % side) for idx in cell_idxs.tolist()]
+
+    with mp.Pool(n_jobs) as pool:
+        cells = dict(zip(keys, pool.map(_union, buckets)))
+        while len(cells) > 1:
+            groups = {}
+            for (col, row), geom in cells.items():
+                groups.setdefault((col // 2, row // 2), []).append(geom)
+            cells = dict(zip(groups, pool.map(_merge, groups.values())))
+    return next(iter(cells.values()))
+
+
+def reproject_geometry(geom, transform, src_crs, dst_crs=None):
+    """Transform all coordinates of (multi)polygon +geom+ (in pixels) with
+    affine +transform+, and then from +src_crs+ to +dst_crs+, at once.
+    Returns a multipolygon."""
+    polygons = list(as_multipolygon(geom).geoms)
+    rings = [np.asarray(r.coords) for p in polygons for r in (p.exterior, *p.interiors)]
+    if not rings:
+        return MultiPolygon()
+
+    coords = np.concatenate(rings)
+    xs, ys = transform * (coords[:, 0], coords[:, 1])
+    if dst_crs is not None:
+        xs, ys = transform_coords(src_crs, dst_crs, xs, ys)
+    coords = np.column_stack([xs, ys])
+    rings = iter(np.split(coords, np.cumsum([len(r) for r in rings])[:-1]))
+
+    return MultiPolygon(
+        [Polygon(next(rings), [next(rings) for _ in p.interiors]) for p in polygons]
+    )
+
+
+def as_multipolygon(geom):
+    """Return (multi)polygon +geom+ as a multipolygon"""
+    if geom.geom_type == "MultiPolygon":
+        return geom
+    if geom.geom_type == "Polygon":
+        return MultiPolygon([geom])
+    return MultiPolygon([g for g in geom.geoms if g.geom_type == "Polygon"])
+
+
+def _grid_index(coords, side):
+    lo, hi = coords.min(), coords.max()
+    if hi == lo:
+        return np.zeros(len(coords), dtype=np.int64)
+    return np.clip(((coords - lo) / (hi - lo) * side).astype(np.int64), 0, side - 1)
+
+
+def _union(geoms):
+    return unary_union(geoms)
+
+
+def _merge(geoms):
+    # Polygons of each geometry are disjoint, so only those that might
+    # intersect polygons of other geometries need to be merged
+    parts, labels = [], []
+    for label, geom in enumerate(geoms):
+        polygons = as_multipolygon(geom).geoms
+        parts.extend(polygons)
+        labels.extend(label for _ in polygons)
+    tree = STRtree(parts)
+    idxs = {id(part): i for i, part in enumerate(parts)}
+    touching = [
+        any(labels[idxs[id(other)]] != labels[i] for other in tree.query(part))
+        for i, part in enumerate(parts)
+    ]
+    merged = unary_union([part for part, t in zip(parts, touching) if t])
+    return MultiPolygon(
+        [part for part, t in zip(parts, touching) if not t]
+        + list(as_multipolygon(merged).geoms)
+    )
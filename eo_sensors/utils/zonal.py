@@ -0,0 +1,201 @@
+"""
+Raster-native zonal areas: area of each class of a categorical raster inside
+each scope, computed from pixel counts instead of intersecting polygons.
+
+Scopes are rasterized once onto the grid of the raster, as label layers
+(scopes that overlap go on different layers), and stored on the step cache.
+Then, class areas per scope are computed block by block with a single
+`bincount` over (label, class value) pairs per layer.
+
+"""
+import hashlib
+import logging
+import math
+import os
+import sys
+import tempfile
+
+import numpy as np
+import rasterio
+from eo_sensors.utils.pipeline import process_blocks, reduce_blocks
+from eo_sensors.utils.step_cache import cached_step
+from rasterio.features import rasterize
+from rasterio.warp import transform_geom
+from rasterio.windows import bounds as window_bounds
+from rasterio.windows import transform as window_transform
+from shapely.geometry import box, shape
+from shapely.strtree import STRtree
+
+# Configure logger
+logger = logging.getLogger(__name__)
+out_handler = logging.StreamHandler(sys.stdout)
+out_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+out_handler.setLevel(logging.INFO)
+logger.addHandler(out_handler)
+logger.setLevel(logging.INFO)
+
+# Mean Earth radius, in meters, used for pixel areas of geographic rasters
+EARTH_RADIUS = 6371008.8
+
+
+def zonal_areas(src_path, geoms, *, n_values=256, n_jobs=None):
+    """
+    Compute the area of each value of categorical raster +src_path+ inside
+    each geometry of +geoms+ (a dict of GeoJSON-like geometries in EPSG:4326,
+    by key).  Values outside [0, +n_values+) and nodata are ignored.
+
+    Returns a dict of {value: area} dicts by key, with areas in square
+    meters.  Values with no pixels inside a geometry are omitted.
+
+    """
+    keys = list(geoms)
+    with rasterio.open(src_path) as src:
+        crs, transform = src.crs, src.transform
+        width, height, nodata = src.width, src.height, src.nodata
+    shapes = [shape(transform_geom("EPSG:4326", crs, geoms[key])) for key in keys]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        labels_path = os.path.join(tmpdir, "labels.tif")
+        params = dict(
+            crs=crs.to_wkt(),
+            transform=list(transform),
+            width=width,
+            height=height,
+            shapes=[hashlib.sha256(s.wkb).hexdigest() for s in shapes],
+        )
+        with cached_step(
+            "zonal.label_layers", inputs=[], outputs=[labels_path], params=params
+        ) as step:
+            if not step.cached:
+                write_label_layers(src_path, labels_path, shapes, n_jobs=n_jobs)
+
+        row_areas = pixel_row_areas(transform, crs, height)
+        size = (len(keys) + 1) * n_values
+
+        def histogram(block, values, labels):
+            valid = (values >= 0) & (values < n_values)
+            if nodata is not None:
+                valid &= values != nodata
+            values = values[valid].astype(np.int64)
+            weights = np.broadcast_to(
+                row_areas[block.row_off : block.row_off + block.height, np.newaxis],
+                valid.shape,
+            )[valid]
+            # Each label is on a single layer, so layers can be added up
+            hist = np.zeros(size)
+            for layer in labels:
+                hist += np.bincount(
+                    layer[valid].astype(np.int64) * n_values + values,
+                    weights=weights,
+                    minlength=size,
+                )
+            return hist
+
+        hist = reduce_blocks(
+            histogram,
+            [src_path, labels_path],
+            indexes=[1, None],
+            pass_window=True,
+            n_jobs=n_jobs,
+            desc="zonal areas",
+        )
+
+    # First row (label 0) are pixels outside of any geometry
+    hist = hist.reshape(len(keys) + 1, n_values)[1:]
+    return {
+        key: {int(v): float(hist[i, v]) for v in np.flatnonzero(hist[i])}
+        for i, key in enumerate(keys)
+    }
+
+
+def write_label_layers(src_path, dst_path, shapes, *, n_jobs=None):
+    """
+    Rasterize +shapes+ onto the grid of raster +src_path+, into +dst_path+.
+    Pixels inside shape `i` are labeled `i + 1` (0 is outside any shape), on
+    one of the bands of the output.
+
+    """
+    layers = pack_layers(shapes)
+    n_layers = max(layers) + 1 if layers else 1
+    logger.info("Rasterize %d shapes into %d label layers", len(shapes), n_layers)
+    # STRtree queries return geometries, so map them back to their labels
+    labels = {id(s): i + 1 for i, s in enumerate(shapes)}
+    trees = [
+        STRtree([s for s, l in zip(shapes, layers) if l == layer])
+        for layer in range(n_layers)
+    ]
+
+    dtype = "uint16" if len(shapes) < 2 ** 16 else "uint32"
+    with rasterio.open(src_path) as src:
+        transform = src.transform
+
+    def rasterize_block(block, _):
+        bbox = box(*window_bounds(block, transform))
+        imgs = np.zeros((n_layers, block.height, block.width), dtype=dtype)
+        for layer, tree in enumerate(trees):
+            hits = tree.query(bbox)
+            if not hits:
+                continue
+            imgs[layer] = rasterize(
+                [(s, labels[id(s)]) for s in hits],
+                out_shape=(block.height, block.width),
+                transform=window_transform(block, transform),
+                fill=0,
+                dtype=dtype,
+            )
+        return imgs
+
+    process_blocks(
+        rasterize_block,
+        [src_path],
+        [dst_path],
+        indexes=[1],
+        profiles=[dict(count=n_layers, dtype=dtype, nodata=None, predictor=2)],
+        pass_window=True,
+        n_jobs=n_jobs,
+        desc="label layers",
+    )
+
+
+def pack_layers(shapes):
+    """
+    Greedily assign each of +shapes+ to a layer, so that shapes on the same
+    layer do not overlap (they can touch).  Larger shapes are assigned first.
+
+    Returns the layer index of each shape.
+
+    """
+    tree = STRtree(shapes)
+    idxs = {id(s): i for i, s in enumerate(shapes)}
+    layers = [None for _ in shapes]
+    for i in sorted(range(len(shapes)), key=lambda i: -shapes[i].area):
+        # Candidates only have intersecting bounds, so check them
+        taken = set()
+        for other in tree.query(shapes[i]):
+            layer = layers[idxs[id(other)]]
+            if (
+                layer is not None
+                and shapes[i].intersects(other)
+                and not shapes[i].touches(other)
+            ):
+                taken.add(layer)
+        layer = 0
+        while layer in taken:
+            layer += 1
+        layers[i] = layer
+    return layers
+
+
+def pixel_row_areas(transform, crs, height):
+    """Area of pixels of each row of a raster, in square meters"""
+    if crs.is_geographic:
+        # Area of a cell between two parallels, on a sphere
+        lats = np.radians(transform.f + transform.e * np.arange(height + 1))
+        return (
+            EARTH_RADIUS ** 2
+            * abs(math.radians(transform.a))
+            * np.abs(np.diff(np.sin(lats)))
+        )
+    _, factor = crs.linear_units_factor
+    area = abs(transform.a * transform.e - transform.b * transform.d) * factor ** 2
+    return np.full(height, area)
@@ -4,9 +4,10 @@ import tempfile
 from datetime import datetime
 import shapely
 
+from django.conf import settings
 from django.db import connection
 from django.db.models import Q
-from django.http import FileResponse
+from django.http import FileResponse, HttpResponse
 from jobs.utils import enqueue_job
 from paramiko.ssh_exception import AuthenticationException
 from rest_framework import permissions, status, viewsets
@@ -28,6 +29,23 @@ from .serializers import (
     RasterSerializer,
 )
 
+# Cache of dynamic tiles (see `get_tile_cache`)
+_tile_cache = None
+
+
+def get_tile_cache():
+    """Return the cache of dynamic tiles, created on first use"""
+    from .tiles import TileCache
+
+    global _tile_cache
+    if _tile_cache is None:
+        _tile_cache = TileCache(
+            settings.DYNAMIC_TILES_CACHE_DIR,
+            max_items=settings.DYNAMIC_TILES_MEMORY_CACHE_SIZE,
+            max_size=settings.DYNAMIC_TILES_CACHE_SIZE * 1024 * 1024,
+        )
+    return _tile_cache
+
 
 # @deprecated
 def select_mask_areas_by_scope(**params):
@@ -50,11 +68,18 @@ def select_mask_areas_by_scope(**params):
 
 
 def select_mask_areas_by_geom(**params):
+    # Intersect only the projected mask parts that overlap the geometry
     query = """
-        SELECT m.id, m.kind, m.date, ST_Area(ST_Transform(
-            ST_Intersection(m.geom, ST_GeomFromText(%(geom_wkt)s, 4326)), %(srid)s)) AS area
+        SELECT m.id, m.kind, m.date,
+            COALESCE(SUM(ST_Area(ST_Intersection(p.geom, g.geom))), 0) AS area
         FROM eo_sensors_coveragemask AS m
+        CROSS JOIN (
+            SELECT ST_Transform(ST_GeomFromText(%(geom_wkt)s, 4326), %(srid)s) AS geom
+        ) AS g
+        LEFT JOIN eo_sensors_coveragemaskpart AS p
+            ON p.mask_id = m.id AND p.geom && g.geom
         WHERE m.date BETWEEN %(date_from)s AND %(date_to)s
+        GROUP BY m.id, m.kind, m.date
         """
     with connection.cursor() as cursor:
         cursor.execute(query, dict(srid=32718, **params))
@@ -154,6 +179,60 @@ class RasterViewSet(viewsets.ReadOnlyModelViewSet):
         return queryset
 
 
+class RasterTileView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, pk, z, x, y):
+        # Tiles are rendered with rasterio, which is only required when
+        # dynamic tiles are enabled
+        from .tiles import render_tile
+
+        raster = Raster.objects.filter(pk=int(pk)).first()
+
+        if not raster or not raster.file:
+            raise NotFound(detail=None, code=None)
+
+        # Include raster version in key, so that tiles from a replaced raster
+        # file are not served from cache
+        key = f"{raster.pk}/{raster.tiles_version()}/{z}/{x}/{y}.png"
+        tile_cache = get_tile_cache()
+        data = tile_cache.get(key)
+        if data is None:
+            data = render_tile(raster.file.path, int(x), int(y), int(z))
+            tile_cache.set(key, data)
+
+        response = HttpResponse(data, content_type="image/png")
+        # Tile URLs change with the raster version (see `Raster.tiles_url`)
+        response["Cache-Control"] = "public, max-age=86400"
+        return response
+
+
+class RasterArchiveTileView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, pk, z, x, y):
+        from .tiles import empty_tile, read_mbtiles_tile
+
+        raster = Raster.objects.filter(pk=int(pk)).first()
+
+        if not raster:
+            raise NotFound(detail=None, code=None)
+
+        archive_path = raster.tiles_archive_path()
+        if not os.path.exists(archive_path):
+            raise NotFound(detail=None, code=None)
+
+        # Fully transparent tiles are not stored in archive
+        data = read_mbtiles_tile(archive_path, int(x), int(y), int(z))
+        if data is None:
+            data = empty_tile()
+
+        response = HttpResponse(data, content_type="image/png")
+        # Tile URLs change with the raster version (see `Raster.tiles_url`)
+        response["Cache-Control"] = "public, max-age=86400"
+        return response
+
+
 class RasterDownloadView(APIView):
     renderer_classes = (BinaryFileRenderer,)
 
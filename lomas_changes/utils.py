@@ -243,17 +243,19 @@ def generate_raster_tiles(raster, zoom_range=(4, 18)):
     # First, download file from storage to temporary local file
     with tempfile.NamedTemporaryFile() as tmpfile:
         shutil.copyfileobj(raster.file, tmpfile)
+        tmpfile.flush()
         src = tmpfile.name
 
         from_zoom, to_zoom = zoom_range
         zoom_range = '{}-{}'.format(from_zoom, to_zoom)
 
         # Create destination directory
-        tiles_dir = os.path.join(settings.TILES_DIR, raster.path)
+        tiles_dir = os.path.join(settings.TILES_DIR, raster.path())
         os.makedirs(tiles_dir, exist_ok=True)
 
-        # Use gdal2tiles to generate raster tiles
-        cmd = '{gdal2tiles} -e -w none -n -z {zoom_range} {src} {dst}'.format(
+        # Use gdal2tiles to generate raster tiles.  Masks are mostly empty or
+        # uniform, so skip transparent tiles and store duplicated tiles once.
+        cmd = '{gdal2tiles} -e --skip-blank --dedup -w none -n -z {zoom_range} {src} {dst}'.format(
             gdal2tiles=settings.GDAL2TILES_BIN_PATH,
             zoom_range=zoom_range,
             src=tmpfile.name,
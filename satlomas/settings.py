@@ -253,6 +253,25 @@ CACHES = {
 
 TILES_DIR = os.path.join(MEDIA_ROOT, "tiles")
 TILE_SERVER_URL = os.getenv("TILE_SERVER_URL", "http://localhost:8000/media/tiles/")
+# Format of pre-rendered tiles: "dir" for a directory of PNG files per raster,
+# or "mbtiles" for a single MBTiles archive per raster
+TILES_FORMAT = os.getenv("TILES_FORMAT", "dir")
+
+# Dynamic tiles: render tiles on demand from raster files instead of
+# pre-rendering all zoom levels when creating a raster
+DYNAMIC_TILES = int(os.getenv("DYNAMIC_TILES", 0)) > 0
+DYNAMIC_TILE_SERVER_URL = os.getenv(
+    "DYNAMIC_TILE_SERVER_URL", "http://localhost:8000/eo-sensors/rasters/"
+)
+DYNAMIC_TILES_CACHE_DIR = os.getenv(
+    "DYNAMIC_TILES_CACHE_DIR", os.path.join(DATA_DIR, "tiles_cache")
+)
+# Maximum size of dynamic tiles disk cache (in MB)
+DYNAMIC_TILES_CACHE_SIZE = int(os.getenv("DYNAMIC_TILES_CACHE_SIZE", 1024))
+# Maximum number of dynamic tiles kept in memory, per process
+DYNAMIC_TILES_MEMORY_CACHE_SIZE = int(
+    os.getenv("DYNAMIC_TILES_MEMORY_CACHE_SIZE", 1000)
+)
 
 REST_AUTH_SERIALIZERS = {
     "PASSWORD_RESET_SERIALIZER": "satlomas.serializers.PasswordResetSerializer"
@@ -276,3 +295,20 @@ RUN_AFTER_ENQUEUE_PROC_JOB = os.getenv("RUN_AFTER_ENQUEUE_PROC_JOB")
 EO_SENSORS_TASKS_DATA_DIR = os.getenv(
     "EO_SENSORS_TASKS_DATA_DIR", os.path.join(BASE_DIR, "data", "eo_sensors")
 )
+
+# Content-addressed cache of processing steps, and its maximum size (in MB)
+EO_SENSORS_STEP_CACHE_DIR = os.getenv(
+    "EO_SENSORS_STEP_CACHE_DIR", os.path.join(EO_SENSORS_TASKS_DATA_DIR, "step_cache")
+)
+EO_SENSORS_STEP_CACHE_SIZE = int(os.getenv("EO_SENSORS_STEP_CACHE_SIZE", 51200))
+
+# Engine used to measure coverage masks on each scope: "vector" intersects
+# mask and scope polygons, "raster" counts pixels of the coverage raster on
+# rasterized scopes (much faster for high-resolution masks)
+EO_SENSORS_MEASUREMENTS_ENGINE = os.getenv("EO_SENSORS_MEASUREMENTS_ENGINE", "vector")
+
+# Maximum number of parallel workers the database can use for each step of
+# the measurements query
+EO_SENSORS_MEASUREMENTS_DB_WORKERS = int(
+    os.getenv("EO_SENSORS_MEASUREMENTS_DB_WORKERS", 4)
+)
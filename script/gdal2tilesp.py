@@ -69,17 +69,23 @@ except:
 
 import os
 import math
+import hashlib
+import json
+
+import numpy
 
 try:
 	from PIL import Image
-	import numpy
 	import osgeo.gdal_array as gdalarray
 except:
 	# 'antialias' resampling is not available
 	pass
 
+import atexit
 import multiprocessing
+import shutil
 import traceback
+from queue import Empty
 import tempfile
 from optparse import OptionParser, OptionGroup
 
@@ -89,8 +95,6 @@ resampling_list = ('average', 'near', 'bilinear', 'cubic', 'cubicspline', 'lancz
 profile_list = ('mercator', 'geodetic', 'raster')  # ,'zoomify')
 webviewer_list = ('all', 'google', 'openlayers', 'leaflet', 'index', 'metadata', 'none')
 
-queue = multiprocessing.Queue()
-tcount = 0
 # =============================================================================
 # =============================================================================
 # =============================================================================
@@ -586,6 +590,10 @@ class GDAL2Tiles(object):
 		if self.options.output_cache not in ('tms', 'xyz'):
 			self.error("Accepted formats for output cache are 'xyz' or 'tms'")
 
+		# Batches must be aligned with the tiles of the upper zoom levels
+		if self.options.batch_size < 1 or self.options.batch_size & (self.options.batch_size - 1):
+			self.error("Batch size must be a power of two")
+
 		# Workaround for old versions of GDAL
 		try:
 			if (self.options.verbose and self.options.resampling == 'near') or gdal.TermProgress_nocb:
@@ -708,9 +716,18 @@ class GDAL2Tiles(object):
 					 help="NODATA transparency value to assign to the input data")
 		p.add_option('--processes', dest='processes', type='int', default=multiprocessing.cpu_count(),
 					 help='Number of concurrent processes (defaults to the number of cores in the system)')
+		p.add_option('--batch-size', dest='batch_size', type='int', default=4,
+					 help='Side, in tiles, of the square batches handed out to the worker processes, a power of two (default 4). '
+						  'Overviews inside a batch are built in memory.')
 		p.add_option("-v", "--verbose",
 					 action="store_true", dest="verbose",
 					 help="Print status messages to stdout")
+		p.add_option('--skip-blank', dest='skip_blank', action='store_true',
+					 help="Do not write fully transparent tiles. Missing tiles are treated as transparent when building overviews.")
+		p.add_option('--stats', dest='stats', metavar="FILE",
+					 help="Write the number of tiles and elapsed time of each wave of zoom levels as JSON into FILE")
+		p.add_option('--dedup', dest='dedup', action='store_true',
+					 help="Store tiles with identical content once (under .blobs/, removed when done) and hard link them into the pyramid.")
 
 		# KML options
 		g = OptionGroup(p, "KML (Google Earth) options", "Options for generated Google Earth SuperOverlay metadata")
@@ -755,7 +772,7 @@ class GDAL2Tiles(object):
 		p.set_defaults(verbose=False, profile="mercator", kml=False, url='',
 					   webviewer='all', copyright='', resampling='average', resume=False,
 					   googlekey='INSERT_YOUR_KEY_HERE', yahookey='INSERT_YOUR_YAHOO_APP_ID_HERE', aux_files=False,
-					   output_format="PNG", output_cache="xyz")
+					   output_format="PNG", output_cache="xyz", skip_blank=False, dedup=False)
 
 		self.parser = p
 
@@ -1243,327 +1260,284 @@ class GDAL2Tiles(object):
 					f.close()
 
 	# -------------------------------------------------------------------------
-	def generate_base_tiles(self, cpu, queue):
-		"""Generation of the base tiles (the lowest in the pyramid) directly from the input raster"""
+	def tile_batches(self, tz, batchsize):
+		"""Splits the tiles of zoom level tz into square batches of batchsize x batchsize tiles.
+		Batches are aligned to multiples of batchsize, so each of them maps to a single batch
+		of the upper zoom level."""
 
-		if self.options.verbose:
-			# mx, my = self.out_gt[0], self.out_gt[3] # OriginX, OriginY
-			# px, py = self.mercator.MetersToPixels( mx, my, self.tmaxz)
-			# print "Pixel coordinates:", px, py, (mx, my)
-			print('')
-			print("Tiles generated from the max zoom level:")
-			print("----------------------------------------")
-			print('')
+		tminx, tminy, tmaxx, tmaxy = self.tminmax[tz]
+		for by in range(tmaxy // batchsize, tminy // batchsize - 1, -1):
+			for bx in range(tminx // batchsize, tmaxx // batchsize + 1):
+				tiles = []
+				for ty in range(min(tmaxy, (by + 1) * batchsize - 1), max(tminy, by * batchsize) - 1, -1):
+					for tx in range(max(tminx, bx * batchsize), min(tmaxx, (bx + 1) * batchsize - 1) + 1):
+						tiles.append((tx, ty))
+				yield tiles
+
+	# -------------------------------------------------------------------------
+	def wave_minz(self, tz):
+		"""Returns the lowest zoom level that is built from batches of zoom level tz,
+		that is, log2(batch size) levels above it"""
+
+		levels = int(math.log(self.options.batch_size, 2))
+		return max(self.tminz, tz - levels)
 
-		# Set the bounds
-		tminx, tminy, tmaxx, tmaxy = self.tminmax[self.tmaxz]
+	# -------------------------------------------------------------------------
+	def tile_filename(self, tx, ty, tz):
+		"""Returns the path of tile tx, ty, tz inside the output directory"""
 
-		# Just the center tile
-		# tminx = tminx+ (tmaxx - tminx)/2
-		# tminy = tminy+ (tmaxy - tminy)/2
-		# tmaxx = tminx
-		# tmaxy = tminy
+		if self.options.output_cache == 'xyz':
+			ty_final = (2 ** tz - 1) - ty
+		else:
+			ty_final = ty
+		return os.path.join(self.output, str(tz), str(tx), "%s.%s" % (ty_final, self.tileext))
+
+	# -------------------------------------------------------------------------
+	def generate_base_tile(self, tx, ty):
+		"""Generation of a base tile (the lowest in the pyramid) directly from the input raster.
+		Returns the tile as an array, or None if it is blank and was not written."""
 
 		ds = self.out_ds
 		tilebands = self.dataBandsCount + 1
 		querysize = self.querysize
+		tz = self.tmaxz
+		tminx, tminy, tmaxx, tmaxy = self.tminmax[tz]
 
+		tilefilename = self.tile_filename(tx, ty, tz)
+		if os.path.exists(os.path.abspath(tilefilename)):
+			# already exist
+			return self.read_tile(tilefilename, tilebands)
 		if self.options.verbose:
-			print("dataBandsCount: ", self.dataBandsCount)
-			print("tilebands: ", tilebands)
-
-		# print tminx, tminy, tmaxx, tmaxy
-		tcount = (1 + abs(tmaxx - tminx)) * (1 + abs(tmaxy - tminy))
-
-		queue.put(tcount)
-
-		ti = 0
+			print(tilefilename)  # , "( TileMapService: z / x / y )"
 
-		proc = []
-		j = 0
-		msg = ''
-		tz = self.tmaxz
-		count = (tmaxy - tminy + 1) * (tmaxx + 1 - tminx)
-		for ty in range(tmaxy, tminy - 1, -1):	# range(tminy, tmaxy+1):
-			for tx in range(tminx, tmaxx + 1):
-
-				if self.stopped:
-					break
-				ti += 1
-				if (ti - 1) % self.options.processes != cpu:
-					continue
+		# Create directories for the tile
+		if not os.path.exists(os.path.dirname(tilefilename)):
+			try:
+				os.makedirs(os.path.dirname(tilefilename))
+			except OSError:
+				pass
 
-				if self.options.output_cache == 'xyz':
-					ty_final = (2 ** tz - 1) - ty
-				else:
-					ty_final = ty
-				# my addons
-				tilefilename = os.path.join(self.output, str(tz), str(tx), "%s.%s" % (ty_final, self.tileext))
-				if os.path.exists(os.path.abspath(tilefilename)):
-					# already exist
-					continue
-				if self.options.verbose:
-					print(ti, '/', tcount, tilefilename)  # , "( TileMapService: z / x / y )"
+		if self.options.profile == 'mercator':
+			# Tile bounds in EPSG:900913
+			b = self.mercator.TileBounds(tx, ty, tz)
+		elif self.options.profile == 'geodetic':
+			b = self.geodetic.TileBounds(tx, ty, tz)
 
-				if self.options.resume and os.path.exists(tilefilename):
-					if self.options.verbose:
-						print("Tile generation skiped because of --resume")
-					else:
-						queue.put(tcount)
-					continue
-				# print queue.qsize()
-				# Create directories for the tile
-				if not os.path.exists(os.path.dirname(tilefilename)):
-					os.makedirs(os.path.dirname(tilefilename))
+		# print "\tgdalwarp -ts 256 256 -te %s %s %s %s %s %s_%s_%s.tif" % ( b[0], b[1], b[2], b[3], "tiles.vrt", tz, tx, ty)
 
-				if self.options.profile == 'mercator':
-					# Tile bounds in EPSG:900913
-					b = self.mercator.TileBounds(tx, ty, tz)
-				elif self.options.profile == 'geodetic':
-					b = self.geodetic.TileBounds(tx, ty, tz)
+		# Don't scale up by nearest neighbour, better change the querysize
+		# to the native resolution (and return smaller query tile) for scaling
 
-				# print "\tgdalwarp -ts 256 256 -te %s %s %s %s %s %s_%s_%s.tif" % ( b[0], b[1], b[2], b[3], "tiles.vrt", tz, tx, ty)
+		if self.options.profile in ('mercator', 'geodetic'):
+			rb, wb = self.geo_query(ds, b[0], b[3], b[2], b[1])
+			nativesize = wb[0] + wb[2]	# Pixel size in the raster covering query geo extent
+			if self.options.verbose:
+				print("\tNative Extent (querysize", nativesize, "): ", rb, wb)
+
+			# Tile bounds in raster coordinates for ReadRaster query
+			rb, wb = self.geo_query(ds, b[0], b[3], b[2], b[1], querysize=querysize)
+
+			rx, ry, rxsize, rysize = rb
+			wx, wy, wxsize, wysize = wb
+
+		else:  # 'raster' profile:
+
+			tsize = int(self.tsize[tz])	 # tilesize in raster coordinates for actual zoom
+			xsize = self.out_ds.RasterXSize	 # size of the raster in pixels
+			ysize = self.out_ds.RasterYSize
+			if tz >= self.nativezoom:
+				querysize = self.tilesize  # int(2**(self.nativezoom-tz) * self.tilesize)
+
+			rx = (tx) * tsize
+			rxsize = 0
+			if tx == tmaxx:
+				rxsize = xsize % tsize
+			if rxsize == 0:
+				rxsize = tsize
+
+			rysize = 0
+			if ty == tmaxy:
+				rysize = ysize % tsize
+			if rysize == 0:
+				rysize = tsize
+			ry = ysize - (ty * tsize) - rysize
+
+			wx, wy = 0, 0
+			wxsize, wysize = int(rxsize / float(tsize) * self.tilesize), int(
+					rysize / float(tsize) * self.tilesize)
+			if wysize != self.tilesize:
+				wy = self.tilesize - wysize
 
-				# Don't scale up by nearest neighbour, better change the querysize
-				# to the native resolution (and return smaller query tile) for scaling
+		if self.options.verbose:
+			print("\tReadRaster Extent: ", (rx, ry, rxsize, rysize), (wx, wy, wxsize, wysize))
 
-				if self.options.profile in ('mercator', 'geodetic'):
-					rb, wb = self.geo_query(ds, b[0], b[3], b[2], b[1])
-					nativesize = wb[0] + wb[2]	# Pixel size in the raster covering query geo extent
-					if self.options.verbose:
-						print("\tNative Extent (querysize", nativesize, "): ", rb, wb)
-
-					# Tile bounds in raster coordinates for ReadRaster query
-					rb, wb = self.geo_query(ds, b[0], b[3], b[2], b[1], querysize=querysize)
-
-					rx, ry, rxsize, rysize = rb
-					wx, wy, wxsize, wysize = wb
-
-				else:  # 'raster' profile:
-
-					tsize = int(self.tsize[tz])	 # tilesize in raster coordinates for actual zoom
-					xsize = self.out_ds.RasterXSize	 # size of the raster in pixels
-					ysize = self.out_ds.RasterYSize
-					if tz >= self.nativezoom:
-						querysize = self.tilesize  # int(2**(self.nativezoom-tz) * self.tilesize)
-
-					rx = (tx) * tsize
-					rxsize = 0
-					if tx == tmaxx:
-						rxsize = xsize % tsize
-					if rxsize == 0:
-						rxsize = tsize
-
-					rysize = 0
-					if ty == tmaxy:
-						rysize = ysize % tsize
-					if rysize == 0:
-						rysize = tsize
-					ry = ysize - (ty * tsize) - rysize
-
-					wx, wy = 0, 0
-					wxsize, wysize = int(rxsize / float(tsize) * self.tilesize), int(
-							rysize / float(tsize) * self.tilesize)
-					if wysize != self.tilesize:
-						wy = self.tilesize - wysize
-
-				if self.options.verbose:
-					print("\tReadRaster Extent: ", (rx, ry, rxsize, rysize), (wx, wy, wxsize, wysize))
-
-				# Query is in 'nearest neighbour' but can be bigger in then the tilesize
-				# We scale down the query to the tilesize by supplied algorithm.
-
-				# Tile dataset in memory
-				dstile = self.mem_drv.Create('', self.tilesize, self.tilesize, tilebands)
-				data = ds.ReadRaster(rx, ry, rxsize, rysize, wxsize, wysize,
-									 band_list=list(range(1, self.dataBandsCount + 1)))
-				alpha = self.alphaband.ReadRaster(rx, ry, rxsize, rysize, wxsize, wysize)
-
-				if self.tilesize == querysize:
-					# Use the ReadRaster result directly in tiles ('nearest neighbour' query)
-					dstile.WriteRaster(wx, wy, wxsize, wysize, data, band_list=list(range(1, self.dataBandsCount + 1)))
-					dstile.WriteRaster(wx, wy, wxsize, wysize, alpha, band_list=[tilebands])
-
-				# Note: For source drivers based on WaveLet compression (JPEG2000, ECW, MrSID)
-				# the ReadRaster function returns high-quality raster (not ugly nearest neighbour)
-				# TODO: Use directly 'near' for WaveLet files
-				else:
-					# Big ReadRaster query in memory scaled to the tilesize - all but 'near' algo
-					dsquery = self.mem_drv.Create('', querysize, querysize, tilebands)
-					# TODO: fill the null value in case a tile without alpha is produced (now only png tiles are supported)
-					# for i in range(1, tilebands+1):
-					#	dsquery.GetRasterBand(1).Fill(tilenodata)
-					dsquery.WriteRaster(wx, wy, wxsize, wysize, data, band_list=list(range(1, self.dataBandsCount + 1)))
-					dsquery.WriteRaster(wx, wy, wxsize, wysize, alpha, band_list=[tilebands])
+		# Query is in 'nearest neighbour' but can be bigger in then the tilesize
+		# We scale down the query to the tilesize by supplied algorithm.
 
-					self.scale_query_to_tile(dsquery, dstile, tilefilename)
-					del dsquery
+		# Tile dataset in memory
+		dstile = self.mem_drv.Create('', self.tilesize, self.tilesize, tilebands)
+		data = ds.ReadRaster(rx, ry, rxsize, rysize, wxsize, wysize,
+							 band_list=list(range(1, self.dataBandsCount + 1)))
+		alpha = self.alphaband.ReadRaster(rx, ry, rxsize, rysize, wxsize, wysize)
 
-				del data
+		if self.tilesize == querysize:
+			# Use the ReadRaster result directly in tiles ('nearest neighbour' query)
+			dstile.WriteRaster(wx, wy, wxsize, wysize, data, band_list=list(range(1, self.dataBandsCount + 1)))
+			dstile.WriteRaster(wx, wy, wxsize, wysize, alpha, band_list=[tilebands])
 
-				if self.options.resampling != 'antialias':
-					# Write a copy of tile to png/jpg
-					self.out_drv.CreateCopy(tilefilename, dstile, strict=0)
+		# Note: For source drivers based on WaveLet compression (JPEG2000, ECW, MrSID)
+		# the ReadRaster function returns high-quality raster (not ugly nearest neighbour)
+		# TODO: Use directly 'near' for WaveLet files
+		else:
+			# Big ReadRaster query in memory scaled to the tilesize - all but 'near' algo
+			dsquery = self.mem_drv.Create('', querysize, querysize, tilebands)
+			# TODO: fill the null value in case a tile without alpha is produced (now only png tiles are supported)
+			# for i in range(1, tilebands+1):
+			#	dsquery.GetRasterBand(1).Fill(tilenodata)
+			dsquery.WriteRaster(wx, wy, wxsize, wysize, data, band_list=list(range(1, self.dataBandsCount + 1)))
+			dsquery.WriteRaster(wx, wy, wxsize, wysize, alpha, band_list=[tilebands])
+
+			self.scale_query_to_tile(dsquery, dstile, tilefilename)
+			del dsquery
+
+		del data
+
+		if self.options.resampling != 'antialias':
+			# Write a copy of tile to png/jpg
+			if self.write_tile(dstile, tilefilename):
+				tile = self.dataset_array(dstile)
+			else:
+				tile = None
+		else:
+			tile = self.read_tile(tilefilename, tilebands)
 
-				del dstile
+		del dstile
 
-				# Create a KML file for this tile.
-				if self.kml:
-					kmlfilename = os.path.join(self.output, str(tz), str(tx), '%d.kml' % ty)
-					if not self.options.resume or not os.path.exists(kmlfilename):
-						f = open(kmlfilename, 'w')
-						f.write(self.generate_kml(tx, ty, tz))
-						f.close()
+		# Create a KML file for this tile.
+		if self.kml:
+			kmlfilename = os.path.join(self.output, str(tz), str(tx), '%d.kml' % ty)
+			if not self.options.resume or not os.path.exists(kmlfilename):
+				f = open(kmlfilename, 'w')
+				f.write(self.generate_kml(tx, ty, tz))
+				f.close()
 
-				if not self.options.verbose:
-					queue.put(tcount)
+		return tile
 
 	# -------------------------------------------------------------------------
-	def generate_overview_tiles(self, cpu, tz, queue):
-		"""Generation of the overview tiles (higher in the pyramid) based on existing tiles"""
+	def generate_overview_tile(self, tx, ty, tz, children=None):
+		"""Generation of an overview tile (higher in the pyramid) from the four underlying tiles of zoom tz + 1.
+		children maps (x, y) of already decoded underlying tiles to their arrays (None for blank tiles),
+		the ones not in it are read from disk. Returns the tile as an array, or None if it is blank
+		and was not written."""
 
 		tilebands = self.dataBandsCount + 1
+		tilesize = self.tilesize
 
-		# Usage of existing tiles: from 4 underlying tiles generate one as overview.
+		# TODO: improve that
+		if self.out_drv.ShortName == 'JPEG' and tilebands == 4:
+			tilebands = 3
 
-		tcount = 0
-		for z in range(self.tmaxz - 1, self.tminz - 1, -1):
-			tminx, tminy, tmaxx, tmaxy = self.tminmax[z]
-			tcount += (1 + abs(tmaxx - tminx)) * (1 + abs(tmaxy - tminy))
+		tilefilename = self.tile_filename(tx, ty, tz)
+		if os.path.exists(os.path.abspath(tilefilename)):
+			# print 'overview tile already exsist'
+			return self.read_tile(tilefilename, tilebands)
+		if self.options.verbose:
+			print(tilefilename)  # , "( TileMapService: z / x / y )"
 
-		ti = 0
+		# Create directories for the tile
+		if not os.path.exists(os.path.dirname(tilefilename)):
+			try:
+				os.makedirs(os.path.dirname(tilefilename))
+			except OSError:
+				pass
 
-		# querysize = tilesize * 2
+		# Missing or blank underlying tiles are left transparent
+		query = numpy.zeros((tilebands, 2 * tilesize, 2 * tilesize), dtype=numpy.uint8)
+		childlist = []
+		minx, miny, maxx, maxy = self.tminmax[tz + 1]
+		for y in range(2 * ty, 2 * ty + 2):
+			for x in range(2 * tx, 2 * tx + 2):
+				if x < minx or x > maxx or y < miny or y > maxy:
+					continue
+				if children is not None and (x, y) in children:
+					array = children[(x, y)]
+				else:
+					array = self.read_tile(self.tile_filename(x, y, tz + 1), tilebands)
+				if array is None:
+					continue
+				# Tile rows grow northwards, so the upper child goes on top
+				tileposy = 0 if y == 2 * ty + 1 else tilesize
+				tileposx = (x - 2 * tx) * tilesize
+				query[:, tileposy:tileposy + tilesize, tileposx:tileposx + tilesize] = array[:tilebands]
+				childlist.append([x, y, tz + 1])
 
-		msg = ''
-		tminx, tminy, tmaxx, tmaxy = self.tminmax[tz]
-		count = (tmaxy - tminy + 1) * (tmaxx + 1 - tminx)
-		for ty in range(tmaxy, tminy - 1, -1):	# range(tminy, tmaxy+1):
-			for tx in range(tminx, tmaxx + 1):
+		if self.options.skip_blank and not childlist:
+			# All four children are blank, so is this tile
+			return None
 
-				if self.stopped:
-					break
+		dstile = self.mem_drv.Create('', tilesize, tilesize, tilebands)
+		if self.options.resampling == 'average':
+			# 2x2 box filter, the same as RegenerateOverview() 'average' on a query twice the tile size
+			blocks = query.reshape(tilebands, tilesize, 2, tilesize, 2).astype(numpy.uint16)
+			tile = ((blocks.sum(axis=(2, 4)) + 2) // 4).astype(numpy.uint8)
+			for i in range(tilebands):
+				dstile.GetRasterBand(i + 1).WriteArray(tile[i])
+		else:
+			dsquery = self.mem_drv.Create('', 2 * tilesize, 2 * tilesize, tilebands)
+			for i in range(tilebands):
+				dsquery.GetRasterBand(i + 1).WriteArray(query[i])
+			self.scale_query_to_tile(dsquery, dstile, tilefilename)
+			del dsquery
+			tile = None
 
-				ti += 1
-				if (ti - 1) % self.options.processes != cpu:
-					continue
+		if self.options.resampling != 'antialias':
+			# Write a copy of tile to png/jpg
+			try:
+				written = self.write_tile(dstile, tilefilename)
+			except:
+				# can't copy
+				return None
+			if not written:
+				tile = None
+			elif tile is None:
+				tile = self.dataset_array(dstile)
+		else:
+			tile = self.read_tile(tilefilename, tilebands)
 
-				if self.options.output_cache == 'xyz':
-					ty_final = (2 ** tz - 1) - ty
-				else:
-					ty_final = ty
-				# My addition if
-				tilefilename = os.path.join(self.output, str(tz), str(tx), "%s.%s" % (ty_final, self.tileext))
-				if os.path.exists(os.path.abspath(tilefilename)):
-					# print 'overview tile already exsist'
-					continue
-				if self.options.verbose:
-					print(ti, '/', tcount, tilefilename)  # , "( TileMapService: z / x / y )"
+		if self.options.verbose:
+			print("\tbuild from zoom", tz + 1, " tiles:", (2 * tx, 2 * ty), (2 * tx + 1, 2 * ty),
+				  (2 * tx, 2 * ty + 1), (2 * tx + 1, 2 * ty + 1))
 
-				if self.options.resume and os.path.exists(tilefilename):
-					if self.options.verbose:
-						print("Tile generation skipped because of --resume")
-					else:
-						queue.put(tcount)
-					continue
+		# Create a KML file for this tile.
+		if self.kml:
+			f = open(os.path.join(self.output, '%d/%d/%d.kml' % (tz, tx, ty)), 'w')
+			f.write(self.generate_kml(tx, ty, tz, childlist))
+			f.close()
 
-				# Create directories for the tile
-				if not os.path.exists(os.path.dirname(tilefilename)):
-					try:
-						os.makedirs(os.path.dirname(tilefilename))
-					except:
-						pass
-
-				# TODO: improve that
-				if self.out_drv.ShortName == 'JPEG' and tilebands == 4:
-					tilebands = 3
-
-				dsquery = self.mem_drv.Create('', 2 * self.tilesize, 2 * self.tilesize, tilebands)
-				# TODO: fill the null value
-				# for i in range(1, tilebands+1):
-				#	dsquery.GetRasterBand(1).Fill(tilenodata)
-				dstile = self.mem_drv.Create('', self.tilesize, self.tilesize, tilebands)
-
-				# TODO: Implement more clever walking on the tiles with cache functionality
-				# probably walk should start with reading of four tiles from top left corner
-				# Hilbert curve...
-
-				children = []
-				# Read the tiles and write them to query window
-				for y in range(2 * ty, 2 * ty + 2):
-					for x in range(2 * tx, 2 * tx + 2):
-						minx, miny, maxx, maxy = self.tminmax[tz + 1]
-						if x >= minx and x <= maxx and y >= miny and y <= maxy:
-
-							if self.options.output_cache == 'xyz':
-								y_final = (2 ** (tz + 1) - 1) - y
-							else:
-								y_final = y
+		return tile
 
-							dsquerytile = gdal.Open(
-									os.path.join(self.output, str(tz + 1), str(x), "%s.%s" % (y_final, self.tileext)),
-									gdal.GA_ReadOnly)
-							if (ty == 0 and y == 1) or (ty != 0 and (y % (2 * ty)) != 0):
-								tileposy = 0
-							else:
-								tileposy = self.tilesize
-							if tx:
-								tileposx = x % (2 * tx) * self.tilesize
-							elif tx == 0 and x == 1:
-								tileposx = self.tilesize
-							else:
-								tileposx = 0
-							#WEBP tiles with zero alpha areas do not contain a alpha band.  We need to add one here and make it fully opaque  It will be saved again with no alpha channel for next zoom level by the libwepb driver if it contains no transparent areas 
-							if dsquerytile.RasterCount == 3 and tilebands == 4:
-								alpha = numpy.full((self.tilesize, self.tilesize),255, dtype=numpy.uint8)
-								tmp_ds = self.mem_drv.Create('', self.tilesize, self.tilesize, tilebands)
-								tmp_ds.GetRasterBand(1).SetColorInterpretation(gdal.GCI_RedBand)
-								tmp_ds.GetRasterBand(2).SetColorInterpretation(gdal.GCI_GreenBand)
-								tmp_ds.GetRasterBand(3).SetColorInterpretation(gdal.GCI_BlueBand)
-								tmp_ds.GetRasterBand(4).SetColorInterpretation(gdal.GCI_AlphaBand)
-								tmp_ds.GetRasterBand(1).WriteArray(dsquerytile.GetRasterBand(1).ReadAsArray())
-								tmp_ds.GetRasterBand(2).WriteArray(dsquerytile.GetRasterBand(2).ReadAsArray())
-								tmp_ds.GetRasterBand(3).WriteArray(dsquerytile.GetRasterBand(3).ReadAsArray())
-								tmp_ds.GetRasterBand(4).WriteArray(alpha)
-
-								dsquery.WriteRaster( tileposx, tileposy, self.tilesize, self.tilesize,
-												tmp_ds.ReadRaster(0,0,self.tilesize,self.tilesize),
-												band_list=list(range(1,tilebands+1)))
-							else :
-								dsquery.WriteRaster( tileposx, tileposy, self.tilesize, self.tilesize,
-												dsquerytile.ReadRaster(0,0,self.tilesize,self.tilesize),
-												band_list=list(range(1,tilebands+1)))
-							children.append([x, y, tz + 1])
-
-				self.scale_query_to_tile(dsquery, dstile, tilefilename)
-				# Write a copy of tile to png/jpg
-				#
-				if self.options.resampling != 'antialias':
-					# Write a copy of tile to png/jpg
-					try:
-						self.out_drv.CreateCopy(tilefilename, dstile, strict=0)
-					except:
-						# can't copy
-						continue
-
-				# strict = 0
-				# p = multiprocessing.Process(target=self.out_drv.CreateCopy, args=[tilefilename, dstile, strict])
-				# p.start()
-				# p.join()
-
-				if self.options.verbose:
-					print("\tbuild from zoom", tz + 1, " tiles:", (2 * tx, 2 * ty), (2 * tx + 1, 2 * ty),
-						  (2 * tx, 2 * ty + 1), (2 * tx + 1, 2 * ty + 1))
-
-				# Create a KML file for this tile.
-				if self.kml:
-					f = open(os.path.join(self.output, '%d/%d/%d.kml' % (tz, tx, ty)), 'w')
-					f.write(self.generate_kml(tx, ty, tz, children))
-					f.close()
+	# -------------------------------------------------------------------------
+	def dataset_array(self, ds):
+		"""Returns all bands of dataset ds as a (bands, rows, cols) array"""
 
-				if not self.options.verbose:
-					queue.put(tcount)
-					pass
+		return numpy.stack([ds.GetRasterBand(i).ReadAsArray() for i in range(1, ds.RasterCount + 1)])
+
+	# -------------------------------------------------------------------------
+	def read_tile(self, tilefilename, tilebands):
+		"""Reads an already written tile as a (tilebands, tilesize, tilesize) array.
+		Returns None if the tile does not exist."""
+
+		if not os.path.exists(tilefilename):
+			return None
+		ds = gdal.Open(tilefilename, gdal.GA_ReadOnly)
+		if ds is None:
+			return None
+		array = self.dataset_array(ds)
+		if array.shape[0] < tilebands:
+			# WEBP tiles without transparent areas are saved without alpha band, make them fully opaque
+			alpha = numpy.full((tilebands - array.shape[0], self.tilesize, self.tilesize), 255, dtype=numpy.uint8)
+			array = numpy.concatenate([array, alpha])
+		return array
 
 	# -------------------------------------------------------------------------
 	def geo_query(self, ds, ulx, uly, lrx, lry, querysize=0):
@@ -1651,6 +1625,46 @@ class GDAL2Tiles(object):
 			if res != 0:
 				self.error("ReprojectImage() failed on %s, error %d" % (tilefilename, res))
 
+	# -------------------------------------------------------------------------
+	def write_tile(self, dstile, tilefilename):
+		"""Writes the tile dataset into tilefilename, honouring --skip-blank and --dedup.
+		Returns False if the tile was skipped because it is fully transparent."""
+
+		tilebands = dstile.RasterCount
+		if self.options.skip_blank and tilebands in (2, 4):
+			# Last band is alpha: check it before paying for the encoding
+			alpha = dstile.GetRasterBand(tilebands).ReadRaster(0, 0, self.tilesize, self.tilesize)
+			if alpha.count(b'\x00') == len(alpha):
+				return False
+
+		if not self.options.dedup:
+			self.out_drv.CreateCopy(tilefilename, dstile, strict=0)
+			return True
+
+		# Hash the raw pixels so that duplicated tiles are encoded only once
+		data = dstile.ReadRaster(0, 0, self.tilesize, self.tilesize)
+		digest = hashlib.sha1(data).hexdigest()
+		blobdir = os.path.join(self.output, '.blobs', digest[:2])
+		blobfilename = os.path.join(blobdir, "%s.%s" % (digest, self.tileext))
+		if not os.path.exists(blobfilename):
+			if not os.path.exists(blobdir):
+				try:
+					os.makedirs(blobdir)
+				except OSError:
+					pass
+			# Other processes may be writing the same blob, publish it atomically
+			tmpfilename = "%s.%d.tmp.%s" % (blobfilename, os.getpid(), self.tileext)
+			self.out_drv.CreateCopy(tmpfilename, dstile, strict=0)
+			os.rename(tmpfilename, blobfilename)
+		if os.path.exists(tilefilename):
+			os.unlink(tilefilename)
+		try:
+			os.link(blobfilename, tilefilename)
+		except OSError:
+			# Filesystem without hard links, fall back to a plain copy
+			self.out_drv.CreateCopy(tilefilename, dstile, strict=0)
+		return True
+
 	# -------------------------------------------------------------------------
 	def generate_tilemapresource(self):
 		"""
@@ -2649,28 +2663,45 @@ def worker_metadata(argv):
 	sys.stdout.flush()
 
 
-def worker_base_tiles(argv, cpu, queue):
+def worker_tiles(argv, task_queue, done_queue, worker):
+	"""Long-lived worker: pulls (tz, tiles) batches from task_queue until it gets None.
+	It reports to done_queue when it starts each batch, and when it finishes it, with
+	the number of processed tiles, or the traceback if the batch failed"""
 	gdal2tiles = GDAL2Tiles(argv[1:])
+	gdal2tiles.open_input()
 
-	try:
-		gdal2tiles.open_input()
-		gdal2tiles.generate_base_tiles(cpu, queue)
-	except:
-		print ('exception error: ', traceback.format_exc())
-
-
-def worker_overview_tiles(argv, cpu, tz, queue):
-	gdal2tiles = GDAL2Tiles(argv[1:])
-	try:
-		gdal2tiles.open_input()
-		gdal2tiles.generate_overview_tiles(cpu, tz, queue)
-	except RuntimeError:
-		print ('Something Wrong: ', traceback.format_exc())
-		pass
+	while True:
+		task = task_queue.get()
+		if task is None:
+			break
+		tz, tiles = task
+		done_queue.put(('start', worker, tz))
+		processed = 0
+		try:
+			level = {}
+			for tx, ty in tiles:
+				if gdal2tiles.stopped:
+					break
+				if tz == gdal2tiles.tmaxz:
+					level[(tx, ty)] = gdal2tiles.generate_base_tile(tx, ty)
+				else:
+					level[(tx, ty)] = gdal2tiles.generate_overview_tile(tx, ty, tz)
+			processed += len(level)
+
+			# Batches are aligned, so the overviews of the batch are built right away
+			# from the decoded tiles, without encoding and reading them back
+			for z in range(tz - 1, gdal2tiles.wave_minz(tz) - 1, -1):
+				parents = sorted(set((x // 2, y // 2) for x, y in level))
+				level = dict(((x, y), gdal2tiles.generate_overview_tile(x, y, z, children=level))
+							 for x, y in parents)
+				processed += len(level)
+		except Exception:
+			done_queue.put(('error', worker, traceback.format_exc()))
+			continue
+		done_queue.put(('done', worker, processed))
 
 
 if __name__ == '__main__':
-	queue = multiprocessing.Queue()
 	argv = gdal.GeneralCmdLineProcessor(sys.argv)
 
 	if argv:
@@ -2680,57 +2711,97 @@ if __name__ == '__main__':
 		else:
 			gdal.SetConfigOption("GDAL_PAM_ENABLED", "NO")
 
+		if gdal2tiles.options.dedup:
+			# Tiles are hard links to the blobs, which are only needed while
+			# rendering, so do not leave them in the (served) output directory
+			atexit.register(shutil.rmtree, os.path.join(gdal2tiles.output, '.blobs'),
+							ignore_errors=True)
+
 		p = multiprocessing.Process(target=worker_metadata, args=[argv])
 		p.start()
 		p.join()
 
-		print("Generating Base Tiles:")
-
-		proc_count = gdal2tiles.options.processes
+		# Zoom levels and tile ranges are needed to schedule the batches
+		gdal2tiles.open_input()
+		tminz = gdal2tiles.tminz
+		tmaxz = gdal2tiles.tmaxz
+		total = 0
+		for tz in range(tminz, tmaxz + 1):
+			tminx, tminy, tmaxx, tmaxy = gdal2tiles.tminmax[tz]
+			total += (1 + abs(tmaxx - tminx)) * (1 + abs(tmaxy - tminy))
+
+		# Workers pull small batches from a shared queue, so that processes that
+		# got sparse (mostly empty) areas keep taking work instead of idling
+		task_queue = multiprocessing.Queue()
+		# Do not wait for queued batches to be flushed when exiting on errors
+		task_queue.cancel_join_thread()
+		done_queue = multiprocessing.Queue()
 		procs = []
-		for cpu in range(proc_count):
-			proc = multiprocessing.Process(target=worker_base_tiles, args=(argv, cpu % proc_count, queue))
+		for worker in range(gdal2tiles.options.processes):
+			proc = multiprocessing.Process(target=worker_tiles,
+										   args=(argv, task_queue, done_queue, worker))
 			proc.daemon = True
 			proc.start()
 			procs.append(proc)
+
+		# Each zoom level is built from the one below, so levels run as waves: a
+		# wave covers a batch and the overviews built in memory from it, and the
+		# next wave is only queued once every batch of the current one is done
+		print("Generating Tiles:")
 		processed_tiles = 0
-		total = queue.get(timeout=1)
-		while (total - processed_tiles):
-			try:
-				total = queue.get_nowait()
-				processed_tiles += 1
-				gdal.TermProgress_nocb(processed_tiles / float(total))
+		waves = []
+		tz = tmaxz
+		while tz >= tminz:
+			wave_start = time.time()
+			wave_tiles = 0
+			pending = 0
+			for tiles in gdal2tiles.tile_batches(tz, gdal2tiles.options.batch_size):
+				task_queue.put((tz, tiles))
+				pending += 1
+
+			# Zoom level of the batch each worker is processing, if any. Workers only
+			# exit when told to, so one that died (e.g. killed for running out of
+			# memory) took its batch with it, and the wave would never finish
+			in_flight = {}
+			while pending:
+				try:
+					msg = done_queue.get(timeout=1)
+				except Empty:
+					for worker, proc in enumerate(procs):
+						if not proc.is_alive():
+							if worker in in_flight:
+								what = "a batch of zoom level %d" % in_flight[worker]
+							else:
+								what = "no batch"
+							gdal2tiles.error("Tile worker %d died (exit code %s), while "
+											 "processing %s" % (worker, proc.exitcode, what))
+					continue
+				kind, worker = msg[:2]
+				if kind == 'start':
+					in_flight[worker] = msg[2]
+					continue
+				if kind == 'error':
+					gdal2tiles.error("Tile worker %d failed on a batch of zoom level %d"
+									 % (worker, in_flight[worker]), msg[2])
+				del in_flight[worker]
+				done = msg[2]
+				pending -= 1
+				processed_tiles += done
+				wave_tiles += done
+				gdal.TermProgress_nocb(min(1.0, processed_tiles / float(total)))
 				sys.stdout.flush()
-			except:
-				proc.join(timeout=1)
 
-		[p.join() for p in procs]
+			waves.append(dict(zooms=[gdal2tiles.wave_minz(tz), tz], tiles=wave_tiles,
+							  seconds=time.time() - wave_start))
+			tz = gdal2tiles.wave_minz(tz) - 1
 
-		print("\n")
-		print("Generating Overview Tiles:")
-		#  Values generated after base tiles creation
-		tminz = gdal2tiles.tminz
-		tmaxz = gdal2tiles.tmaxz
-
-		processed_tiles = 0
-		for tz in range(tmaxz - 1, tminz - 1, -1):
-
-			procs = []
-			for cpu in range(proc_count):
-				proc = multiprocessing.Process(target=worker_overview_tiles, args=(argv, cpu % proc_count, tz, queue))
-				proc.daemon = True
-				proc.start()
-				procs.append(proc)
+		for proc in procs:
+			task_queue.put(None)
+		[p.join() for p in procs]
 
-			while len(multiprocessing.active_children()):
-				try:
-					total = queue.get(timeout=1)
-					processed_tiles += 1
-					gdal.TermProgress_nocb(processed_tiles / float(total))
-					sys.stdout.flush()
-				except:
-					pass
-			[p.join(timeout=1) for p in procs]
+		if gdal2tiles.options.stats:
+			with open(gdal2tiles.options.stats, 'w') as f:
+				json.dump(dict(tiles=processed_tiles, waves=waves), f)
 #############
 # vim:noet
 #############